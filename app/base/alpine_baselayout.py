@@ -1,18 +1,35 @@
 #!/usr/bin/env python3
 import os
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from core.logger import info, success, warning, error
 from utils.execute import run_command_live
+from utils.fsmeta import record_apk_installed
+from utils.pathfilter import prune_tree
 
 # >>> Deine neuen Utils werden HIER verwendet
-from utils.download import download_file, extract_archive, download_and_extract
+from utils.download import fetch_url
+from utils.archive import extract_tar
+from utils.apkindex import ApkIndex, read_apkindex
+from utils.shared_cache import SharedCache, default_cache
+
+
+# Wie main.py: work/ liegt neben app/, unabhängig vom aktuellen Verzeichnis
+WORK_DIR = Path(__file__).resolve().parent.parent / "work"
 
 
 class APKInstaller:
     """
     Installiert apk-tools in ein RootFS und initialisiert alpine-baselayout.
     Unterstützte Architekturen: x86_64, arm64
+
+    APKINDEX und .apk-Dateien liegen in einem persistenten Cache (gemeinsamer Cache, falls
+    gesetzt), der als lokales Repository dient: die Hülle wird aus dem APKINDEX berechnet,
+    fehlende Pakete werden parallel vorab geladen und apk.static läuft danach offline.
     """
 
     ALPINE_REPO = "https://dl-cdn.alpinelinux.org/alpine/latest-stable"
@@ -20,59 +37,132 @@ class APKInstaller:
         "x86_64": "x86_64",
         "arm64": "aarch64",
     }
+    REPOS = ("main",)
+    BASE_PACKAGES = ("alpine-baselayout", "busybox", "apk-tools")
+    INDEX_MAX_AGE = 6 * 3600  # Sekunden, danach wird der APKINDEX neu geladen
+    FETCH_WORKERS = 8
 
-    def __init__(self, rootfs_dir: Path, arch: str):
+    def __init__(self, rootfs_dir: Path, arch: str, meta=None, path_filter=None,
+                 cache_dir: Path | None = None, mirror: str | None = None, work_dir: Path | None = None):
         self.rootfs_dir = Path(rootfs_dir)
         self.arch = arch
+        self.meta = meta  # Optional: FSMetadata für Owner/Modi aus der apk-Datenbank
+        self.path_filter = path_filter  # Optional: PathFilter (apk.static kann nicht beim Entpacken filtern)
 
         if arch not in self.ARCH_MAPPING:
             raise ValueError(f"Unsupported architecture: {arch}")
 
         self.alpine_arch = self.ARCH_MAPPING[arch]
 
+        # Mirror: Parameter, sonst NEXUZCORE_ALPINE_MIRROR (z.B. lokales Verzeichnis in Tests)
+        self.mirror = (mirror or os.environ.get("NEXUZCORE_ALPINE_MIRROR") or self.ALPINE_REPO).rstrip("/")
+        # Cache: gemeinsamer Cache, sonst cache_dir, sonst <work_dir>/downloads/apk-cache
+        cache_dir = cache_dir or Path(work_dir or WORK_DIR).resolve() / "downloads" / "apk-cache"
+        self.cache = default_cache() or SharedCache(cache_dir)
+        self.cache_prefix = "apk/" + re.sub(r"[^A-Za-z0-9._-]+", "_", self.mirror).strip("_")
+
     def install(self):
         """Hauptfunktion zum Installieren von apk in das rootfs"""
-        info(f"[APK] Starte Installation für Architektur: {self.arch}")
+        info(f"[APK] Starte Installation für Architektur: {self.arch} (Mirror: {self.mirror})")
 
-        apk_static_path = self._download_and_extract_apk_tools()
+        index = self._load_index()
+        apk_static_path = self._download_and_extract_apk_tools(index)
 
         if not apk_static_path.exists():
             error("[APK] apk.static wurde nicht gefunden!")
             return False
 
-        self._init_apk_database(apk_static_path)
+        packages, missing = index.resolve(list(self.BASE_PACKAGES))
+        if missing:
+            warning(f"[APK] Nicht im APKINDEX: {', '.join(missing)}")
+        self._prefetch_packages(packages.values())
+
         self._write_repositories()
         self._install_base_packages(apk_static_path)
 
+        if self.path_filter:
+            removed = prune_tree(self.rootfs_dir, self.path_filter)
+            info(f"[APK] {removed} gefilterte Pfade entfernt (Profil: {self.path_filter.name}).")
+
+        if self.meta is not None:
+            record_apk_installed(self.meta, self.rootfs_dir, path_filter=self.path_filter)
+
         success("[APK] apk-tools erfolgreich in das RootFS installiert!")
         return True
 
+    def fetch_apk_static(self) -> Path:
+        """Nur apk.static aus dem upstream-Paket apk-tools-static (über den Cache), ohne RootFS-Installation"""
+        return self._download_and_extract_apk_tools(self._load_index())
+
+    # -------------------------------------------------------------
+    # Cache / lokales Repository
+    # -------------------------------------------------------------
+    def _key(self, repo: str, filename: str) -> str:
+        return f"{self.cache_prefix}/{repo}/{self.alpine_arch}/{filename}"
+
+    def _local_repo(self, repo: str) -> Path:
+        return self.cache.path(f"{self.cache_prefix}/{repo}")
+
+    def _remote(self, repo: str, filename: str) -> str:
+        return f"{self.mirror}/{repo}/{self.alpine_arch}/{filename}"
+
+    def _load_index(self) -> ApkIndex:
+        """APKINDEX pro Repo aus dem Cache (höchstens INDEX_MAX_AGE alt), offline notfalls auch älter"""
+        packages = []
+        for repo in self.REPOS:
+            key = self._key(repo, "APKINDEX.tar.gz")
+            fresh = lambda path: time.time() - path.stat().st_mtime < self.INDEX_MAX_AGE
+            try:
+                path = self.cache.fetch(key, lambda tmp: fetch_url(self._remote(repo, "APKINDEX.tar.gz"), tmp),
+                                        verify=fresh)
+            except Exception as e:
+                path = self.cache.path(key)
+                if not path.exists():
+                    raise RuntimeError(f"[APK] APKINDEX für {repo} nicht ladbar und nicht im Cache: {e}")
+                warning(f"[APK] APKINDEX für {repo} nicht aktualisierbar ({e}), nutze Cache-Stand.")
+
+            for pkg in read_apkindex(path):
+                pkg["repo"] = repo
+                packages.append(pkg)
+
+        info(f"[APK] APKINDEX: {len(packages)} Pakete")
+        return ApkIndex(packages)
+
+    def _fetch_package(self, pkg: dict) -> Path:
+        return self.cache.fetch(
+            self._key(pkg["repo"], pkg["filename"]),
+            lambda tmp: fetch_url(self._remote(pkg["repo"], pkg["filename"]), tmp),
+            verify=lambda path: not pkg.get("size") or path.stat().st_size == pkg["size"],
+        )
+
+    def _prefetch_packages(self, packages):
+        """Lädt alle fehlenden .apk-Dateien parallel in den Cache (Single-Flight zwischen Builds)"""
+        packages = list(packages)
+        before = self.cache.fetches
+        with ThreadPoolExecutor(max_workers=self.FETCH_WORKERS) as pool:
+            list(pool.map(self._fetch_package, packages))
+        info(f"[APK] {len(packages)} Pakete im Cache ({self.cache.fetches - before} neu geladen)")
+
     # -------------------------------------------------------------
     # Schritt 1: apk-tools-static herunterladen und extrahieren
     # -------------------------------------------------------------
-    def _download_and_extract_apk_tools(self) -> Path:
+    def _download_and_extract_apk_tools(self, index: ApkIndex) -> Path:
         info("[APK] Lade apk-tools-static herunter...")
 
-        # Die URL für STATIC apk-tools ist IMMER gleich, aber arch-spezifisch
-        url_main = f"{self.ALPINE_REPO}/main/{self.alpine_arch}/apk-tools-static-latest.apk"
-        mirrors = [
-            url_main,
-            url_main.replace("dl-cdn", "dl-4"),   # Mirror fallback
-            url_main.replace("dl-cdn", "dl-2"),
-        ]
-
-        download_dir = Path("downloads") / "apk-tools"
-        extract_dir = download_dir / f"extracted-{self.arch}"
-
-        # Nutzt deine download_and_extract Funktion!
-        apk_extract_path = download_and_extract(
-            mirrors,
-            dest_dir=download_dir,
-            extract_to=extract_dir,
-        )
+        # Exakter Dateiname aus dem APKINDEX (es gibt kein "latest"-Alias auf den Mirrors)
+        pkg = index.packages.get("apk-tools-static")
+        if pkg is None:
+            error("[APK] apk-tools-static nicht im APKINDEX!")
+            return Path("apk.static")
+
+        apk_file = self._fetch_package(pkg)
+        extract_dir = self.cache.path(f"{self.cache_prefix}/apk-tools-static/{self.alpine_arch}/{pkg['version']}")
+        apk_static = extract_dir / "sbin" / "apk.static"
 
-        # apk-tools-static entpackt in sbin/apk.static
-        apk_static = apk_extract_path / "sbin" / "apk.static"
+        if not apk_static.exists():
+            with self.cache.locked(f"{self.cache_prefix}/apk-tools-static-{self.alpine_arch}"):
+                if not apk_static.exists():
+                    extract_tar(apk_file, extract_dir)
 
         if apk_static.exists():
             info(f"[APK] apk.static gefunden: {apk_static}")
@@ -82,21 +172,7 @@ class APKInstaller:
         return apk_static
 
     # -------------------------------------------------------------
-    # Schritt 2: APK Datenbank initialisieren
-    # -------------------------------------------------------------
-    def _init_apk_database(self, apk_static: Path):
-        info("[APK] Initialisiere APK Datenbank...")
-
-        run_command_live([
-            str(apk_static),
-            "-X", f"{self.ALPINE_REPO}/main",
-            "--arch", self.alpine_arch,
-            "--root", str(self.rootfs_dir),
-            "--initdb"
-        ])
-
-    # -------------------------------------------------------------
-    # Schritt 3: /etc/apk/repositories schreiben
+    # Schritt 2: /etc/apk/repositories schreiben
     # -------------------------------------------------------------
     def _write_repositories(self):
         repo_file = self.rootfs_dir / "etc/apk/repositories"
@@ -104,29 +180,36 @@ class APKInstaller:
 
         info("[APK] Schreibe /etc/apk/repositories...")
 
+        # Für das Zielsystem immer das öffentliche Repo, nie den lokalen Cache
         repo_file.write_text(
             f"{self.ALPINE_REPO}/main\n"
             f"{self.ALPINE_REPO}/community\n"
         )
 
     # -------------------------------------------------------------
-    # Schritt 4: Basis-Pakete installieren
+    # Schritt 3: Datenbank initialisieren und Basis-Pakete installieren (offline)
     # -------------------------------------------------------------
     def _install_base_packages(self, apk_static: Path):
         info("[APK] Installiere Basis-Pakete (busybox, alpine-baselayout, apk-tools)...")
 
-        run_command_live([
+        repos = []
+        for repo in self.REPOS:
+            repos += ["-X", str(self._local_repo(repo))]
+
+        ok = run_command_live([
             str(apk_static),
-            "-X", f"{self.ALPINE_REPO}/main",
+            *repos,
+            "--repositories-file", "/dev/null",
+            "--no-network",
             "--arch", self.alpine_arch,
             "--root", str(self.rootfs_dir),
-            "--update-cache",
+            "--initdb",
             "--allow-untrusted",
             "add",
-            "alpine-baselayout",
-            "busybox",
-            "apk-tools"
+            *self.BASE_PACKAGES
         ])
+        if not ok:
+            raise RuntimeError("[APK] apk.static add fehlgeschlagen")
 
 
 # -------------------------------------------------------------
@@ -0,0 +1,423 @@
+import os
+import json
+import math
+import stat
+import time
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.fsmeta import resolve_metadata
+from utils.manifest import scan_rootfs, hash_file, diff_manifests, NO_VALUE
+
+from core.logger import success, info, warning, error, start
+
+
+
+
+# =============================================================================
+# DELTA / OTA UPDATES
+# =============================================================================
+# Erzeugt aus zwei RootFS-Builds ein kompaktes Update:
+#   - unveränderte Dateien werden gar nicht übertragen
+#   - Inhalte, die es im alten Build schon gibt (auch unter anderem Pfad), werden kopiert
+#   - geänderte Dateien als Binär-Diff (zstd --patch-from oder bsdiff)
+#   - neue Dateien zstd-komprimiert, je Inhalt nur einmal
+# Das Ergebnis ist ein einzelnes tar mit delta.json + Patches/Blobs.
+# Für Images gibt es einen Block-Delta über zstd --patch-from --long.
+
+DELTA_VERSION = 1
+DELTA_METHODS = ("zstd", "bsdiff")
+ZSTD_LEVEL = 19
+
+
+def _require(tool: str):
+    if not shutil.which(tool):
+        error(f"[delta] '{tool}' nicht gefunden. Bitte installieren!")
+        raise SystemExit(1)
+
+
+def _run(cmd: list[str]):
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} fehlgeschlagen:\n{result.stdout}")
+
+
+def _window_log(size: int) -> int:
+    """zstd --long Fenster, groß genug für die Referenzdatei (max. 2 GiB)"""
+    return min(max(27, math.ceil(math.log2(max(size, 1))) + 1), 31)
+
+
+# -------------------------------------------------------------
+# Einzelne Dateien
+# -------------------------------------------------------------
+
+def _compress(src: Path, dest: Path):
+    _run(["zstd", "-q", "-f", f"-{ZSTD_LEVEL}", "-T1", str(src), "-o", str(dest)])
+
+
+def _patch(old: Path, new: Path, dest: Path, method: str):
+    if method == "bsdiff":
+        _run(["bsdiff", str(old), str(new), str(dest)])
+        return
+    window = _window_log(max(old.stat().st_size, new.stat().st_size))
+    _run(["zstd", "-q", "-f", f"-{ZSTD_LEVEL}", "-T1", f"--long={window}",
+          f"--patch-from={old}", str(new), "-o", str(dest)])
+
+
+def _decompress(blob: Path, dest: Path):
+    _run(["zstd", "-q", "-d", "-f", str(blob), "-o", str(dest)])
+
+
+def _unpatch(old: Path, patch: Path, dest: Path, method: str):
+    if method == "bsdiff":
+        _run(["bspatch", str(old), str(dest), str(patch)])
+        return
+    # Das Fenster steht im Frame, --memory muss nur groß genug sein
+    _run(["zstd", "-q", "-d", "-f", f"--memory={2 ** 31}",
+          f"--patch-from={old}", str(patch), "-o", str(dest)])
+
+
+# =============================================================================
+# GENERATE
+# =============================================================================
+
+def _plan(old: dict, new: dict) -> tuple[list[dict], dict[str, str]]:
+    """
+    Legt pro Pfad im neuen Build fest, woher der Inhalt kommt.
+    Gibt (einträge, neue_inhalte: sha256 -> pfad im neuen Build) zurück.
+    """
+    by_hash = {}
+    for rel, (mode, _, digest, _) in old.items():
+        if stat.S_ISREG(mode):
+            by_hash.setdefault(digest, rel)
+
+    entries, fresh = [], {}
+    for rel in sorted(new):
+        mode, size, digest, target = new[rel]
+        entry = {"path": rel, "mode": mode}
+
+        if stat.S_ISLNK(mode):
+            entry["target"] = target
+        elif stat.S_ISREG(mode):
+            entry.update(size=size, sha256=digest)
+            if digest in by_hash:
+                entry["source"] = "old"
+                entry["from"] = by_hash[digest]
+            elif rel in old and stat.S_ISREG(old[rel][0]):
+                entry["source"] = "patch"
+                entry["from"] = rel
+                entry["from_sha256"] = old[rel][2]
+            else:
+                entry["source"] = "blob"
+                fresh.setdefault(digest, rel)
+        entries.append(entry)
+
+    return entries, fresh
+
+
+def _as_blob(entry: dict):
+    entry["source"] = "blob"
+    for key in ("from", "from_sha256", "patch", "method"):
+        entry.pop(key, None)
+
+
+def generate_delta(old_root: Path, new_root: Path, output: Path, method: str = "zstd",
+                   jobs: int | None = None, meta=None) -> dict:
+    """
+    Erzeugt das Update old_root -> new_root als tar-Datei output. Gibt einen Report zurück.
+    meta: Optional FSMetadata von new_root (Owner aus der DB statt von der Platte, rootless Builds).
+    """
+    if method not in DELTA_METHODS:
+        raise ValueError(f"Unbekannte Delta-Methode: {method}")
+    _require("zstd")
+    if method == "bsdiff":
+        _require("bsdiff")
+
+    old_root, new_root, output = Path(old_root), Path(new_root), Path(output)
+    start(f"[delta] Erzeuge Update {old_root} -> {new_root} ...")
+    began = time.monotonic()
+
+    old = scan_rootfs(old_root, jobs=jobs)
+    new = scan_rootfs(new_root, jobs=jobs)
+    entries, fresh = _plan(old, new)
+    changes = diff_manifests(old, new)
+
+    # Owner, mtime und Gerätenummern: das Manifest kennt nur Modus und Inhalt
+    snapshot = meta.snapshot() if meta is not None else None
+    for entry in entries:
+        st = os.lstat(new_root / entry["path"])
+        if snapshot is not None:
+            resolved = resolve_metadata(snapshot.get(entry["path"]), st)
+            entry.update(uid=resolved["uid"], gid=resolved["gid"])
+        else:
+            entry.update(uid=st.st_uid, gid=st.st_gid)
+        entry["mtime"] = int(st.st_mtime)
+        if _is_node(entry["mode"]):
+            entry.update(major=os.major(st.st_rdev), minor=os.minor(st.st_rdev))
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="delta-", dir=output.parent) as tmp:
+        tmp = Path(tmp)
+        (tmp / "patches").mkdir()
+        (tmp / "blobs").mkdir()
+
+        def build_patch(entry: dict):
+            name = entry["sha256"]
+            patch = tmp / "patches" / name
+            blob = tmp / "blobs" / name
+            _patch(old_root / entry["from"], new_root / entry["path"], patch, method)
+            _compress(new_root / entry["path"], blob)
+            # Ein Patch lohnt sich nur, wenn er kleiner als der komprimierte Inhalt ist
+            if patch.stat().st_size < blob.stat().st_size:
+                blob.unlink()
+                entry["patch"] = name
+                entry["method"] = method
+            else:
+                patch.unlink()
+                _as_blob(entry)
+
+        patched = {}
+        for entry in entries:
+            if entry.get("source") == "patch" and entry["sha256"] not in fresh:
+                # Gleicher Zielinhalt mehrfach: nur einmal patchen
+                patched.setdefault(entry["sha256"], entry)
+
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            list(pool.map(build_patch, patched.values()))
+            list(pool.map(lambda item: _compress(new_root / item[1], tmp / "blobs" / item[0]), fresh.items()))
+
+        # Gleiche Zielinhalte übernehmen die Entscheidung des ersten Eintrags
+        for entry in entries:
+            if entry.get("source") != "patch":
+                continue
+            first = patched.get(entry["sha256"])
+            if first is None or first["source"] == "blob":
+                _as_blob(entry)
+            elif first is not entry:
+                for key in ("from", "from_sha256", "patch", "method"):
+                    entry[key] = first[key]
+
+        delta_info = {
+            "version": DELTA_VERSION,
+            "entries": entries,
+            "removed": changes["removed"],
+        }
+        (tmp / "delta.json").write_text(json.dumps(delta_info, indent=1))
+
+        tmp_output = output.with_name(output.name + ".tmp")
+        with tarfile.open(tmp_output, "w", format=tarfile.PAX_FORMAT) as tar:
+            tar.add(tmp / "delta.json", arcname="delta.json")
+            for sub in ("patches", "blobs"):
+                for item in sorted((tmp / sub).iterdir()):
+                    tar.add(item, arcname=f"{sub}/{item.name}")
+        os.replace(tmp_output, output)
+
+    counts = {}
+    for entry in entries:
+        if "source" in entry:
+            counts[entry["source"]] = counts.get(entry["source"], 0) + 1
+
+    report = {
+        "path": output,
+        "size": output.stat().st_size,
+        "new_size": sum(size for mode, size, _, _ in new.values() if stat.S_ISREG(mode)),
+        "added": len(changes["added"]),
+        "changed": len(changes["changed"]),
+        "removed": len(changes["removed"]),
+        "copied": counts.get("old", 0),
+        "patched": counts.get("patch", 0),
+        "blobs": counts.get("blob", 0),
+        "seconds": time.monotonic() - began,
+    }
+    success(
+        f"[delta] {output.name}: {report['size'] / 1024 / 1024:.1f} MiB "
+        f"(Build: {report['new_size'] / 1024 / 1024:.1f} MiB) – "
+        f"{report['added']} neu, {report['changed']} geändert, {report['removed']} entfernt, "
+        f"{report['patched']} Patches, {report['blobs']} Blobs in {report['seconds']:.1f}s"
+    )
+    return report
+
+
+# =============================================================================
+# APPLY / VERIFY
+# =============================================================================
+
+def _is_node(mode: int) -> bool:
+    return stat.S_ISCHR(mode) or stat.S_ISBLK(mode)
+
+
+def _set_owner(path: Path, entry: dict, as_root: bool):
+    # Vor chmod: chown löscht setuid/setgid
+    if as_root and "uid" in entry:
+        os.lchown(path, entry["uid"], entry["gid"])
+
+
+def verify_tree(root: Path, entries: list[dict], jobs: int | None = None, skip: set[str] = frozenset(),
+                check_owner: bool = False) -> list[str]:
+    """
+    Vergleicht root mit den Delta-Einträgen. Gibt die abweichenden Pfade zurück (leer = ok).
+    skip: Pfade, die bewusst nicht angelegt wurden (Device Nodes ohne Rootrechte).
+    check_owner: auch uid/gid prüfen (nur sinnvoll, wenn als root angewendet).
+    """
+    root = Path(root)
+    actual = {rel: value for rel, value in scan_rootfs(root, jobs=jobs).items() if rel not in skip}
+    expected = {
+        e["path"]: (e["mode"], e.get("size", len(e.get("target", ""))), e.get("sha256", NO_VALUE), e.get("target", NO_VALUE))
+        for e in entries if e["path"] not in skip
+    }
+    changes = diff_manifests(expected, actual)
+    mismatches = set(changes["added"] + changes["removed"] + changes["changed"] + changes["mode"])
+
+    for e in entries:
+        if e["path"] in skip or e["path"] in mismatches:
+            continue
+        st = os.lstat(root / e["path"])
+        if _is_node(e["mode"]) and st.st_rdev != os.makedev(e.get("major", 0), e.get("minor", 0)):
+            mismatches.add(e["path"])
+        if check_owner and "uid" in e and (st.st_uid, st.st_gid) != (e["uid"], e["gid"]):
+            mismatches.add(e["path"])
+    return sorted(mismatches)
+
+
+def apply_delta(delta: Path, old_root: Path, new_root: Path, jobs: int | None = None) -> Path:
+    """
+    Baut new_root aus old_root + Delta neu auf (A/B: old_root bleibt unverändert)
+    und verifiziert das Ergebnis gegen die Hashes im Delta.
+    """
+    _require("zstd")
+    delta, old_root, new_root = Path(delta), Path(old_root), Path(new_root)
+    start(f"[delta] Wende {delta.name} auf {old_root} an -> {new_root} ...")
+
+    if new_root.exists():
+        shutil.rmtree(new_root)
+    new_root.mkdir(parents=True)
+    as_root = os.geteuid() == 0
+
+    with tempfile.TemporaryDirectory(prefix="delta-apply-", dir=new_root.parent) as tmp:
+        tmp = Path(tmp)
+        with tarfile.open(delta) as tar:
+            tar.extractall(tmp, filter="data")
+        data = json.loads((tmp / "delta.json").read_text())
+        if data.get("version") != DELTA_VERSION:
+            raise RuntimeError(f"Nicht unterstützte Delta-Version: {data.get('version')}")
+        entries = data["entries"]
+
+        # Basis prüfen, bevor irgendetwas gepatcht wird
+        for entry in entries:
+            if entry.get("source") == "patch":
+                source = old_root / entry["from"]
+                if not source.is_file() or hash_file(str(source), source.stat().st_size) != entry["from_sha256"]:
+                    raise RuntimeError(f"Basis passt nicht zum Delta: {entry['from']}")
+
+        # Verzeichnisse, Symlinks, FIFOs und Device Nodes zuerst (sortiert, Eltern vor Kindern)
+        skipped = set()
+        for entry in entries:
+            path = new_root / entry["path"]
+            mode = entry["mode"]
+            if stat.S_ISDIR(mode):
+                path.mkdir(exist_ok=True)
+                _set_owner(path, entry, as_root)
+            elif stat.S_ISLNK(mode):
+                os.symlink(entry["target"], path)
+                _set_owner(path, entry, as_root)
+            elif stat.S_ISFIFO(mode):
+                os.mkfifo(path, stat.S_IMODE(mode))
+                _set_owner(path, entry, as_root)
+                os.chmod(path, stat.S_IMODE(mode))
+            elif _is_node(mode):
+                try:
+                    os.mknod(path, mode, os.makedev(entry.get("major", 0), entry.get("minor", 0)))
+                    _set_owner(path, entry, as_root)
+                    os.chmod(path, stat.S_IMODE(mode))
+                except PermissionError:
+                    skipped.add(entry["path"])
+
+        if skipped:
+            warning(f"[delta] Ohne Rootrechte keine Device Nodes, übersprungen: {', '.join(sorted(skipped))}")
+        if not as_root and any(entry.get("uid") or entry.get("gid") for entry in entries):
+            warning("[delta] Ohne Rootrechte werden Owner nicht gesetzt und nicht geprüft.")
+
+        def restore(entry: dict):
+            dest = new_root / entry["path"]
+            source = entry["source"]
+            if source == "old":
+                shutil.copyfile(old_root / entry["from"], dest)
+            elif source == "patch":
+                _unpatch(old_root / entry["from"], tmp / "patches" / entry["patch"], dest, entry["method"])
+            else:
+                _decompress(tmp / "blobs" / entry["sha256"], dest)
+            _set_owner(dest, entry, as_root)
+            os.chmod(dest, stat.S_IMODE(entry["mode"]))
+
+        files = [e for e in entries if stat.S_ISREG(e["mode"])]
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            list(pool.map(restore, files))
+
+        # Verzeichnisrechte und mtimes zuletzt (Kinder vor Eltern, schreibgeschützte Verzeichnisse)
+        for entry in reversed(entries):
+            path = new_root / entry["path"]
+            if entry["path"] in skipped:
+                continue
+            if stat.S_ISDIR(entry["mode"]):
+                os.chmod(path, stat.S_IMODE(entry["mode"]))
+            if "mtime" in entry:
+                os.utime(path, (entry["mtime"], entry["mtime"]), follow_symlinks=False)
+
+    mismatches = verify_tree(new_root, entries, jobs=jobs, skip=skipped, check_owner=as_root)
+    if mismatches:
+        error(f"[delta] Verifikation fehlgeschlagen ({len(mismatches)} Pfade): {', '.join(mismatches[:10])}")
+        raise RuntimeError("Delta-Verifikation fehlgeschlagen")
+
+    success(f"[delta] {new_root} aufgebaut und verifiziert ({len(files)} Dateien).")
+    return new_root
+
+
+# =============================================================================
+# IMAGE DELTAS
+# =============================================================================
+
+def generate_image_delta(old_image: Path, new_image: Path, output: Path) -> dict:
+    """Block-Delta zwischen zwei Images (zstd --patch-from --long) + Hash des Zielimages"""
+    _require("zstd")
+    old_image, new_image, output = Path(old_image), Path(new_image), Path(output)
+    start(f"[delta] Image-Delta {old_image.name} -> {new_image.name} ...")
+    began = time.monotonic()
+
+    window = _window_log(max(old_image.stat().st_size, new_image.stat().st_size))
+    _run(["zstd", "-q", "-f", f"-{ZSTD_LEVEL}", "-T0", f"--long={window}",
+          f"--patch-from={old_image}", str(new_image), "-o", str(output)])
+
+    sums = {
+        "old_sha256": hash_file(str(old_image), old_image.stat().st_size),
+        "new_sha256": hash_file(str(new_image), new_image.stat().st_size),
+        "window": window,
+    }
+    Path(str(output) + ".json").write_text(json.dumps(sums, indent=1))
+
+    report = {"path": output, "size": output.stat().st_size, "seconds": time.monotonic() - began}
+    success(f"[delta] {output.name}: {report['size'] / 1024 / 1024:.1f} MiB in {report['seconds']:.1f}s")
+    return report
+
+
+def apply_image_delta(old_image: Path, delta: Path, new_image: Path) -> Path:
+    _require("zstd")
+    old_image, delta, new_image = Path(old_image), Path(delta), Path(new_image)
+    sums = json.loads(Path(str(delta) + ".json").read_text())
+
+    if hash_file(str(old_image), old_image.stat().st_size) != sums["old_sha256"]:
+        raise RuntimeError(f"Basis-Image passt nicht zum Delta: {old_image}")
+
+    window = sums["window"]
+    _run(["zstd", "-q", "-d", "-f", f"--long={window}", f"--memory={2 ** window}",
+          f"--patch-from={old_image}", str(delta), "-o", str(new_image)])
+
+    if hash_file(str(new_image), new_image.stat().st_size) != sums["new_sha256"]:
+        raise RuntimeError(f"Image-Verifikation fehlgeschlagen: {new_image}")
+
+    success(f"[delta] {new_image.name} aus Delta erzeugt und verifiziert.")
+    return new_image
@@ -0,0 +1,337 @@
+import os
+import time
+import uuid
+import zlib
+import struct
+import shutil
+import hashlib
+import subprocess
+
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error, start
+
+
+
+
+# =============================================================================
+# DISK IMAGE ASSEMBLER
+# =============================================================================
+# Baut ein bootfähiges Firmware-Image (GPT oder MBR) aus FAT-Bootfs und
+# RootFS-Image zusammen – ohne Rootrechte und ohne Loop-Devices. Die Ausgabe
+# bleibt sparse (nur Datenbereiche werden per copy_file_range kopiert) und
+# bekommt eine .bmap für schnelles Flashen mit bmaptool.
+
+SECTOR = 512
+ALIGN = 1024 * 1024
+GPT_ENTRIES = 128
+GPT_ENTRY_SIZE = 128
+GPT_TABLE_SECTORS = GPT_ENTRIES * GPT_ENTRY_SIZE // SECTOR
+BMAP_BLOCK = 4096
+# FAT32 braucht mindestens 65525 Cluster (~33 MiB bei 512-Byte-Clustern)
+FAT32_MIN_MB = 64
+
+# Partitionstypen: (GPT-Typ-GUID, MBR-Typ-Byte)
+PARTITION_TYPES = {
+    "fat32": ("EBD0A0A2-B9E5-4433-87C0-68B6B72699C7", 0x0C),
+    "esp": ("C12A7328-F81F-11D2-BA4B-00A0C93EC93B", 0xEF),
+    "linux": ("0FC63DAF-8483-4772-8E79-3D69D8477DE4", 0x83),
+}
+
+
+def _align(value: int, alignment: int = ALIGN) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+# -------------------------------------------------------------
+# Sparse Hilfsfunktionen
+# -------------------------------------------------------------
+
+def data_ranges(fd: int, size: int):
+    """Liefert (offset, länge) aller Datenbereiche einer Datei (SEEK_DATA/SEEK_HOLE)"""
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError:
+            # ENXIO: nur noch Loch bis zum Ende
+            return
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        yield data, hole - data
+        offset = hole
+
+
+def sparse_copy(src: Path, dst_fd: int, dst_offset: int) -> int:
+    """Kopiert nur die Datenbereiche von src an dst_offset. Gibt die kopierten Bytes zurück."""
+    copied = 0
+    with open(src, "rb") as f:
+        src_fd = f.fileno()
+        size = os.fstat(src_fd).st_size
+        for offset, length in data_ranges(src_fd, size):
+            while length > 0:
+                try:
+                    n = os.copy_file_range(src_fd, dst_fd, length, offset, dst_offset + offset)
+                except OSError:
+                    n = 0
+                if n == 0:
+                    # Fallback (z.B. über Dateisystemgrenzen ohne copy_file_range)
+                    chunk = os.pread(src_fd, min(length, 4 * 1024 * 1024), offset)
+                    if not chunk:
+                        break
+                    if chunk.count(0) != len(chunk):
+                        os.pwrite(dst_fd, chunk, dst_offset + offset)
+                    n = len(chunk)
+                offset += n
+                length -= n
+                copied += n
+    return copied
+
+
+# -------------------------------------------------------------
+# Partitionstabellen
+# -------------------------------------------------------------
+
+def _mbr(entries: list[tuple[int, int, int, bool]], disk_signature: int) -> bytes:
+    """entries: (typ, start_lba, sektoren, bootfähig) – max. 4 primäre Partitionen"""
+    mbr = bytearray(SECTOR)
+    struct.pack_into("<I", mbr, 440, disk_signature)
+    for i, (ptype, first, count, bootable) in enumerate(entries):
+        struct.pack_into(
+            "<B3sB3sII", mbr, 446 + i * 16,
+            0x80 if bootable else 0x00, b"\xfe\xff\xff", ptype, b"\xfe\xff\xff", first, count
+        )
+    mbr[510:512] = b"\x55\xaa"
+    return bytes(mbr)
+
+
+def _gpt_header(current: int, backup: int, first_usable: int, last_usable: int,
+                disk_guid: uuid.UUID, entries_lba: int, entries_crc: int) -> bytes:
+    header = struct.pack(
+        "<8sIIIIQQQQ16sQIII",
+        b"EFI PART", 0x00010000, 92, 0, 0,
+        current, backup, first_usable, last_usable,
+        disk_guid.bytes_le, entries_lba, GPT_ENTRIES, GPT_ENTRY_SIZE, entries_crc
+    )
+    crc = zlib.crc32(header)
+    header = header[:16] + struct.pack("<I", crc) + header[20:]
+    return header + b"\0" * (SECTOR - len(header))
+
+
+def write_gpt(fd: int, total_sectors: int, partitions: list[dict], disk_guid: uuid.UUID):
+    table = bytearray(GPT_ENTRIES * GPT_ENTRY_SIZE)
+    for i, part in enumerate(partitions):
+        type_guid = uuid.UUID(PARTITION_TYPES[part["type"]][0])
+        name = part["name"].encode("utf-16-le")[:72]
+        struct.pack_into(
+            "<16s16sQQQ72s", table, i * GPT_ENTRY_SIZE,
+            type_guid.bytes_le, part["guid"].bytes_le,
+            part["start"] // SECTOR, (part["start"] + part["size"]) // SECTOR - 1,
+            0, name
+        )
+    table = bytes(table)
+    table_crc = zlib.crc32(table)
+
+    last = total_sectors - 1
+    first_usable = 2 + GPT_TABLE_SECTORS
+    last_usable = last - 1 - GPT_TABLE_SECTORS
+
+    # Protective MBR
+    os.pwrite(fd, _mbr([(0xEE, 1, min(total_sectors - 1, 0xFFFFFFFF), False)], 0), 0)
+
+    # Primär: Header LBA 1, Tabelle ab LBA 2
+    os.pwrite(fd, _gpt_header(1, last, first_usable, last_usable, disk_guid, 2, table_crc), SECTOR)
+    os.pwrite(fd, table, 2 * SECTOR)
+
+    # Backup: Tabelle vor dem letzten Sektor, Header im letzten Sektor
+    backup_table_lba = last - GPT_TABLE_SECTORS
+    os.pwrite(fd, table, backup_table_lba * SECTOR)
+    os.pwrite(fd, _gpt_header(last, 1, first_usable, last_usable, disk_guid, backup_table_lba, table_crc), last * SECTOR)
+
+
+def write_mbr(fd: int, partitions: list[dict], disk_signature: int):
+    if len(partitions) > 4:
+        raise ValueError("MBR unterstützt maximal 4 primäre Partitionen")
+    entries = [
+        (PARTITION_TYPES[p["type"]][1], p["start"] // SECTOR, p["size"] // SECTOR, i == 0)
+        for i, p in enumerate(partitions)
+    ]
+    os.pwrite(fd, _mbr(entries, disk_signature), 0)
+
+
+# -------------------------------------------------------------
+# Block Map (.bmap, Format 2.0 für bmaptool)
+# -------------------------------------------------------------
+
+def write_bmap(image: Path, bmap_path: Path) -> int:
+    """Schreibt die Block Map aller belegten Blöcke mit SHA256 je Bereich. Gibt die Anzahl belegter Blöcke zurück."""
+    size = image.stat().st_size
+    blocks = (size + BMAP_BLOCK - 1) // BMAP_BLOCK
+    ranges = []
+    mapped = 0
+
+    with open(image, "rb") as f:
+        fd = f.fileno()
+        for offset, length in data_ranges(fd, size):
+            first = offset // BMAP_BLOCK
+            last = min((offset + length + BMAP_BLOCK - 1) // BMAP_BLOCK, blocks) - 1
+            if ranges and ranges[-1][1] >= first - 1:
+                first = ranges.pop()[0]
+            ranges.append((first, last))
+
+        lines = []
+        for first, last in ranges:
+            digest = hashlib.sha256()
+            pos = first * BMAP_BLOCK
+            end = min((last + 1) * BMAP_BLOCK, size)
+            while pos < end:
+                chunk = os.pread(fd, min(end - pos, 4 * 1024 * 1024), pos)
+                digest.update(chunk)
+                pos += len(chunk)
+            mapped += last - first + 1
+            span = f"{first}-{last}" if last != first else f"{first}"
+            lines.append(f'        <Range chksum="{digest.hexdigest()}"> {span} </Range>')
+
+    placeholder = "0" * 64
+    xml = (
+        '<?xml version="1.0" ?>\n'
+        '<bmap version="2.0">\n'
+        f"    <ImageSize> {size} </ImageSize>\n"
+        f"    <BlockSize> {BMAP_BLOCK} </BlockSize>\n"
+        f"    <BlocksCount> {blocks} </BlocksCount>\n"
+        f"    <MappedBlocksCount> {mapped} </MappedBlocksCount>\n"
+        "    <ChecksumType> sha256 </ChecksumType>\n"
+        f"    <BmapFileChecksum> {placeholder} </BmapFileChecksum>\n"
+        "    <BlockMap>\n"
+        + "\n".join(lines) + "\n"
+        "    </BlockMap>\n"
+        "</bmap>\n"
+    )
+    # Die Prüfsumme wird über die Datei mit genullter Prüfsumme berechnet
+    checksum = hashlib.sha256(xml.encode()).hexdigest()
+    bmap_path.write_text(xml.replace(placeholder, checksum, 1))
+    return mapped
+
+
+# -------------------------------------------------------------
+# FAT Bootfs (mtools, ohne Mount)
+# -------------------------------------------------------------
+
+def _tree_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def build_bootfs_image(source_dirs: list[Path], image: Path, min_size_mb: int = 64, label: str = "BOOT") -> Path:
+    """Erstellt ein FAT-Image und kopiert den Inhalt aller source_dirs per mcopy hinein"""
+    for tool in ("mkfs.vfat", "mcopy"):
+        if not shutil.which(tool):
+            error(f"[disk] '{tool}' nicht gefunden. Bitte dosfstools/mtools installieren!")
+            raise SystemExit(1)
+
+    source_dirs = [Path(d) for d in source_dirs if Path(d).exists()]
+    content = sum(_tree_size(d) for d in source_dirs)
+    size_kb = max(max(min_size_mb, FAT32_MIN_MB) * 1024, _align(int(content * 1.1) + 16 * ALIGN) // 1024)
+
+    # Immer FAT32, passend zum Partitionstyp 0x0C bzw. zur ESP (mkfs.vfat wählt sonst FAT16 für kleine Images)
+    image.unlink(missing_ok=True)
+    result = subprocess.run(["mkfs.vfat", "-C", "-F", "32", "-n", label, str(image), str(size_kb)],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        error(f"[disk] mkfs.vfat fehlgeschlagen:\n{result.stdout}")
+        raise SystemExit(1)
+
+    for src in source_dirs:
+        entries = sorted(src.iterdir())
+        if not entries:
+            continue
+        cmd = ["mcopy", "-s", "-o", "-Q", "-i", str(image)] + [str(e) for e in entries] + ["::/"]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            error(f"[disk] mcopy fehlgeschlagen:\n{result.stdout}")
+            raise SystemExit(1)
+
+    info(f"[disk] Bootfs {image.name}: {size_kb // 1024} MiB aus {', '.join(str(d) for d in source_dirs)}")
+    return image
+
+
+# =============================================================================
+# MAIN ENTRY FUNCTION
+# =============================================================================
+
+def assemble_disk_image(output: Path, partitions: list[dict], table: str = "gpt", bmap: bool = True) -> dict:
+    """
+    partitions: [{"name": "boot", "type": "fat32", "image": Path, "size_mb": optional}, ...]
+    Legt die Partitionen 1-MiB-aligned ab, schreibt die Partitionstabelle und
+    kopiert die Images sparse hinein. Gibt einen Report zurück.
+    """
+    if table not in ("gpt", "mbr"):
+        raise ValueError(f"Unbekannte Partitionstabelle: {table}")
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    start(f"[disk] Baue {table.upper()} Disk-Image {output.name} ...")
+    began = time.monotonic()
+
+    offset = ALIGN
+    layout = []
+    for part in partitions:
+        image = Path(part["image"])
+        size = _align(max(image.stat().st_size, part.get("size_mb", 0) * ALIGN))
+        layout.append({
+            **part,
+            "image": image,
+            "start": offset,
+            "size": size,
+            "guid": uuid.uuid5(uuid.NAMESPACE_URL, f"nexuzcore:{output.name}:{part['name']}"),
+        })
+        offset += size
+
+    # Platz für die Backup-GPT am Ende
+    total = _align(offset + (GPT_TABLE_SECTORS + 1) * SECTOR)
+    disk_guid = uuid.uuid5(uuid.NAMESPACE_URL, f"nexuzcore:{output.name}")
+
+    output.unlink(missing_ok=True)
+    copied = 0
+    with open(output, "wb") as f:
+        fd = f.fileno()
+        f.truncate(total)
+
+        if table == "gpt":
+            write_gpt(fd, total // SECTOR, layout, disk_guid)
+        else:
+            write_mbr(fd, layout, disk_guid.int & 0xFFFFFFFF)
+
+        for part in layout:
+            n = sparse_copy(part["image"], fd, part["start"])
+            copied += n
+            info(f"[disk] {part['name']}: {part['size'] // ALIGN} MiB @ {part['start'] // ALIGN} MiB ({n / 1024 / 1024:.1f} MiB Daten)")
+
+    report = {"path": output, "size": total, "data": copied}
+
+    if bmap:
+        bmap_path = output.with_name(output.name + ".bmap")
+        mapped = write_bmap(output, bmap_path)
+        report["bmap"] = bmap_path
+        report["mapped"] = mapped * BMAP_BLOCK
+
+    elapsed = time.monotonic() - began
+    report["seconds"] = elapsed
+    success(
+        f"[disk] {output.name}: {total / 1024 / 1024:.0f} MiB, "
+        f"{report.get('mapped', copied) / 1024 / 1024:.1f} MiB belegt, in {elapsed:.1f}s"
+    )
+    return report
+
+
+def build_firmware_image(bootfs_sources: list[Path], rootfs_image: Path, output_dir: Path, name: str = "firmware",
+                         table: str = "gpt", boot_size_mb: int = 256) -> dict:
+    """Bootfs (kernel.img + dtbs) + RootFS-Image -> <name>.img (+ .bmap)"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    boot_image = build_bootfs_image(bootfs_sources, output_dir / "bootfs.vfat", min_size_mb=boot_size_mb)
+    partitions = [
+        {"name": "boot", "type": "fat32", "image": boot_image},
+        {"name": "rootfs", "type": "linux", "image": Path(rootfs_image)},
+    ]
+    return assemble_disk_image(output_dir / f"{name}.img", partitions, table=table)
@@ -0,0 +1,307 @@
+import os
+import re
+import glob
+import stat
+import fnmatch
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.elf import ElfFile, ET_EXEC, ET_DYN
+from utils.fswalk import parallel_walk
+
+from core.strip import find_elf_files
+from core.logger import success, info, warning, error, start
+
+
+
+
+# =============================================================================
+# ELF DEPENDENCY CLOSURE
+# =============================================================================
+# Liest DT_NEEDED / RPATH / RUNPATH / PT_INTERP aller ELF-Dateien im RootFS
+# (in-process, ohne qemu), löst die Bibliotheken wie ld.so relativ zum RootFS
+# auf und bestimmt die von den Root-Executables erreichbare Menge.
+# Nicht erreichbare .so-Dateien werden gemeldet oder entfernt.
+# dlopen() ist so nicht sichtbar – dafür gibt es die keep-Liste (configs/elf_prune.json).
+
+DEFAULT_LIB_DIRS = ["lib", "usr/lib", "lib64", "usr/lib64", "usr/local/lib"]
+
+_SO_NAME = re.compile(r"\.so(\.\d+)*$")
+
+
+def is_shared_library_name(name: str) -> bool:
+    return bool(_SO_NAME.search(name))
+
+
+def resolve_in_root(root: Path, path: str, max_hops: int = 40) -> str | None:
+    """
+    Löst path (absolut im Ziel-RootFS) inkl. aller Symlinks innerhalb von root auf.
+    Absolute Link-Ziele werden auf root umgebogen. Gibt den realen rel-Pfad oder None zurück.
+    """
+    parts = [p for p in path.split("/") if p]
+    resolved: list[str] = []
+    hops = 0
+
+    while parts:
+        part = parts.pop(0)
+        if part == ".":
+            continue
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+
+        candidate = os.path.join(root, *resolved, part)
+        try:
+            st = os.lstat(candidate)
+        except OSError:
+            return None
+
+        if stat.S_ISLNK(st.st_mode):
+            hops += 1
+            if hops > max_hops:
+                return None
+            target = os.readlink(candidate)
+            if target.startswith("/"):
+                resolved = []
+            parts = [p for p in target.split("/") if p] + parts
+            continue
+
+        resolved.append(part)
+
+    return "/".join(resolved)
+
+
+def _ld_conf_dirs(root: Path, conf: str = "etc/ld.so.conf", seen: set | None = None) -> list[str]:
+    """Verzeichnisse aus ld.so.conf (glibc, inkl. include) relativ zum RootFS"""
+    seen = seen if seen is not None else set()
+    path = root / conf
+    if conf in seen or not path.is_file():
+        return []
+    seen.add(conf)
+
+    dirs = []
+    for line in path.read_text(errors="replace").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("include"):
+            pattern = line.split(None, 1)[1]
+            if not pattern.startswith("/"):
+                pattern = str(Path(conf).parent / pattern)
+            for match in sorted(glob.glob(str(root / pattern.lstrip("/")))):
+                dirs += _ld_conf_dirs(root, os.path.relpath(match, root), seen)
+        else:
+            dirs.append(line.strip("/"))
+    return dirs
+
+
+def library_search_dirs(root: Path) -> list[str]:
+    """Standard-Suchpfade: ld.so.conf bzw. /etc/ld-musl-*.path, danach die Default-Verzeichnisse"""
+    dirs = _ld_conf_dirs(root)
+    for musl_path in sorted((root / "etc").glob("ld-musl-*.path")):
+        dirs += [d.strip("/") for d in re.split(r"[:\n]", musl_path.read_text()) if d.strip()]
+
+    result = []
+    for d in dirs + DEFAULT_LIB_DIRS:
+        if d not in result:
+            result.append(d)
+    return result
+
+
+# -------------------------------------------------------------
+# Analyse
+# -------------------------------------------------------------
+
+def _read_object(root: Path, rel: str) -> dict | None:
+    try:
+        with ElfFile(root / rel) as elf:
+            if elf.type not in (ET_EXEC, ET_DYN):
+                return None
+            return {
+                "machine": elf.machine,
+                "bits": elf.bits,
+                "interp": elf.interpreter(),
+                **elf.dynamic(),
+            }
+    except (ValueError, OSError):
+        return None
+
+
+def scan_objects(root: Path, jobs: int | None = None) -> dict[str, dict]:
+    """
+    Alle dynamischen ELF-Objekte im RootFS: realer rel-Pfad -> Header-Infos.
+    Hardlinks zählen als ein Objekt (Schlüssel: erster Name), alle Namen stehen unter "links".
+    """
+    inodes = list(find_elf_files(root, jobs=jobs).values())
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        infos = pool.map(lambda links: _read_object(root, links[0]), inodes)
+    return {links[0]: {**obj, "links": links} for links, obj in zip(inodes, infos) if obj is not None}
+
+
+def canonical_names(objects: dict[str, dict]) -> dict[str, str]:
+    """Jeder Hardlink-Name -> Schlüssel des Objekts in objects"""
+    return {name: rel for rel, obj in objects.items() for name in obj.get("links", [rel])}
+
+
+class LibraryResolver:
+    """Sucht Bibliotheken wie ld.so: RPATH (ohne RUNPATH), RUNPATH, ld.so.conf, Defaults"""
+
+    def __init__(self, root: Path, objects: dict[str, dict]):
+        self.root = Path(root)
+        self.objects = objects
+        self.search_dirs = library_search_dirs(self.root)
+        self.canonical = canonical_names(objects)
+        self._cache: dict[tuple, str | None] = {}
+
+    def _expand(self, path: str, origin: str) -> str:
+        return path.replace("${ORIGIN}", origin).replace("$ORIGIN", origin)
+
+    def resolve(self, name: str, requester: str) -> str | None:
+        obj = self.objects[requester]
+        origin = "/" + os.path.dirname(requester)
+
+        if "/" in name:
+            dirs, name = [os.path.dirname(name)], os.path.basename(name)
+        else:
+            dirs = [] if obj["runpath"] else list(obj["rpath"])
+            dirs += obj["runpath"] + self.search_dirs
+
+        key = (name, tuple(self._expand(d, origin) for d in dirs), obj["machine"], obj["bits"])
+        if key in self._cache:
+            return self._cache[key]
+
+        found = None
+        for d in key[1]:
+            rel = self.canonical.get(resolve_in_root(self.root, f"{d}/{name}"))
+            # Nur Bibliotheken der gleichen Architektur/Wortbreite (wie ld.so)
+            candidate = self.objects.get(rel) if rel else None
+            if candidate and candidate["machine"] == obj["machine"] and candidate["bits"] == obj["bits"]:
+                found = rel
+                break
+
+        self._cache[key] = found
+        return found
+
+
+def _matches(rel: str, patterns: list[str]) -> bool:
+    return any(fnmatch.fnmatch(rel, p) or fnmatch.fnmatch("/" + rel, p) for p in patterns)
+
+
+def dependency_closure(root: Path, objects: dict[str, dict], roots: list[str]) -> tuple[set[str], dict[str, list[str]]]:
+    """
+    Traversierung über DT_NEEDED + Interpreter ab roots (reale rel-Pfade).
+    Gibt (erreichbare Objekte, fehlende Bibliotheken pro Objekt) zurück.
+    """
+    resolver = LibraryResolver(root, objects)
+    canonical = resolver.canonical
+    reachable = set()
+    missing: dict[str, list[str]] = {}
+    queue = [r for r in roots if r in objects]
+
+    while queue:
+        rel = queue.pop()
+        if rel in reachable:
+            continue
+        reachable.add(rel)
+        obj = objects[rel]
+
+        if obj["interp"]:
+            interp = canonical.get(resolve_in_root(root, obj["interp"]))
+            if interp in objects:
+                queue.append(interp)
+            else:
+                missing.setdefault(rel, []).append(obj["interp"])
+
+        for needed in obj["needed"]:
+            lib = resolver.resolve(needed, rel)
+            if lib is None:
+                missing.setdefault(rel, []).append(needed)
+            elif lib not in reachable:
+                queue.append(lib)
+
+    return reachable, missing
+
+
+def _links_into(root: Path, targets: set[str], jobs: int | None = None) -> list[str]:
+    """
+    .so-Symlinks, die auf einen der targets zeigen (vor dem Entfernen ermitteln).
+    Bereits vorher verwaiste Symlinks bleiben unberührt.
+    """
+    def visit(entry: os.DirEntry, rel: str):
+        if entry.is_symlink() and is_shared_library_name(entry.name) and resolve_in_root(root, rel) in targets:
+            return rel
+        return None
+
+    return parallel_walk(root, visit, jobs=jobs)
+
+
+# =============================================================================
+# MAIN ENTRY FUNCTION
+# =============================================================================
+
+def prune_libraries(root: Path, roots: list[str], keep: list[str] | None = None, remove: bool = False,
+                    meta=None, jobs: int | None = None) -> dict:
+    """
+    roots: Globs der Einstiegs-Executables (relativ zum RootFS).
+    keep:  Globs für Bibliotheken, die per dlopen() geladen werden und nie entfernt werden.
+    remove=False meldet nur. Gibt einen Report zurück (reachable, unreachable, missing, bytes).
+    """
+    root = Path(root)
+    keep = keep or []
+    start(f"[elfdeps] Analysiere ELF-Abhängigkeiten in {root} ...")
+
+    objects = scan_objects(root, jobs=jobs)
+    canonical = canonical_names(objects)
+
+    root_objects = set()
+    for pattern in roots:
+        for match in glob.glob(str(root / pattern)):
+            rel = canonical.get(resolve_in_root(root, os.path.relpath(match, root)))
+            if rel in objects:
+                root_objects.add(rel)
+
+    # Per dlopen() geladene Bibliotheken (keep) ziehen ihre eigenen Abhängigkeiten mit
+    libraries = {rel for rel, obj in objects.items()
+                 if any(is_shared_library_name(os.path.basename(name)) for name in obj["links"])}
+    root_objects |= {rel for rel in libraries if any(_matches(name, keep) for name in objects[rel]["links"])}
+
+    reachable, missing = dependency_closure(root, objects, sorted(root_objects))
+
+    unreachable = sorted(libraries - reachable)
+    unreachable_bytes = sum((root / rel).stat().st_size for rel in unreachable)
+
+    for rel, names in sorted(missing.items()):
+        warning(f"[elfdeps] {rel}: nicht gefunden: {', '.join(names)}")
+
+    info(f"[elfdeps] {len(root_objects)} Root-Executables, {len(reachable)} erreichbare Objekte, "
+         f"{len(libraries)} Bibliotheken, {len(unreachable)} unerreichbar "
+         f"({unreachable_bytes / 1024 / 1024:.1f} MiB).")
+
+    removed_links = []
+    if remove and unreachable:
+        # Symlinks vorher bestimmen: nach dem Löschen wären sie nicht von alten Waisen zu unterscheiden
+        names = {name for rel in unreachable for name in objects[rel]["links"]}
+        removed_links = _links_into(root, names, jobs=jobs)
+        for name in sorted(names):
+            # Alle Hardlink-Namen, sonst bleiben die Daten auf der Platte
+            (root / name).unlink()
+            if meta is not None:
+                meta.remove(name)
+        for rel in removed_links:
+            (root / rel).unlink()
+            if meta is not None:
+                meta.remove(rel)
+        success(f"[elfdeps] {len(unreachable)} Bibliotheken und {len(removed_links)} Symlinks entfernt.")
+    else:
+        for rel in unreachable:
+            info(f"[elfdeps] unerreichbar: {rel}")
+
+    return {
+        "reachable": sorted(reachable),
+        "unreachable": unreachable,
+        "missing": missing,
+        "bytes": unreachable_bytes,
+        "removed_links": sorted(removed_links),
+    }
@@ -0,0 +1,420 @@
+import os
+import re
+import stat
+import time
+import shutil
+import tarfile
+import tempfile
+import subprocess
+
+
+from pathlib import Path
+
+from utils.fsmeta import resolve_metadata
+
+from core.logger import success, info, warning, error, start
+
+
+
+
+# =============================================================================
+# ROOTFS IMAGE WRITER
+# =============================================================================
+# Schreibt das RootFS ohne Loop-Mounts direkt in ein Image. Owner, Modi und
+# Device Nodes kommen aus der Metadaten-DB (utils/fsmeta.py), nicht vom Baum
+# auf der Platte – damit funktioniert die Stage auch ohne Rootrechte.
+
+IMAGE_FORMATS = ("ext4", "squashfs", "erofs", "cpio")
+
+IMAGE_SUFFIXES = {
+    "ext4": ".ext4",
+    "squashfs": ".squashfs",
+    "erofs": ".erofs",
+    "cpio": ".cpio",
+}
+
+CPIO_COMPRESSORS = {
+    "zstd": (".zst", lambda jobs: ["zstd", "-q", "-19", f"-T{jobs}", "-c"]),
+    "xz": (".xz", lambda jobs: ["xz", "-9", "--check=crc32", f"-T{jobs}", "-c"]),
+    "gzip": (".gz", lambda jobs: ["pigz", "-9", f"-p{jobs}", "-c"] if shutil.which("pigz") else ["gzip", "-9", "-c"]),
+    "none": ("", None),
+}
+
+
+def iter_rootfs(rootfs_dir: Path, meta_entries: dict):
+    """
+    Läuft sortiert (reproduzierbar) über das RootFS und liefert
+    (rel, abs_path, stat, effektive Metadaten) für jeden Eintrag inkl. Wurzel ("").
+    """
+    def walk(path: str, rel: str):
+        st = os.lstat(path)
+        yield rel, path, st, resolve_metadata(meta_entries.get(rel), st)
+
+        if stat.S_ISDIR(st.st_mode):
+            with os.scandir(path) as it:
+                children = sorted(it, key=lambda e: e.name)
+            for child in children:
+                yield from walk(child.path, f"{rel}/{child.name}" if rel else child.name)
+
+    yield from walk(str(rootfs_dir), "")
+
+
+def _require(tool: str):
+    if not shutil.which(tool):
+        error(f"[image] '{tool}' nicht gefunden. Bitte installieren!")
+        raise SystemExit(1)
+
+
+def _run(cmd: list[str], stdin=None, desc: str = "") -> None:
+    info(f"[image] {desc}: {' '.join(cmd)}")
+    result = subprocess.run(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        error(f"[image] {desc} fehlgeschlagen:\n{result.stdout}")
+        raise SystemExit(1)
+
+
+# -------------------------------------------------------------
+# cpio (newc) – reiner Python-Writer, Kompression per Pipe
+# -------------------------------------------------------------
+
+def _cpio_header(name: bytes, ino: int, mode: int, uid: int, gid: int, nlink: int, mtime: int,
+                 size: int, rmajor: int = 0, rminor: int = 0) -> bytes:
+    fields = (ino, mode, uid, gid, nlink, mtime, size, 0, 0, rmajor, rminor, len(name) + 1, 0)
+    header = b"070701" + b"".join(b"%08X" % value for value in fields) + name + b"\0"
+    return header + b"\0" * (-len(header) % 4)
+
+
+def write_cpio(rootfs_dir: Path, meta_entries: dict, out) -> int:
+    """Streamt das RootFS als newc-cpio nach out (binärer Stream). Gibt die Anzahl Einträge zurück."""
+    count = 0
+    # Hardlinks: gleiche ino-Nummer, Daten nur beim ersten Eintrag (wie der Kernel-Entpacker erwartet)
+    links: dict[tuple[int, int], int] = {}
+
+    for ino, (rel, path, st, md) in enumerate(iter_rootfs(rootfs_dir, meta_entries), start=1):
+        name = (rel or ".").encode()
+        kind = md["kind"]
+        mtime = int(st.st_mtime)
+
+        if kind == "file" and stat.S_ISREG(st.st_mode) and st.st_nlink > 1 and (st.st_dev, st.st_ino) in links:
+            out.write(_cpio_header(name, links[(st.st_dev, st.st_ino)], md["mode"], md["uid"], md["gid"],
+                                   st.st_nlink, mtime, 0))
+        elif kind == "file" and stat.S_ISREG(st.st_mode):
+            if st.st_nlink > 1:
+                links[(st.st_dev, st.st_ino)] = ino
+            out.write(_cpio_header(name, ino, md["mode"], md["uid"], md["gid"], st.st_nlink, mtime, st.st_size))
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            out.write(b"\0" * (-st.st_size % 4))
+        elif kind == "link":
+            target = os.readlink(path).encode()
+            out.write(_cpio_header(name, ino, md["mode"], md["uid"], md["gid"], 1, mtime, len(target)))
+            out.write(target + b"\0" * (-len(target) % 4))
+        elif kind in ("char", "block"):
+            out.write(_cpio_header(name, ino, md["mode"], md["uid"], md["gid"], 1, mtime, 0,
+                                   md["major"] or 0, md["minor"] or 0))
+        else:
+            nlink = 2 if kind == "dir" else 1
+            out.write(_cpio_header(name, ino, md["mode"], md["uid"], md["gid"], nlink, mtime, 0))
+        count += 1
+
+    out.write(_cpio_header(b"TRAILER!!!", 0, 0, 0, 0, 1, 0, 0))
+    return count
+
+
+def build_cpio(rootfs_dir: Path, image: Path, meta_entries: dict, jobs: int, compression: str = "zstd") -> Path:
+    suffix, compressor = CPIO_COMPRESSORS[compression]
+    image = image.with_name(image.name + suffix)
+
+    with open(image, "wb") as out:
+        if compressor is None:
+            write_cpio(rootfs_dir, meta_entries, out)
+            return image
+
+        cmd = compressor(jobs)
+        _require(cmd[0])
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+        try:
+            write_cpio(rootfs_dir, meta_entries, proc.stdin)
+        finally:
+            proc.stdin.close()
+            retcode = proc.wait()
+
+    if retcode != 0:
+        error(f"[image] {cmd[0]} fehlgeschlagen (Exit-Code {retcode})")
+        raise SystemExit(1)
+    return image
+
+
+# -------------------------------------------------------------
+# erofs – tar-Stream mit Soll-Metadaten direkt in mkfs.erofs
+# -------------------------------------------------------------
+
+TAR_TYPES = {
+    "file": tarfile.REGTYPE,
+    "dir": tarfile.DIRTYPE,
+    "link": tarfile.SYMTYPE,
+    "char": tarfile.CHRTYPE,
+    "block": tarfile.BLKTYPE,
+    "fifo": tarfile.FIFOTYPE,
+}
+
+
+def write_tar_stream(rootfs_dir: Path, meta_entries: dict, out) -> int:
+    """Streamt das RootFS als tar (PAX) mit Owner/Modi/Devices aus der Metadaten-DB"""
+    count = 0
+    links: dict[tuple[int, int], str] = {}
+
+    with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for rel, path, st, md in iter_rootfs(rootfs_dir, meta_entries):
+            if not rel:
+                continue
+
+            ti = tarfile.TarInfo(rel)
+            ti.type = TAR_TYPES[md["kind"]]
+            ti.mode = stat.S_IMODE(md["mode"])
+            ti.uid, ti.gid = md["uid"], md["gid"]
+            ti.uname = ti.gname = ""
+            ti.mtime = int(st.st_mtime)
+
+            if md["kind"] == "file" and stat.S_ISREG(st.st_mode) and st.st_nlink > 1 and (st.st_dev, st.st_ino) in links:
+                ti.type = tarfile.LNKTYPE
+                ti.linkname = links[(st.st_dev, st.st_ino)]
+                tar.addfile(ti)
+            elif md["kind"] == "file" and stat.S_ISREG(st.st_mode):
+                if st.st_nlink > 1:
+                    links[(st.st_dev, st.st_ino)] = rel
+                ti.size = st.st_size
+                with open(path, "rb") as f:
+                    tar.addfile(ti, f)
+            else:
+                if md["kind"] == "link":
+                    ti.linkname = os.readlink(path)
+                elif md["kind"] in ("char", "block"):
+                    ti.devmajor, ti.devminor = md["major"] or 0, md["minor"] or 0
+                tar.addfile(ti)
+            count += 1
+
+    return count
+
+
+def build_erofs(rootfs_dir: Path, image: Path, meta_entries: dict, jobs: int, compression: str = "lz4hc") -> Path:
+    _require("mkfs.erofs")
+
+    cmd = ["mkfs.erofs", "--tar=f", f"-z{compression}"]
+    help_text = subprocess.run(["mkfs.erofs", "--help"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True).stdout
+    if "--workers" in help_text:
+        cmd.append(f"--workers={jobs}")
+    cmd += [str(image), "/dev/stdin"]
+
+    info(f"[image] erofs: {' '.join(cmd)}")
+    with tempfile.TemporaryFile() as log:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            write_tar_stream(rootfs_dir, meta_entries, proc.stdin)
+        finally:
+            proc.stdin.close()
+            retcode = proc.wait()
+        log.seek(0)
+        output = log.read().decode(errors="replace")
+
+    if retcode != 0:
+        error(f"[image] mkfs.erofs fehlgeschlagen:\n{output}")
+        raise SystemExit(1)
+    return image
+
+
+# -------------------------------------------------------------
+# squashfs – mksquashfs mit Pseudo-Datei für Owner/Modi/Devices
+# -------------------------------------------------------------
+
+def _pseudo_path(rel: str) -> str:
+    return "/" + rel.replace("\\", "\\\\").replace(" ", "\\ ") if rel else "/"
+
+
+def build_squashfs(rootfs_dir: Path, image: Path, meta_entries: dict, jobs: int, compression: str = "zstd") -> Path:
+    _require("mksquashfs")
+
+    pseudo_file = image.with_suffix(".pseudo")
+    exclude_file = image.with_suffix(".exclude")
+
+    with open(pseudo_file, "w") as pf, open(exclude_file, "w") as ef:
+        for rel, path, st, md in iter_rootfs(rootfs_dir, meta_entries):
+            perm = f"{stat.S_IMODE(md['mode']):o}"
+            if md["kind"] in ("char", "block") and not stat.S_ISCHR(st.st_mode) and not stat.S_ISBLK(st.st_mode):
+                # Platzhalter auf der Platte ausschließen, echten Node als Pseudo-Eintrag anlegen
+                ef.write(rel + "\n")
+                kind = "c" if md["kind"] == "char" else "b"
+                pf.write(f"{_pseudo_path(rel)} {kind} {perm} {md['uid']} {md['gid']} {md['major']} {md['minor']}\n")
+            elif md["kind"] != "link":
+                pf.write(f"{_pseudo_path(rel)} m {perm} {md['uid']} {md['gid']}\n")
+
+    cmd = [
+        "mksquashfs", str(rootfs_dir), str(image),
+        "-noappend", "-no-progress",
+        "-comp", compression,
+        "-processors", str(jobs),
+        "-all-root",
+        "-pf", str(pseudo_file),
+        "-ef", str(exclude_file),
+    ]
+    try:
+        _run(cmd, desc="squashfs")
+    finally:
+        pseudo_file.unlink(missing_ok=True)
+        exclude_file.unlink(missing_ok=True)
+    return image
+
+
+# -------------------------------------------------------------
+# ext4 – mkfs.ext4 -d aus einem tar mit Soll-Metadaten (e2fsprogs >= 1.47.1),
+# sonst aus dem Verzeichnis und nur abweichende Owner/Modi/Devices per debugfs
+# -------------------------------------------------------------
+
+EXT4_TAR_VERSION = (1, 47, 1)
+
+
+def _ext4_size(rootfs_dir: Path, meta_entries: dict, extra_mb: int) -> int:
+    seen = set()
+    for _, _, st, _ in iter_rootfs(rootfs_dir, meta_entries):
+        seen.add((st.st_ino, st.st_blocks))
+    used = sum(blocks * 512 for _, blocks in seen)
+    size = int(used * 1.25) + len(seen) * 256 + extra_mb * 1024 * 1024
+    step = 4 * 1024 * 1024
+    return max(64 * 1024 * 1024, (size + step - 1) // step * step)
+
+
+def _mke2fs_version() -> tuple[int, ...]:
+    result = subprocess.run(["mkfs.ext4", "-V"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    match = re.search(r"mke2fs (\d+)\.(\d+)(?:\.(\d+))?", result.stdout)
+    return tuple(int(part or 0) for part in match.groups()) if match else ()
+
+
+def _debugfs_quote(path: str) -> str:
+    return '"' + path.replace('"', '\\"') + '"'
+
+
+def ext4_debugfs_commands(rootfs_dir: Path, meta_entries: dict) -> list[str]:
+    """
+    debugfs-Befehle für alles, was mkfs.ext4 -d nicht schon korrekt aus dem Baum übernimmt:
+    Device Nodes (Platzhalter ersetzen) und von der Platte abweichende Modi/Owner.
+    """
+    commands = []
+    for rel, path, st, md in iter_rootfs(rootfs_dir, meta_entries):
+        if not rel:
+            continue
+        target = _debugfs_quote("/" + rel)
+        # Was nach mkfs.ext4 -d (bzw. debugfs mknod) im Inode steht
+        written = (st.st_mode, st.st_uid, st.st_gid)
+        if md["kind"] in ("char", "block") and stat.S_IFMT(st.st_mode) != stat.S_IFMT(md["mode"]):
+            # debugfs mknod legt den Namen im aktuellen Verzeichnis an (Modus ohne Rechte, root:root)
+            parent, _, node = ("/" + rel).rpartition("/")
+            commands += [
+                f"rm {target}",
+                f"cd {_debugfs_quote(parent or '/')}",
+                f"mknod {_debugfs_quote(node)} {'c' if md['kind'] == 'char' else 'b'} {md['major']} {md['minor']}",
+                "cd /",
+            ]
+            written = (stat.S_IFMT(md["mode"]), 0, 0)
+        if md["mode"] != written[0]:
+            commands.append(f"sif {target} mode 0{md['mode']:o}")
+        if md["uid"] != written[1]:
+            commands.append(f"sif {target} uid {md['uid']}")
+        if md["gid"] != written[2]:
+            commands.append(f"sif {target} gid {md['gid']}")
+    return commands
+
+
+def _build_ext4_from_tar(rootfs_dir: Path, image: Path, meta_entries: dict) -> bool:
+    """mkfs.ext4 -d <tar>: Owner/Modi/Devices stehen schon im tar, kein debugfs nötig"""
+    with tempfile.NamedTemporaryFile(prefix=".rootfs-", suffix=".tar", dir=image.parent) as tar_file:
+        write_tar_stream(rootfs_dir, meta_entries, tar_file)
+        tar_file.flush()
+        cmd = ["mkfs.ext4", "-q", "-F", "-d", tar_file.name, "-E", "root_owner=0:0", str(image)]
+        info(f"[image] ext4: {' '.join(cmd)}")
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        # z.B. e2fsprogs ohne libarchive
+        warning(f"[image] mkfs.ext4 -d <tar> fehlgeschlagen, nutze debugfs:\n{result.stdout}")
+        return False
+    return True
+
+
+def build_ext4(rootfs_dir: Path, image: Path, meta_entries: dict, jobs: int, extra_mb: int = 64) -> Path:
+    _require("mkfs.ext4")
+
+    size = _ext4_size(rootfs_dir, meta_entries, extra_mb)
+
+    # Sparse anlegen, mkfs.ext4 schreibt nur belegte Blöcke
+    image.unlink(missing_ok=True)
+    with open(image, "wb") as f:
+        f.truncate(size)
+
+    if _mke2fs_version() >= EXT4_TAR_VERSION and _build_ext4_from_tar(rootfs_dir, image, meta_entries):
+        return image
+
+    _require("debugfs")
+    _run(["mkfs.ext4", "-q", "-F", "-d", str(rootfs_dir), "-E", "root_owner=0:0", str(image)], desc="ext4")
+
+    commands = ext4_debugfs_commands(rootfs_dir, meta_entries)
+    if not commands:
+        return image
+
+    script = image.with_suffix(".debugfs")
+    script.write_text("".join(f"{command}\n" for command in commands))
+    try:
+        _run(["debugfs", "-w", "-f", str(script), str(image)], desc=f"ext4 Metadaten ({len(commands)} Befehle)")
+    finally:
+        script.unlink(missing_ok=True)
+    return image
+
+
+# =============================================================================
+# MAIN ENTRY FUNCTION
+# =============================================================================
+
+def build_rootfs_image(fmt: str, rootfs_dir: Path, output_dir: Path, meta=None, jobs: int | None = None,
+                       compression: str | None = None, name: str = "rootfs") -> dict:
+    """
+    Erstellt ein Image im Format fmt aus rootfs_dir nach output_dir.
+    Gibt einen Report mit Pfad, Größe (apparent/belegt) und Dauer zurück.
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Unbekanntes Image-Format: {fmt}. Unterstützt: {', '.join(IMAGE_FORMATS)}")
+
+    rootfs_dir = Path(rootfs_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    jobs = jobs or os.cpu_count() or 1
+    meta_entries = meta.snapshot() if meta is not None else {}
+
+    image = output_dir / f"{name}{IMAGE_SUFFIXES[fmt]}"
+    start(f"[image] Erstelle {fmt}-Image aus {rootfs_dir} ...")
+    began = time.monotonic()
+
+    if fmt == "ext4":
+        image = build_ext4(rootfs_dir, image, meta_entries, jobs)
+    elif fmt == "squashfs":
+        image = build_squashfs(rootfs_dir, image, meta_entries, jobs, compression or "zstd")
+    elif fmt == "erofs":
+        image = build_erofs(rootfs_dir, image, meta_entries, jobs, compression or "lz4hc")
+    else:
+        image = build_cpio(rootfs_dir, image, meta_entries, jobs, compression or "zstd")
+
+    elapsed = time.monotonic() - began
+    st = image.stat()
+    report = {
+        "format": fmt,
+        "path": image,
+        "size": st.st_size,
+        "allocated": st.st_blocks * 512,
+        "seconds": elapsed,
+    }
+    success(
+        f"[image] {image.name}: {st.st_size / 1024 / 1024:.1f} MiB "
+        f"({report['allocated'] / 1024 / 1024:.1f} MiB belegt) in {elapsed:.1f}s"
+    )
+    return report
+
+
+def build_rootfs_images(formats: list[str], rootfs_dir: Path, output_dir: Path, meta=None, jobs: int | None = None) -> list[dict]:
+    return [build_rootfs_image(fmt, rootfs_dir, output_dir, meta=meta, jobs=jobs) for fmt in formats]
@@ -1,4 +1,6 @@
+import os
 import json
+import hashlib
 import subprocess
 import shutil
 
@@ -7,6 +9,7 @@ from pathlib import Path
 
 
 from utils.execute import run_command_live
+from utils.git_mirror import prepare_source
 
 from core.logger import success, info, warning, error, start, stop, pause, install
 
@@ -17,6 +20,20 @@ from core.logger import success, info, warning, error, start, stop, pause, insta
 # KERNEL BUILDER
 # =============================================================================
 
+KERNEL_IMAGE_TARGETS = {
+    "x86_64": ("bzImage", "arch/x86/boot/bzImage"),
+    "arm64": ("Image", "arch/arm64/boot/Image"),
+}
+
+MODULE_COMPRESS_OPTIONS = {
+    "zstd": "CONFIG_MODULE_COMPRESS_ZSTD",
+    "xz": "CONFIG_MODULE_COMPRESS_XZ",
+    "gzip": "CONFIG_MODULE_COMPRESS_GZIP",
+}
+
+CONFIG_STAMP = ".nexuzcore-config-stamp"
+
+
 def load_kernel_config(configs_dir: Path, arch: str):
     config_file = configs_dir / "kernel.json"
 
@@ -34,95 +51,191 @@ def load_kernel_config(configs_dir: Path, arch: str):
     return data[arch]
 
 
-def clone_or_update_repo(repo_url: str, dest: Path):
-    if dest.exists():
-        info(f"[kernel] Repository existiert bereits. Pull...")
-        run_command_live(["git", "-C", str(dest), "pull"])
-    else:
-        info(f"[kernel] Klone Kernel-Repository {repo_url} ...")
-        run_command_live(["git", "clone", "--depth=1", repo_url, str(dest)])
-
-
-def apply_defconfig(kernel_src: Path, defconfig: str, arch: str):
-    info(f"[kernel] Verwende Defconfig: {defconfig}")
-
-    env = dict(**{**dict()}, ARCH=arch)
+def kernel_env(arch: str) -> dict:
+    """Build-Umgebung für alle make-Aufrufe (inkl. PATH des Hosts)"""
+    env = os.environ.copy()
+    env["ARCH"] = arch
 
     if arch == "arm64":
         env["CROSS_COMPILE"] = "aarch64-linux-gnu-"
 
-    run_command_live(
-        ["make", defconfig],
-        cwd=str(kernel_src),
-        env=env
-    )
+    return env
 
 
-def build_kernel_commands(kernel_src: Path, arch: str, jobs: int):
-    info(f"[kernel] Kompiliere Kernel für {arch} ...")
+def _make(kernel_src: Path, obj_dir: Path, targets: list[str], env: dict, jobs: int | None = None, desc="make"):
+    """Ein make-Aufruf gegen den Out-of-Tree Objektbaum, bricht bei Fehler ab"""
+    cmd = ["make", f"O={obj_dir}"]
+    if jobs:
+        cmd.append(f"-j{jobs}")
+    cmd += targets
 
-    env = {"ARCH": arch}
+    if not run_command_live(cmd, cwd=kernel_src, env=env, desc=desc):
+        error(f"[kernel] {desc} fehlgeschlagen!")
+        raise SystemExit(1)
 
-    if arch == "arm64":
-        env["CROSS_COMPILE"] = "aarch64-linux-gnu-"
 
-    # Kernel
-    run_command_live(
-        ["make", f"-j{jobs}"],
-        cwd=str(kernel_src),
-        env=env
-    )
-
-    # Module
-    run_command_live(
-        ["make", "modules", f"-j{jobs}"],
-        cwd=str(kernel_src),
-        env=env
-    )
-
-    # Device Trees für ARM
-    if arch == "arm64":
-        run_command_live(
-            ["make", "dtbs", f"-j{jobs}"],
-            cwd=str(kernel_src),
-            env=env
-        )
+def clone_or_update_repo(repo_url: str, dest: Path, work_dir: Path, ref: str = "master", depth: int | None = 1) -> str:
+    """Checkt den gepinnten Kernel-Ref als Worktree aus dem gemeinsamen Git-Mirror aus"""
+    info(f"[kernel] Hole Kernel-Quellen {repo_url} @ {ref} ...")
+    _, commit = prepare_source(repo_url, ref, dest, work_dir, depth=depth)
+    return commit
+
+
+def _config_fragments(kernel_cfg: dict, configs_dir: Path, obj_dir: Path) -> list[Path]:
+    """
+    Sammelt alle .config-Fragmente: Dateien aus "config_fragments" sowie
+    Inline-Optionen aus "config" und "module_compress" als generiertes Fragment.
+    """
+    fragments = [configs_dir / frag for frag in kernel_cfg.get("config_fragments", [])]
+
+    for frag in fragments:
+        if not frag.exists():
+            error(f"[kernel] Config-Fragment nicht gefunden: {frag}")
+            raise SystemExit(1)
+
+    inline = dict(kernel_cfg.get("config", {}))
+    compress = kernel_cfg.get("module_compress")
+    if compress:
+        if compress not in MODULE_COMPRESS_OPTIONS:
+            error(f"[kernel] Unbekannte Modul-Kompression: {compress}")
+            raise SystemExit(1)
+        # Nur das Choice-Symbol; ein eigenes CONFIG_MODULE_COMPRESS gibt es seit 5.13 nicht mehr
+        inline[MODULE_COMPRESS_OPTIONS[compress]] = "y"
+
+    if inline:
+        inline_frag = obj_dir / "nexuzcore-inline.config"
+        content = "".join(f"{key}={val}\n" for key, val in sorted(inline.items()))
+        if not inline_frag.exists() or inline_frag.read_text() != content:
+            inline_frag.write_text(content)
+        fragments.append(inline_frag)
+
+    return fragments
+
+
+def apply_defconfig(kernel_src: Path, obj_dir: Path, defconfig: str, fragments: list[Path], env: dict, commit: str = ""):
+    """
+    Erzeugt die .config im Objektbaum aus Defconfig + Fragmenten.
+    Unveränderte Eingaben (Stamp) überspringen den Schritt komplett, der
+    Objektbaum wird nie gelöscht, damit Kbuild nur Betroffenes neu baut.
+    """
+    obj_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256(f"{defconfig}\0{commit}".encode())
+    for frag in fragments:
+        digest.update(frag.read_bytes())
+    stamp = digest.hexdigest()
+
+    stamp_file = obj_dir / CONFIG_STAMP
+    if (obj_dir / ".config").exists() and stamp_file.exists() and stamp_file.read_text() == stamp:
+        info("[kernel] .config unverändert, überspringe Konfiguration.")
+        return
+
+    info(f"[kernel] Verwende Defconfig: {defconfig} (+{len(fragments)} Fragmente)")
+    _make(kernel_src, obj_dir, [defconfig], env, desc=f"Kernel {defconfig}")
+
+    if fragments:
+        merge = ["scripts/kconfig/merge_config.sh", "-m", "-O", str(obj_dir), str(obj_dir / ".config")]
+        merge += [str(frag) for frag in fragments]
+        if not run_command_live(merge, cwd=kernel_src, env=env, desc="Kernel Config-Fragmente mergen"):
+            error("[kernel] Mergen der Config-Fragmente fehlgeschlagen!")
+            raise SystemExit(1)
+        _make(kernel_src, obj_dir, ["olddefconfig"], env, desc="Kernel olddefconfig")
+
+    stamp_file.write_text(stamp)
+
+
+def kernel_targets(kernel_cfg: dict, arch: str, dtbs: list[str]) -> list[str]:
+    """Alle make-Targets für einen einzigen parallelen Build-Aufruf"""
+    build = kernel_cfg.get("modules", {})
+    targets = []
+
+    if build.get("kernel", True):
+        targets.append(KERNEL_IMAGE_TARGETS[arch][0])
+    if build.get("modules", True):
+        targets.append("modules")
+    if build.get("dtbs", True) and arch == "arm64":
+        # Nur die DTBs des Boards bauen, sonst alle
+        targets += dtbs if dtbs else ["dtbs"]
+
+    return targets
+
+
+def build_kernel_commands(kernel_src: Path, obj_dir: Path, arch: str, jobs: int, targets: list[str], env: dict):
+    info(f"[kernel] Kompiliere Kernel für {arch}: {' '.join(targets)} ...")
+    _make(kernel_src, obj_dir, targets, env, jobs=jobs, desc="Kernel kompilieren")
+
+
+def install_dtbs(obj_dir: Path, boot_dir: Path, dtbs: list[str]):
+    """Kopiert nur gebaute DTBs (laut Board-Manifest) statt des dts-Quellbaums"""
+    dts_dir = obj_dir / "arch/arm64/boot/dts"
+    out = boot_dir / "dtbs"
+
+    if out.exists():
+        shutil.rmtree(out)
+
+    if dtbs:
+        blobs = [dts_dir / dtb for dtb in dtbs]
+        missing = [str(blob) for blob in blobs if not blob.exists()]
+        if missing:
+            error(f"[kernel] DTBs nicht gebaut: {', '.join(missing)}")
+            raise SystemExit(1)
+    else:
+        blobs = [p for p in dts_dir.rglob("*") if p.suffix in (".dtb", ".dtbo")]
+
+    for blob in blobs:
+        dest = out / blob.relative_to(dts_dir)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(blob, dest)
+
+    info(f"[kernel] {len(blobs)} DTBs nach {out} installiert.")
 
 
-def install_kernel(kernel_src: Path, output_dir: Path, arch: str):
+def install_kernel(kernel_src: Path, obj_dir: Path, output_dir: Path, arch: str, jobs: int, env: dict,
+                   kernel_cfg: dict, dtbs: list[str]):
     boot_dir = output_dir / "boot"
     modules_dir = output_dir / "lib/modules"
+    build = kernel_cfg.get("modules", {})
 
     boot_dir.mkdir(parents=True, exist_ok=True)
     modules_dir.mkdir(parents=True, exist_ok=True)
 
-    if arch == "x86_64":
-        kernel_image = kernel_src / "arch/x86/boot/bzImage"
-    else:
-        kernel_image = kernel_src / "arch/arm64/boot/Image"
+    if build.get("kernel", True):
+        kernel_image = obj_dir / KERNEL_IMAGE_TARGETS[arch][1]
 
-    if not kernel_image.exists():
-        error("Kernel Image wurde nicht erstellt!")
-        raise SystemExit(1)
+        if not kernel_image.exists():
+            error("Kernel Image wurde nicht erstellt!")
+            raise SystemExit(1)
 
-    shutil.copy(kernel_image, boot_dir / "kernel.img")
+        shutil.copy(kernel_image, boot_dir / "kernel.img")
 
-    # Module installieren
-    run_command_live([
-        "make",
-        f"INSTALL_MOD_PATH={output_dir}",
-        "modules_install"
-    ], cwd=str(kernel_src))
+    # Module installieren: parallel gestrippt, Kompression über CONFIG_MODULE_COMPRESS_*
+    if build.get("modules", True):
+        targets = [f"INSTALL_MOD_PATH={output_dir}", "modules_install"]
+        if kernel_cfg.get("strip_modules", True):
+            targets.insert(0, "INSTALL_MOD_STRIP=1")
+        _make(kernel_src, obj_dir, targets, env, jobs=jobs, desc="Kernel Module installieren")
 
     # Device Trees für ARM64
-    if arch == "arm64":
-        dtb_dir = kernel_src / "arch/arm64/boot/dts"
-        out = boot_dir / "dtbs"
-        shutil.copytree(dtb_dir, out, dirs_exist_ok=True)
+    if build.get("dtbs", True) and arch == "arm64":
+        install_dtbs(obj_dir, boot_dir, dtbs)
 
     success("[kernel] Kernel erfolgreich installiert.")
 
 
+def board_dtbs(kernel_cfg: dict, board: str | None) -> list[str]:
+    """DTB-Liste aus dem Board-Manifest (leer = alle DTBs)"""
+    boards = kernel_cfg.get("boards", {})
+    board = board or kernel_cfg.get("board")
+
+    if not board:
+        return []
+    if board not in boards:
+        error(f"Board '{board}' nicht in kernel.json definiert!")
+        raise SystemExit(1)
+
+    return boards[board].get("dtbs", [])
+
+
 # =============================================================================
 # MAIN ENTRY FUNCTION
 # =============================================================================
@@ -135,21 +248,27 @@ def build_kernel(args, work_dir: Path, downloads_dir: Path, output_dir: Path):
 
     # 1) Kernel-Konfiguration aus kernel.json laden
     kernel_cfg = load_kernel_config(configs_dir, arch)
-    repo_url = kernel_cfg["repo_url"]
+    repo_url = kernel_cfg.get("repo_url") or kernel_cfg["repository"]
+    ref = kernel_cfg.get("ref", "master")
     defconfig = kernel_cfg["defconfig"]
+    dtbs = board_dtbs(kernel_cfg, getattr(args, "board", None))
 
     kernel_src = downloads_dir / f"kernel-{arch}"
+    obj_dir = (work_dir / "build" / "kernel" / arch).resolve()
+    env = kernel_env(arch)
 
-    # 2) Repository klonen oder aktualisieren
-    clone_or_update_repo(repo_url, kernel_src)
+    # 2) Worktree aus dem Git-Mirror auschecken (ein Mirror für alle Archs)
+    commit = clone_or_update_repo(repo_url, kernel_src, work_dir, ref=ref, depth=kernel_cfg.get("depth", 1))
 
-    # 3) Defconfig anwenden
-    apply_defconfig(kernel_src, defconfig, arch)
+    # 3) Defconfig + Fragmente anwenden (nur bei Änderungen)
+    obj_dir.mkdir(parents=True, exist_ok=True)
+    fragments = _config_fragments(kernel_cfg, configs_dir, obj_dir)
+    apply_defconfig(kernel_src, obj_dir, defconfig, fragments, env, commit=commit)
 
-    # 4) Kernel kompilieren
-    build_kernel_commands(kernel_src, arch, jobs)
+    # 4) Kernel, Module und DTBs in einem parallelen make-Lauf kompilieren
+    build_kernel_commands(kernel_src, obj_dir, arch, jobs, kernel_targets(kernel_cfg, arch, dtbs), env)
 
     # 5) Kernel & Module ins Output-Verzeichnis installieren
-    install_kernel(kernel_src, output_dir, arch)
+    install_kernel(kernel_src, obj_dir, output_dir, arch, jobs, env, kernel_cfg, dtbs)
 
     success(f"[kernel] Build für {arch} abgeschlossen.")
@@ -0,0 +1,250 @@
+import os
+import stat
+import shutil
+import tarfile
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.fswalk import parallel_walk
+from utils.elf import ElfFile, ELF_MAGIC, ET_REL, ET_EXEC, ET_DYN, MACHINE_PREFIXES, toolchain_prefix, host_machine
+
+from core.logger import success, info, warning, error, start
+
+
+
+
+# =============================================================================
+# ELF STRIP + DEBUG SPLIT
+# =============================================================================
+# Findet ELF-Dateien im RootFS per Magic-Bytes, strippt sie parallel mit den
+# Binutils der Zielarchitektur und legt die Debug-Infos optional nach Build-ID
+# ab (usr/lib/debug/.build-id/xx/yyyy.debug) – gepackt als eigenes Archiv.
+
+STRIP_MODES = ("strip", "split", "none")
+
+MODULE_SIGNATURE = b"~Module signature appended~\n"
+DEBUG_PREFIX = "usr/lib/debug"
+
+_tool_cache: dict[tuple[int, str], str | None] = {}
+_tool_lock = threading.Lock()
+
+
+def binutil(machine: int, tool: str) -> str | None:
+    """
+    <prefix>strip/objcopy für e_machine; auf dem Host auch ohne Präfix, sonst llvm-*.
+    Unbekannte Architekturen (z.B. DSP-Firmware) -> None, nie das Host-Tool.
+    """
+    key = (machine, tool)
+    with _tool_lock:
+        if key not in _tool_cache:
+            candidates = [f"{toolchain_prefix(machine)}{tool}"] if machine in MACHINE_PREFIXES else []
+            if machine == host_machine():
+                candidates.append(tool)
+            if candidates:
+                candidates.append(f"llvm-{tool}")
+            _tool_cache[key] = next((c for c in candidates if shutil.which(c)), None)
+        return _tool_cache[key]
+
+
+def _run(cmd: list[str]):
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} fehlgeschlagen:\n{result.stdout}")
+
+
+def _is_signed_module(path: str, size: int) -> bool:
+    if not path.endswith(".ko") or size < len(MODULE_SIGNATURE):
+        return False
+    with open(path, "rb") as f:
+        f.seek(size - len(MODULE_SIGNATURE))
+        return f.read() == MODULE_SIGNATURE
+
+
+def find_elf_files(root: Path, jobs: int | None = None) -> dict[tuple[int, int], list[str]]:
+    """Alle ELF-Dateien (per Magic) als inode -> [rel, ...], Debug-Verzeichnis ausgenommen"""
+    def visit(entry: os.DirEntry, rel: str):
+        if rel.startswith(DEBUG_PREFIX):
+            return None
+        st = entry.stat(follow_symlinks=False)
+        if not stat.S_ISREG(st.st_mode) or st.st_size < 64:
+            return None
+        with open(entry.path, "rb") as f:
+            if f.read(4) != ELF_MAGIC:
+                return None
+        return (st.st_dev, st.st_ino), rel
+
+    inodes: dict[tuple[int, int], list[str]] = {}
+    for inode, rel in parallel_walk(root, visit, jobs=jobs):
+        inodes.setdefault(inode, []).append(rel)
+    return {inode: sorted(rels) for inode, rels in inodes.items()}
+
+
+def _debug_name(build_id: str | None, rel: str) -> str:
+    if build_id and len(build_id) > 2:
+        return f".build-id/{build_id[:2]}/{build_id[2:]}.debug"
+    return f"{rel}.debug"
+
+
+def _strip_one(root: Path, rels: list[str], debug_dir: Path | None) -> dict | None:
+    """Strippt eine Datei (alle Hardlinks bleiben erhalten). None = nichts zu tun."""
+    path = root / rels[0]
+    st = path.stat()
+
+    try:
+        with ElfFile(path) as elf:
+            # Objekte/Module behalten ihre Symboltabelle, dort zählen nur Debug-Sections
+            if elf.type not in (ET_REL, ET_EXEC, ET_DYN) or not elf.has_debug(symbols=elf.type != ET_REL):
+                return None
+            machine, etype, build_id = elf.machine, elf.type, elf.build_id()
+    except ValueError:
+        return None
+
+    if etype == ET_REL and _is_signed_module(str(path), st.st_size):
+        return None
+
+    if machine not in MACHINE_PREFIXES and machine != host_machine():
+        return {"rel": rels[0], "error": f"unbekannte e_machine {machine:#x}"}
+
+    strip = binutil(machine, "strip")
+    if strip is None:
+        return {"rel": rels[0], "error": f"kein strip für e_machine {machine:#x}"}
+
+    debug_name = debug_file = None
+    tmp = path.with_name(f".{path.name}.strip-{os.getpid()}")
+    try:
+        if debug_dir is not None:
+            objcopy = binutil(machine, "objcopy")
+            if objcopy is None:
+                return {"rel": rels[0], "error": f"kein objcopy für e_machine {machine:#x}"}
+            debug_name = _debug_name(build_id, rels[0])
+            debug_file = debug_dir / debug_name
+            debug_file.parent.mkdir(parents=True, exist_ok=True)
+            _run([objcopy, "--only-keep-debug", "--compress-debug-sections", str(path), str(debug_file)])
+
+        # Module/Objekte nur Debug-Infos, sonst alles Unnötige (dynamische Symbole bleiben)
+        args = ["--strip-debug"] if etype == ET_REL else ["--strip-unneeded", "--remove-section=.comment"]
+        _run([strip, *args, "-o", str(tmp), str(path)])
+        os.chmod(tmp, stat.S_IMODE(st.st_mode))
+        os.replace(tmp, path)
+    except (RuntimeError, OSError) as e:
+        # Ein kaputtes Objekt darf den Build nicht abbrechen; halbe Debug-Datei verwerfen
+        if debug_file is not None:
+            debug_file.unlink(missing_ok=True)
+        return {"rel": rels[0], "error": str(e).splitlines()[0]}
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    # Weitere Hardlinks wieder auf den gestrippten Inode zeigen lassen
+    for rel in rels[1:]:
+        link_tmp = root / f"{rel}.strip-{os.getpid()}"
+        os.link(path, link_tmp)
+        os.replace(link_tmp, root / rel)
+
+    return {
+        "rel": rels[0],
+        "saved": st.st_size - path.stat().st_size,
+        "build_id": build_id,
+        "debug": debug_name,
+    }
+
+
+def update_debug_index(debug_dir: Path, results: list[dict]) -> Path:
+    """
+    Pflegt debug_dir/index.tsv (build-id, pfad im rootfs, debug-datei).
+    Einträge früherer Läufe bleiben erhalten, da bereits gestrippte Dateien nicht erneut auftauchen.
+    """
+    index = debug_dir / "index.tsv"
+    entries = {}
+    if index.exists():
+        for line in index.read_text().splitlines():
+            build_id, rel, debug = line.split("\t")
+            entries[rel] = (build_id, debug)
+    for result in results:
+        if result.get("debug"):
+            entries[result["rel"]] = (result["build_id"] or "-", result["debug"])
+
+    with open(index, "w") as f:
+        for rel in sorted(entries):
+            build_id, debug = entries[rel]
+            f.write(f"{build_id}\t{rel}\t{debug}\n")
+    return index
+
+
+def write_debug_archive(debug_dir: Path, archive: Path) -> Path:
+    """Packt debug_dir als usr/lib/debug/... in ein tar (zstd wenn vorhanden, sonst gzip)"""
+    archive.parent.mkdir(parents=True, exist_ok=True)
+
+    files = sorted(p for p in debug_dir.rglob("*") if p.is_file())
+    if shutil.which("zstd"):
+        archive = archive.with_name(archive.name.split(".tar")[0] + ".tar.zst")
+        with open(archive, "wb") as out:
+            proc = subprocess.Popen(["zstd", "-q", "-T0", "-19"], stdin=subprocess.PIPE, stdout=out)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                    for p in files:
+                        tar.add(p, arcname=f"{DEBUG_PREFIX}/{p.relative_to(debug_dir)}")
+            finally:
+                proc.stdin.close()
+                if proc.wait() != 0:
+                    raise RuntimeError("zstd fehlgeschlagen")
+    else:
+        archive = archive.with_name(archive.name.split(".tar")[0] + ".tar.gz")
+        with tarfile.open(archive, "w:gz", format=tarfile.PAX_FORMAT) as tar:
+            for p in files:
+                tar.add(p, arcname=f"{DEBUG_PREFIX}/{p.relative_to(debug_dir)}")
+
+    return archive
+
+
+# =============================================================================
+# MAIN ENTRY FUNCTION
+# =============================================================================
+
+def strip_rootfs(root: Path, mode: str = "split", debug_dir: Path | None = None, archive: Path | None = None,
+                 jobs: int | None = None) -> dict:
+    """
+    mode: "strip" (nur strippen), "split" (Debug-Infos vorher nach debug_dir/archive retten), "none".
+    Gibt einen Report mit files, bytes, archive zurück.
+    """
+    if mode not in STRIP_MODES:
+        raise ValueError(f"Unbekannter Strip-Modus: {mode}")
+    report = {"files": 0, "bytes": 0, "archive": None}
+    if mode == "none":
+        return report
+
+    root = Path(root)
+    if mode == "split":
+        if debug_dir is None:
+            raise ValueError("split benötigt debug_dir")
+        debug_dir = Path(debug_dir)
+        debug_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        debug_dir = None
+
+    start(f"[strip] Suche ELF-Dateien in {root} ...")
+    inodes = find_elf_files(root, jobs=jobs)
+    info(f"[strip] {len(inodes)} ELF-Dateien gefunden.")
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        results = [r for r in pool.map(lambda rels: _strip_one(root, rels, debug_dir), inodes.values()) if r]
+
+    failed = [r for r in results if "error" in r]
+    for r in failed[:10]:
+        warning(f"[strip] {r['rel']} übersprungen: {r['error']}")
+    done = [r for r in results if "error" not in r]
+
+    report["files"] = len(done)
+    report["bytes"] = sum(r["saved"] for r in done)
+
+    if debug_dir is not None:
+        update_debug_index(debug_dir, done)
+    if debug_dir is not None and archive is not None:
+        report["archive"] = write_debug_archive(debug_dir, Path(archive))
+        info(f"[strip] Debug-Symbole: {report['archive']}")
+
+    success(f"[strip] {report['files']} Dateien gestrippt, {report['bytes'] / 1024 / 1024:.1f} MiB gespart"
+            + (f", {len(failed)} übersprungen." if failed else "."))
+    return report
@@ -6,16 +6,14 @@ import json
 
 
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
 from utils.load import load_config
+from utils.fsmeta import FSMetadata
 from utils.create import (
-    create_directories,
-    create_etc_files,
-    create_busybox_init,
-    create_dev_nodes,
-    create_symlinks,
+    create_rootfs_layout,
     set_rootfs_permissions,
     copy_qemu_user_static
 )
@@ -24,6 +22,15 @@ from utils.create import (
 from core.modify_rootfs import chroot_with_qemu
 
 from core.busybox import get_configs, build_busybox
+from core.image import build_rootfs_images, build_rootfs_image, IMAGE_FORMATS
+from core.disk_image import build_firmware_image
+from core.strip import strip_rootfs, STRIP_MODES
+from core.elfdeps import prune_libraries
+
+from utils.manifest import generate_manifest
+from utils.dedup import dedup_rootfs, DEDUP_METHODS
+from utils.pathfilter import PathFilter
+from utils.shared_cache import set_default_cache, default_cache
 
 
 from tools.host_check import check_host_prerequisites
@@ -53,6 +60,9 @@ output_dir = work_dir / "output"
 rootfs_dir = build_dir / "rootfs"
 bootfs_dir = build_dir / "bootfs"
 kernel_dir = build_dir / "kernel"
+rootfs_meta_db = build_dir / "rootfs-meta.sqlite"
+rootfs_hash_cache = build_dir / "rootfs-hashcache.json"
+debug_dir = build_dir / "debug"
 
 kernel_output = output_dir / "kernel"
 bootfs_output = output_dir / "bootfs"
@@ -125,6 +135,34 @@ def parse():
     parser.add_argument("--ignore-host-tools", action="store_true", 
                         help="Ignores missing Host-Tools in check.")
     
+    parser.add_argument("--image", nargs="+", choices=IMAGE_FORMATS, default=[],
+                        help="Write RootFS-Images (ext4, squashfs, erofs, cpio) into the firmware output.")
+    
+    parser.add_argument("--shared-cache", type=Path, default=os.environ.get("NEXUZCORE_CACHE_DIR"),
+                        help="Host-wide download/package cache shared by concurrent builds (locked, single-flight).")
+    
+    lock = parser.add_mutually_exclusive_group()
+    lock.add_argument("--locked", action="store_true",
+                        help="Install exactly the packages from work/output/rootfs/packages.lock.json (no dependency resolution).")
+    
+    lock.add_argument("--update-lock", action="store_true",
+                        help="Re-resolve packages.json and write work/output/rootfs/packages.lock.json (default: resolve, no lockfile).")
+    
+    parser.add_argument("--install-profile", type=str, default=None,
+                        help="Path filter profile from configs/install_filters.json (full = no filtering, default; embedded, minimal).")
+    
+    parser.add_argument("--prune-libs", choices=("report", "remove", "none"), default="report",
+                        help="Report (or remove) shared libraries not reachable from the RootFS executables.")
+    
+    parser.add_argument("--strip", choices=STRIP_MODES, default="split",
+                        help="Strip ELF files in the RootFS (split: keep debug symbols in a separate archive).")
+    
+    parser.add_argument("--dedup", choices=DEDUP_METHODS + ("none",), default="none",
+                        help="Replace identical RootFS files (outside /etc and package backup files) with hardlinks/reflinks. Off by default: it modifies the working RootFS.")
+    
+    parser.add_argument("--disk-image", choices=("gpt", "mbr"), default=None,
+                        help="Assemble a sparse, flashable disk image (bootfs + rootfs, with .bmap).")
+    
     # parser.add_argument("--configs", type=Path, default=Path("configs"),
     #                     help="Pfad zu configs/")
     # parser.add_argument("--work-dir", type=Path, default=Path("work"),
@@ -145,30 +183,18 @@ def parse():
 # ---------------------------
 # RootFS erstellen
 # ---------------------------
-def create_rootfs(args):
+def create_rootfs(args, meta):
     """ Creates a minimal rootfs layout !!!"""
     info("RootFS Builder Started.")
     
-    start("[*] Generating Basic RootFS - Folder Structures. ...")
-    create_directories()
-    
-    start("Generating all neccessary configuration files, deployed in '/etc/' !.")
-    create_etc_files()
-
-    start("Building all device-nodes as needed!.")
-    create_dev_nodes()
-
-    start("Generating: Initializing System")
-    create_busybox_init()
-
-    start("Linking Binarys & Folders !. - (SYMLINKS)")
-    create_symlinks()
+    start("[*] Applying RootFS layout: folders, /etc files, device-nodes, init & symlinks ...")
+    create_rootfs_layout(meta=meta)
 
     start("Copying QEMU- Static Console Emulation File to RootFS !.")
     copy_qemu_user_static(arch=args.arch)
 
     start("Settings-UP: All File's and Folders expected Permissions & Privileges!... .. .")
-    set_rootfs_permissions()
+    set_rootfs_permissions(meta=meta)
     
     success("[*] RootFS Struktur erfolgreich erstellt!")
     
@@ -187,7 +213,7 @@ def busybox(args, work_dir, downloads_dir, rootfs_dir):
 
 
 
-def packages_installer(args, packages_config):
+def packages_installer(args, packages_config, meta=None):
     """ [ArchLinux] - Install Pacman's Packages INTO RootFS !!! """
     arch = args.arch if args.arch else "x86_64"
     env = os.environ.copy()
@@ -211,7 +237,13 @@ def packages_installer(args, packages_config):
     
     
     start("Downloading & Installing the Packages Now!... .. .")
-    installer = RootFSPackageInstaller(rootfs_dir, arch=arch_str, ignore_missing=args.ignore_missing)
+    path_filter = PathFilter.from_profile(args.install_profile, configs_dir / "install_filters.json")
+    info(f"Install-Filter Profil: {path_filter.name}")
+    lock_mode = "locked" if args.locked else "update" if args.update_lock else "auto"
+    installer = RootFSPackageInstaller(rootfs_dir, arch=arch_str, ignore_missing=args.ignore_missing, meta=meta,
+                                       path_filter=path_filter, cache_dir=work_dir / "cache", jobs=args.jobs,
+                                       lock_file=rootfs_output / f"{path.stem}.lock.json", lock_mode=lock_mode,
+                                       shared_cache=default_cache())
     installer.install_packages(packages)
     # installer.install_packages(["bash", "nano", "apk-tools", "wget", "curl", "gcc", "make", "cmake", "python", "python-pip", "git", "dhcpcd", "dnsmasq", "openssh", "openssl", "coreutils", "libtool", "binutils", "autoconf", "automake", "cryptsetup", "device-mapper", "dmidecode", "findutils", "flex", "bison", "fwupd", "gawk", "gettext", "gmp", "mpc", "mpfr", "hdparm", "help2man", "libgcrypt", "libusb", "lvm2", "m4", "mtools", "libgpg-error", "libsoup", "libffi", "ncurses", "pciutils", "parted", "texinfo", "util-linux", "zlib"])
     success("All Packages should be installed now on your system!")
@@ -224,25 +256,87 @@ def main():
     """ NexuzCore - Firmware Buildsystem's Main Function """
 
     args = parse()
+    set_default_cache(args.shared_cache)
     
     start("Checking Host Prerequisites!.")
     check_host_prerequisites(exit_on_fail=not args.ignore_host_tools)
     
     
-    create_rootfs(args)
+    # Soll-Owner/Modi/Device Nodes für rootless Image-Erstellung
+    meta = FSMetadata(rootfs_meta_db)
+    try:
+        # Einträge für Pfade, die es seit dem letzten Lauf nicht mehr gibt
+        stale = meta.prune_missing(rootfs_dir)
+        if stale:
+            info(f"[meta] {stale} veraltete Einträge entfernt.")
     
-    busybox(args, work_dir, downloads_dir, rootfs_dir)
+        create_rootfs(args, meta)
     
-    packages_installer(args, packages_config="packages.json")
-    
- 
-    build_apk_tools(arch=args.arch, rootfs_dir=rootfs_dir)
-
-    build_opkg(args.arch, rootfs_dir)
+        busybox(args, work_dir, downloads_dir, rootfs_dir)
     
+        packages_installer(args, packages_config="packages.json", meta=meta)
     
-
  
+        git_sources = load_config(configs_dir / "git_sources.json")
+
+        # Beide Builder arbeiten nur unter work_dir (kein chdir) und laufen parallel
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            builds = [
+                pool.submit(
+                    build_apk_tools,
+                    arch=args.arch,
+                    rootfs_dir=rootfs_dir,
+                    work_dir=work_dir,
+                    repo_url=git_sources["apk-tools"]["repo_url"],
+                    ref=git_sources["apk-tools"]["ref"],
+                    jobs=args.jobs
+                ),
+                pool.submit(
+                    build_opkg,
+                    args.arch,
+                    rootfs_dir,
+                    work_dir=work_dir,
+                    repo_url=git_sources["opkg"]["repo_url"],
+                    ref=git_sources["opkg"]["ref"],
+                    jobs=args.jobs,
+                    meta=meta
+                ),
+            ]
+            for build in builds:
+                build.result()
+    
+        if args.prune_libs != "none":
+            start("Analysing ELF dependencies")
+            prune_conf = load_config(configs_dir / "elf_prune.json")
+            prune_libraries(rootfs_dir, prune_conf["roots"], keep=prune_conf.get("keep"),
+                            remove=args.prune_libs == "remove", meta=meta, jobs=args.jobs)
+
+        if args.strip != "none":
+            start("Stripping RootFS ELF files")
+            strip_rootfs(rootfs_dir, mode=args.strip, debug_dir=debug_dir,
+                         archive=firmware_output / "debug-symbols.tar.zst", jobs=args.jobs)
+
+        if args.dedup != "none":
+            start("Deduplicating RootFS")
+            dedup_rootfs(rootfs_dir, meta=meta, method=args.dedup, jobs=args.jobs)
+
+        start("Writing RootFS-Manifest")
+        generate_manifest(rootfs_dir, rootfs_output / "rootfs.manifest", cache_path=rootfs_hash_cache, jobs=args.jobs)
+
+        if args.image:
+            start(f"Writing RootFS-Images: {', '.join(args.image)}")
+            images = build_rootfs_images(args.image, rootfs_dir, firmware_output, meta=meta, jobs=args.jobs)
+        else:
+            images = []
+
+        if args.disk_image:
+            start(f"Assembling {args.disk_image.upper()} Disk-Image")
+            rootfs_image = next((img["path"] for img in images if img["format"] == "ext4"), None)
+            if rootfs_image is None:
+                rootfs_image = build_rootfs_image("ext4", rootfs_dir, firmware_output, meta=meta, jobs=args.jobs)["path"]
+            build_firmware_image([kernel_output / "boot", bootfs_dir], rootfs_image, firmware_output, table=args.disk_image)
+    finally:
+        meta.close()
 
     chroot_with_qemu(
         rootfs_dir=rootfs_dir,
@@ -1,133 +1,200 @@
 import os
-import subprocess
 import shutil
 
 
 from pathlib import Path
 
+from base.alpine_baselayout import APKInstaller
+from utils.execute import run_command_live
+from utils.git_mirror import prepare_source
+from utils.prebuilt import prebuilt_cache, prebuilt_key, toolchain_version
+
 from core.logger import success, info, warning, error
 
 
+APK_TOOLS_REPO = "https://github.com/alpinelinux/apk-tools"
 
-def build_apk_tools(arch: str, rootfs_dir: str, source_dir: str = "apk-tools_src"):
-    """
-    Klont, kompiliert (statisch) und installiert apk-tools in das Ziel-RootFS.
+# arm64 (Projektname) und aarch64 (Toolchain/meson) bezeichnen dasselbe Ziel
+MESON_ARCH = {
+    "x86_64": "x86_64",
+    "arm64": "aarch64",
+    "aarch64": "aarch64",
+}
 
-    :param arch: Die Zielarchitektur ('x86_64' oder 'aarch64').
-    :param rootfs_dir: Der Pfad zum BusyBox-Ziel-RootFS.
-    :param source_dir: Der lokale Ordner, in den das Repository geklont wird.
-    """
-    
-    
-    info(f"🏗️ Starte den Build-Prozess für apk-tools ({arch})...")
-    
-    # --- Pfade definieren ---
-    repo_url = "https://github.com/alpinelinux/apk-tools"
-    rootfs_path = Path(rootfs_dir)
-    build_dir = Path(source_dir) / "build_static"
-    
-    # --- 1. Toolchain und Cross File definieren ---
-    if arch == 'aarch64':
-        compiler_prefix = 'aarch64-linux-gnu'
-        cross_file_content = f"""
-[binaries]
-c = '{compiler_prefix}-gcc'
-cpp = '{compiler_prefix}-g++'
-ar = '{compiler_prefix}-ar'
-strip = '{compiler_prefix}-strip'
+# APKInstaller kennt die Projektnamen
+APK_INSTALLER_ARCH = {
+    "x86_64": "x86_64",
+    "aarch64": "arm64",
+}
 
-[host_machine]
-system = 'linux'
-cpu_family = 'aarch64'
-cpu = 'aarch64'
-endian = 'little'
-"""
-    elif arch == 'x86_64':
-        # Für x86_64 verwenden wir oft den systemeigenen Compiler, 
-        # aber wir definieren ihn explizit für eine Cross-Umgebung.
-        compiler_prefix = 'x86_64-linux-gnu'
-        cross_file_content = f"""
+MESON_OPTIONS = [
+    '-Ddefault_library=static',
+    '-Dprefer_static=true',
+    '-Dc_link_args=-static',
+]
+
+CROSS_FILE_TEMPLATE = """
 [binaries]
-c = '{compiler_prefix}-gcc'
-cpp = '{compiler_prefix}-g++'
-ar = '{compiler_prefix}-ar'
-strip = '{compiler_prefix}-strip'
+c = '{prefix}-gcc'
+cpp = '{prefix}-g++'
+ar = '{prefix}-ar'
+strip = '{prefix}-strip'
 
 [host_machine]
 system = 'linux'
-cpu_family = 'x86_64'
-cpu = 'x86_64'
+cpu_family = '{cpu}'
+cpu = '{cpu}'
 endian = 'little'
 """
-    else:
-        raise ValueError(f"Unbekannte Architektur: {arch}. Unterstützt: 'aarch64', 'x86_64'.")
 
-    # Cross File erstellen
-    cross_file_path = Path(source_dir) / f"crossfile-{arch}.txt"
-    cross_file_path.write_text(cross_file_content)
-    info(f"   ☑️ Cross File ({cross_file_path}) erstellt.")
 
+def _run(cmd: list[str], desc: str, cwd: Path | None = None):
+    if not run_command_live(cmd, cwd=cwd, desc=desc):
+        raise RuntimeError(f"{desc} fehlgeschlagen: {' '.join(cmd)}")
+
+
+def _write_if_changed(path: Path, content: str) -> bool:
+    """Schreibt nur bei geändertem Inhalt (sonst würde meson/make unnötig neu konfigurieren)"""
+    if path.exists() and path.read_text() == content:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return True
+
+
+def build_apk_tools(arch: str, rootfs_dir: str, source_dir: Path | None = None, work_dir: Path = Path("work"),
+                    repo_url: str = APK_TOOLS_REPO, ref: str = "master", jobs: int | None = None) -> Path | None:
+    """
+    Checkt apk-tools aus dem Git-Mirror aus, kompiliert (statisch) und installiert es in das Ziel-RootFS.
+    Arbeitet nur mit absoluten Pfaden unter work_dir (kein chdir) und kann daher parallel zu
+    anderen Stages laufen; der meson-Build liegt out-of-tree und wird inkrementell fortgesetzt.
+    Fertige Binaries landen pro (Commit, Arch, Toolchain) im Cache und ersetzen spätere Builds;
+    scheitert der Build, wird apk.static aus dem upstream-Paket apk-tools-static installiert.
+
+    :param arch: Die Zielarchitektur ('x86_64', 'arm64' bzw. 'aarch64').
+    :param rootfs_dir: Der Pfad zum BusyBox-Ziel-RootFS.
+    :param source_dir: Worktree-Checkout (Standard: <work_dir>/src/apk-tools).
+    :param work_dir: Work-Verzeichnis mit dem gemeinsamen Mirror-Store.
+    :param repo_url: Upstream-Repository.
+    :param ref: Gepinnter Branch, Tag oder Commit.
+    :param jobs: Parallele ninja-Jobs (Standard: ninja entscheidet).
+    :return: Pfad des installierten apk-Binaries oder None bei Fehler.
+    """
+    
+    
+    info(f"🏗️ Starte den Build-Prozess für apk-tools ({arch})...")
+
+    if arch not in MESON_ARCH:
+        raise ValueError(f"Unbekannte Architektur: {arch}. Unterstützt: {', '.join(MESON_ARCH)}.")
+    cpu = MESON_ARCH[arch]
+
+    # --- Pfade definieren (alle absolut, unabhängig vom cwd) ---
+    work_dir = Path(work_dir).resolve()
+    rootfs_path = Path(rootfs_dir).resolve()
+    source_dir = Path(source_dir).resolve() if source_dir else work_dir / "src" / "apk-tools"
+    build_root = work_dir / "build" / "apk-tools"
+    
     try:
-        # --- 2. Klonen des Repositorys ---
-        if not Path(source_dir).exists():
-            info(f"   ⬇️ Klone Repository in {source_dir}...")
-            subprocess.run(['git', 'clone', '--depth', '1', repo_url, source_dir], check=True)
-            info("   ☑️ Klonen abgeschlossen.")
+        # --- 1. Worktree aus dem Git-Mirror auschecken ---
+        info(f"   ⬇️ Checke {ref} in {source_dir} aus...")
+        _, commit = prepare_source(repo_url, ref, source_dir, work_dir)
+        info("   ☑️ Checkout abgeschlossen.")
+
+        # --- 2. Vorgebautes Binary für (Commit, Arch, Toolchain) im Cache? ---
+        cross_file_content = CROSS_FILE_TEMPLATE.format(prefix=f"{cpu}-linux-gnu", cpu=cpu)
+        cache = prebuilt_cache(work_dir)
+        key = prebuilt_key("apk-tools", cpu, commit, toolchain_version(f"{cpu}-linux-gnu-gcc"),
+                           [cross_file_content, *MESON_OPTIONS], "apk")
+
+        if cache.path(key).is_file():
+            info(f"   ♻️ Vorgebautes apk aus dem Cache ({commit[:12]}, {cpu}), überspringe Build.")
+            apk_binary_path = cache.path(key)
         else:
-            info(f"   ℹ️ Quellverzeichnis {source_dir} existiert bereits, überspringe Klonen.")
-        
-        os.chdir(source_dir)
-        
-        # --- 3. Meson Konfiguration (statisch) ---
-        info("   ⚙️ Konfiguriere Meson für statischen Build...")
-        meson_setup_cmd = [
-            'meson', 'setup', '--reconfigure', 
-            '--cross-file', str(cross_file_path.name), 
-            '-Ddefault_library=static', 
-            '-Dprefer_static=true', 
-            '-Dc_link_args=-static', 
-            str(build_dir.name)
-        ]
-        subprocess.run(meson_setup_cmd, check=True)
-        info("   ☑️ Meson Konfiguration abgeschlossen.")
+            apk_binary_path = _meson_build(source_dir, build_root, cpu, cross_file_content, jobs)
+            cache.fetch(key, lambda tmp: shutil.copy2(apk_binary_path, tmp))
+            info(f"   ☑️ apk im Cache veröffentlicht: {key}")
 
-        # --- 4. Kompilierung mit Ninja ---
-        info("   🔨 Kompiliere mit Ninja...")
-        subprocess.run(['ninja', '-C', str(build_dir.name)], check=True)
-        info("   ☑️ Kompilierung abgeschlossen.")
-        
-        # --- 5. Installation in das Ziel-RootFS ---
+        # --- 3. Installation in das Ziel-RootFS ---
         info(f"   📦 Installiere in Ziel-RootFS: {rootfs_path}...")
-        
-        # Pfad zum kompilierten Binary
-        apk_binary_path = build_dir / "src" / "apk"
-        target_sbin_path = rootfs_path / "sbin"
-        target_apk_path = target_sbin_path / "apk"
-        
-        # Sicherstellen, dass die Zielverzeichnisse existieren
-        target_sbin_path.mkdir(parents=True, exist_ok=True)
-        (rootfs_path / "etc" / "apk").mkdir(parents=True, exist_ok=True)
-        
-        # Kopieren des statischen Binaries
-        shutil.copy(apk_binary_path, target_apk_path)
-        os.chmod(target_apk_path, 0o755) # Ausführbar machen
-        
-        # Minimal benötigte Konfigurationsdatei (Beispiel)
-        if not (rootfs_path / "etc" / "apk" / "repositories").exists():
-            info("   📝 Erstelle /etc/apk/repositories...")
-            # Alpine Edge ist oft die aktuellste Quelle für arm64/x86_64
-            repo_content = "http://dl-cdn.alpinelinux.org/alpine/edge/main\n"
-            (rootfs_path / "etc" / "apk" / "repositories").write_text(repo_content)
-            
+        target_apk_path = install_apk_binary(apk_binary_path, rootfs_path)
         success("   ✅ Installation abgeschlossen. 'apk' ist nun im Ziel-RootFS verfügbar.")
+        return target_apk_path
 
-    except subprocess.CalledProcessError as e:
-        error(f"❌ Fehler während der Ausführung eines Befehls: {e}")
-        error(f"Ausgabe: {e.output}")
+    except RuntimeError as e:
+        error(f"❌ Fehler beim Bauen von apk-tools: {e}")
     except FileNotFoundError as e:
         error(f"❌ Fehler: Eines der benötigten Tools (git, meson, ninja oder die Toolchain) wurde nicht gefunden: {e}")
-    finally:
-        os.chdir("..") # Zurück ins Ausgangsverzeichnis
+
+    # --- Fallback: apk.static aus dem upstream-Paket apk-tools-static ---
+    warning("   ↩️ Nutze apk.static aus dem upstream-Paket apk-tools-static...")
+    try:
+        installer = APKInstaller(rootfs_path, APK_INSTALLER_ARCH[cpu], work_dir=work_dir)
+        apk_static = installer.fetch_apk_static()
+        if apk_static.exists():
+            target_apk_path = install_apk_binary(apk_static, rootfs_path)
+            success("   ✅ Installation abgeschlossen (upstream apk.static).")
+            return target_apk_path
+    except (RuntimeError, OSError) as e:
+        error(f"❌ Auch apk-tools-static ist nicht verfügbar: {e}")
+    return None
+
+
+def _meson_build(source_dir: Path, build_root: Path, cpu: str, cross_file_content: str, jobs: int | None) -> Path:
+    """Statischer meson/ninja-Build out-of-tree in build_root/<cpu>, liefert den Pfad des apk-Binaries"""
+    build_dir = build_root / cpu
+
+    # Cross File (neben dem Build-Verzeichnis, nicht im Worktree)
+    cross_file_path = build_root / f"crossfile-{cpu}.txt"
+    cross_changed = _write_if_changed(cross_file_path, cross_file_content)
+    info(f"   ☑️ Cross File ({cross_file_path}) {'erstellt' if cross_changed else 'unverändert'}.")
+
+    # Meson Konfiguration (statisch, out-of-tree)
+    # Ein bestehendes Build-Verzeichnis konfiguriert ninja bei Änderungen an meson.build selbst neu
+    if not (build_dir / "build.ninja").exists() or cross_changed:
+        info("   ⚙️ Konfiguriere Meson für statischen Build...")
+        meson_setup_cmd = [
+            'meson', 'setup',
+            *(['--reconfigure'] if (build_dir / "build.ninja").exists() else []),
+            '--cross-file', str(cross_file_path),
+            *MESON_OPTIONS,
+            str(build_dir),
+            str(source_dir),
+        ]
+        _run(meson_setup_cmd, "apk-tools: meson setup")
+        info("   ☑️ Meson Konfiguration abgeschlossen.")
+    else:
+        info(f"   ☑️ Meson bereits konfiguriert ({build_dir}).")
+
+    # Kompilierung mit Ninja (inkrementell)
+    info("   🔨 Kompiliere mit Ninja...")
+    _run(['ninja', '-C', str(build_dir), *([f'-j{jobs}'] if jobs else [])], "apk-tools: ninja")
+    info("   ☑️ Kompilierung abgeschlossen.")
+
+    return build_dir / "src" / "apk"
+
+def install_apk_binary(apk_binary_path: Path, rootfs_path: Path) -> Path:
+    """Kopiert das statische apk-Binary nach /sbin/apk und legt /etc/apk/repositories an"""
+    target_sbin_path = rootfs_path / "sbin"
+    target_apk_path = target_sbin_path / "apk"
+
+    # Sicherstellen, dass die Zielverzeichnisse existieren
+    target_sbin_path.mkdir(parents=True, exist_ok=True)
+    (rootfs_path / "etc" / "apk").mkdir(parents=True, exist_ok=True)
+
+    # Kopieren des statischen Binaries (atomar, falls apk gerade im RootFS läuft)
+    tmp_path = target_sbin_path / ".apk.tmp"
+    shutil.copy(apk_binary_path, tmp_path)
+    os.chmod(tmp_path, 0o755) # Ausführbar machen
+    os.replace(tmp_path, target_apk_path)
+
+    # Minimal benötigte Konfigurationsdatei (Beispiel)
+    if not (rootfs_path / "etc" / "apk" / "repositories").exists():
+        info("   📝 Erstelle /etc/apk/repositories...")
+        # Alpine Edge ist oft die aktuellste Quelle für arm64/x86_64
+        repo_content = "http://dl-cdn.alpinelinux.org/alpine/edge/main\n"
+        (rootfs_path / "etc" / "apk" / "repositories").write_text(repo_content)
+
+    return target_apk_path
 
 # --- Beispiel für die Verwendung ---
 # if __name__ == "__main__":
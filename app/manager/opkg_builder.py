@@ -1,50 +1,61 @@
-import subprocess
 import os
-import argparse
 import shutil
+import threading
 
 
 from pathlib import Path
 
+from utils.archive import extract_tar
 from utils.execute import run_command_live
+from utils.fsmeta import tar_member_row
+from utils.git_mirror import prepare_source
+from utils.prebuilt import prebuilt_cache, prebuilt_key, toolchain_version, pack_tree
 
 from core.logger import success, info, warning, error
 
 
 # --- Konfiguration ---
 OPKG_REPO = "https://git.yoctoproject.org/opkg"
-OPKG_DIR = "opkg_source"
-
-def run_command(command, cwd=None, env=None):
-    """Führt einen Shell-Befehl aus und prüft auf Fehler."""
-    info(f"-> Ausführen: {' '.join(command)}")
-    try:
-        # check=True stellt sicher, dass eine CalledProcessError ausgelöst wird, wenn der Befehl fehlschlägt.
-        subprocess.run(
-            command,
-            check=True,
-            cwd=cwd,
-            env=env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True
-        )
-        success("   ✅ Erfolgreich.")
-    except subprocess.CalledProcessError as e:
-        error(f"   ❌ Fehler beim Ausführen des Befehls: {e.cmd}")
-        error(f"   Fehlerausgabe:\n{e.output}")
-        # Beendet das Skript bei einem Fehler
-        exit(1)
-        
-        
-        
-
-def build_opkg(arch: str, rootfs_dir: Path):
+OPKG_REF = "master"
+
+# autogen.sh schreibt in den gemeinsamen Worktree – nie zwei Archs gleichzeitig
+_AUTOGEN_LOCK = threading.Lock()
+
+
+def _run(cmd: list[str], desc: str, cwd: Path | None = None, env: dict | None = None):
+    if not run_command_live(cmd, cwd=cwd, env=env, desc=desc):
+        raise RuntimeError(f"{desc} fehlgeschlagen: {' '.join(cmd)}")
+
+
+def _bootstrap(src_dir: Path):
+    """autogen.sh nur, wenn configure fehlt oder älter als configure.ac ist"""
+    with _AUTOGEN_LOCK:
+        configure = src_dir / "configure"
+        configure_ac = src_dir / "configure.ac"
+        if configure.exists() and (not configure_ac.exists()
+                                   or configure.stat().st_mtime >= configure_ac.stat().st_mtime):
+            info("   ☑️ configure ist aktuell, überspringe autogen.sh.")
+            return
+        if (src_dir / "autogen.sh").exists():
+            _run(["sh", "autogen.sh"], "opkg: autogen.sh", cwd=src_dir)
+
+
+def build_opkg(arch: str, rootfs_dir: Path, work_dir: Path = Path("work"), repo_url: str = OPKG_REPO, ref: str = OPKG_REF,
+               jobs: int | None = None, meta=None) -> Path:
     """
-    Klont, kompiliert (cross) und installiert opkg für die gegebene Architektur.
+    Checkt opkg aus dem Git-Mirror aus, kompiliert (cross) und installiert es für die gegebene Architektur.
+    Alle Pfade liegen absolut unter work_dir (kein chdir); configure/make laufen out-of-tree in
+    <work_dir>/build/opkg/<arch>, ein erneuter Aufruf baut nur geänderte Dateien neu.
+    Der Installationsbaum wird pro (Commit, Arch, Toolchain) gecacht und spart spätere Builds.
     
     :param arch: Zielarchitektur ('x86_64' oder 'arm64').
-    :param rootfs_path: Pfad zum Ziel-Root-Dateisystem.
+    :param rootfs_dir: Pfad zum Ziel-Root-Dateisystem.
+    :param work_dir: Work-Verzeichnis mit dem gemeinsamen Mirror-Store.
+    :param repo_url: Upstream-Repository.
+    :param ref: Gepinnter Branch, Tag oder Commit.
+    :param jobs: Parallele make-Jobs (Standard: alle Kerne).
+    :param meta: Optional FSMetadata; installierte Pfade werden mit Owner root:root erfasst.
+    :return: Pfad des Ziel-RootFS.
     """
     
     info(f"🚀 Starte den Cross-Build für opkg (Architektur: {arch}, Ziel: {rootfs_dir})")
@@ -72,54 +83,87 @@ def build_opkg(arch: str, rootfs_dir: Path):
     # Setzt den Cross-Compiler für das Configure-Skript.
     # WICHTIG: Prüfen Sie, ob diese Variable in Ihrem Build-System korrekt ist!
     custom_env['CC'] = cross_compiler 
+
+    # Pfade (absolut, unabhängig vom cwd)
+    work_dir = Path(work_dir).resolve()
+    rootfs_dir = Path(rootfs_dir).resolve()
+    src_dir = work_dir / "src" / "opkg"
+    build_dir = work_dir / "build" / "opkg" / arch
     
-    # 2. Klonen des Repositorys
-    info("\n--- 1. Klonen von opkg ---")
-    if os.path.exists(OPKG_DIR):
-        info(f"   Ordner '{OPKG_DIR}' existiert bereits. Lösche...")
-        shutil.rmtree(OPKG_DIR)
-    
-    run_command_live(["git", "clone", OPKG_REPO, OPKG_DIR])
-    os.chdir(OPKG_DIR)
-    
-    # 3. Vorbereitung für die Kompilierung (z.B. `autogen.sh` oder `bootstrap`)
-    info("\n--- 2. Vorbereitung der Build-Umgebung ---")
-    # opkg verwendet `autoreconf` oder `autogen.sh`.
-    if os.path.exists("autogen.sh"):
-        run_command_live(["sh", "autogen.sh"])
-    
-    # 4. Konfigurieren
-    info("\n--- 3. Konfigurieren (Cross-Compilation) ---")
+    # 2. Worktree aus dem Git-Mirror (inkrementeller Fetch statt Vollklon)
+    info("\n--- 1. Checkout von opkg ---")
+    _, commit = prepare_source(repo_url, ref, src_dir, work_dir)
+
     # --host: Gibt das Zielsystem an.
-    # --prefix: Gibt das Installationsziel innerhalb des Rootfs an (z.B. /usr).
+    # --prefix: Installationspfad *im Zielsystem*; das RootFS kommt erst über DESTDIR dazu.
     # --with-default-config-file: Setzt den Pfad zur opkg-Konfigurationsdatei.
     configure_cmd = [
-        "./configure",
+        str(src_dir / "configure"),
         f"--host={compiler_prefix}",  # Wichtig für Cross-Compilation
-        f"--prefix={rootfs_dir}/usr", # Installiert in /usr im Ziel-Rootfs
+        "--prefix=/usr",
+        "--sysconfdir=/etc",
+        "--localstatedir=/var",
         "--disable-gpg",  # Vereinfachung: GPG-Prüfungen deaktivieren
-        f"--with-default-config-file={rootfs_dir}/etc/opkg.conf" # Beispiel für Konfigurationspfad
+        "--with-default-config-file=/etc/opkg.conf"
     ]
+
+    # Installationsbaum für (Commit, Arch, Toolchain) bereits im Cache?
+    cache = prebuilt_cache(work_dir)
+    key = prebuilt_key("opkg", arch, commit, toolchain_version(cross_compiler), configure_cmd[1:], "install.tar.gz")
+
+    if cache.path(key).is_file():
+        info(f"\n♻️ Vorgebautes opkg aus dem Cache ({commit[:12]}, {arch}), überspringe Build.")
+    else:
+        destdir = _autotools_build(src_dir, build_dir, configure_cmd, cross_compiler, custom_env, jobs)
+        cache.fetch(key, lambda tmp: pack_tree(destdir, tmp))
+        info(f"   ☑️ opkg im Cache veröffentlicht: {key}")
+
+    # 6. Installation in das Ziel-Rootfs
+    info("\n--- 5. Installation in das Ziel-Rootfs ---")
+    # Vorhandene Verzeichnisse (/usr, /etc, /var, ...) behalten ihre Rechte und mtimes
+    rows = []
+    extract_tar(cache.path(key), rootfs_dir, preserve_dirs=True,
+                on_member=lambda member: rows.append(tar_member_row(member, source="opkg")))
+    if meta is not None:
+        meta.record_many(rows)
+
+    success(f"\n🎉 opkg erfolgreich in {rootfs_dir} für {arch} installiert.")
+    return rootfs_dir
+
+
+def _autotools_build(src_dir: Path, build_dir: Path, configure_cmd: list[str], cross_compiler: str,
+                     env: dict, jobs: int | None) -> Path:
+    """autogen/configure/make out-of-tree in build_dir, 'make install' in build_dir/destdir"""
+    # 3. Vorbereitung für die Kompilierung (z.B. `autogen.sh` oder `bootstrap`)
+    info("\n--- 2. Vorbereitung der Build-Umgebung ---")
+    _bootstrap(src_dir)
     
-    # Führt configure mit der angepassten Umgebung aus (inkl. CC)
-    run_command_live(configure_cmd, env=custom_env)
+    # 4. Konfigurieren (out-of-tree)
+    info("\n--- 3. Konfigurieren (Cross-Compilation) ---")
+    # Nur bei neuem Build-Verzeichnis oder geänderten Optionen; sonst ruft make config.status selbst auf
+    build_dir.mkdir(parents=True, exist_ok=True)
+    stamp = build_dir / ".configure-cmd"
+    stamp_content = "\n".join(configure_cmd + [f"CC={cross_compiler}"])
+    if not (build_dir / "config.status").exists() or not stamp.exists() or stamp.read_text() != stamp_content:
+        _run(configure_cmd, "opkg: configure", cwd=build_dir, env=env)
+        stamp.write_text(stamp_content)
+    else:
+        info("   ☑️ Bereits konfiguriert, überspringe configure.")
 
     # 5. Kompilieren
     info("\n--- 4. Kompilieren ---")
-    # -j$(nproc) nutzt alle verfügbaren Kerne für schnelles Kompilieren
-    run_command_live(["make", "-j", str(os.cpu_count() or 1)])
+    _run(["make", "-C", str(build_dir), "-j", str(jobs or os.cpu_count() or 1)], "opkg: make", env=env)
 
-    # 6. Installation in das Ziel-Rootfs
-    info("\n--- 5. Installation in das Ziel-Rootfs ---")
     # 'DESTDIR' stellt sicher, dass 'make install' in den Pfad von DESTDIR 
     # und nicht in das Root-Dateisystem des Hosts installiert.
+    # Frisches Staging-Verzeichnis, damit der Cache-Eintrag keine Altlasten enthält
+    destdir = build_dir / "destdir"
+    shutil.rmtree(destdir, ignore_errors=True)
     install_cmd = [
         "make",
-        f"DESTDIR={rootfs_dir}", 
+        "-C", str(build_dir),
+        f"DESTDIR={destdir}", 
         "install"
     ]
-    run_command_live(install_cmd)
-
-    os.chdir("..")
-    success(f"\n🎉 opkg erfolgreich in {rootfs_dir} für {arch} installiert.")
-
+    _run(install_cmd, "opkg: make install", env=env)
+    return destdir
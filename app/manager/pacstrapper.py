@@ -1,17 +1,57 @@
+import os
+import re
+import gzip
+import json
+import tempfile
 import subprocess
+import requests
 
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from utils.fsmeta import mtree_rows
+from utils.manifest import HashCache
+from utils.download import fetch_url
+from utils.archive import extract_tar, list_members, resolve_in_dest, PACMAN_METADATA
+from utils.pacman_db import SyncDB, LocalDB, vercmp, parse_pkginfo, repo_servers, file_md5
+
 
 
 class RootFSPackageInstaller:
-    def __init__(self, rootfs_path: str, arch: str = "x86_64", ignore_missing: bool = False):
+    SYNC_DB_DIR = Path("/var/lib/pacman/sync")
+    QUERY_BATCH = 200 # Pakete pro pacman -Si Aufruf (ARG_MAX)
+    LOCK_VERSION = 1
+    LOCK_FIELDS = ("version", "repo", "arch", "filename", "csize", "sha256")
+    LOCK_MODES = ("auto", "locked", "update")
+    DOWNLOAD_WORKERS = 8
+
+    def __init__(self, rootfs_path: str, arch: str = "x86_64", ignore_missing: bool = False, meta=None,
+                 path_filter=None, cache_dir: Path | None = None, jobs: int | None = None,
+                 lock_file: Path | None = None, lock_mode: str = "auto", shared_cache=None):
         self.rootfs_path = Path(rootfs_path)
         self.arch = arch
-        self.pacman_cache = Path("/var/cache/pacman/pkg")
+        self.shared_cache = shared_cache # Optional: SharedCache, Pakete liegen dann unter <cache>/pacman
+        self.pacman_cache = shared_cache.path("pacman") if shared_cache else Path("/var/cache/pacman/pkg")
         self.ignore_missing = ignore_missing # NEU: Option speichern
+        self.meta = meta # Optional: FSMetadata für Owner/Modi aus .MTREE
+        self.path_filter = path_filter # Optional: PathFilter, gefilterte Pfade werden nie entpackt
+        self.cache_dir = Path(cache_dir) if cache_dir else None # Optional: Paket-Infos über Läufe hinweg merken
+        self.jobs = jobs or os.cpu_count() or 1 # parallele Extraktionen
+        self.lock_file = Path(lock_file) if lock_file else None # Optional: packages.lock.json
+        self.lock_mode = lock_mode # auto: auflösen, Lockfile ignorieren; locked: nur Lockfile; update: auflösen und schreiben
+        self.locked = False
+        self._info_cache = None
+        self._sync_db = None
+        self._cache_index = None
+        self.resolved = {} # Name -> Paket-Eintrag aus der Sync-DB (filename, sha256, ...)
+        self.versions = {} # Name -> aufgelöste Version (für inkrementelle Installation)
+        self.package_files = {} # Name -> entpackte rel-Pfade
+        self.package_info = {} # Name -> .PKGINFO-Felder
+        self.backup_hashes = {} # backup-Datei -> md5 der Paket-Version (Datei des Benutzers blieb erhalten)
 
+        if lock_mode not in self.LOCK_MODES:
+            raise ValueError(f"Unbekannter Lock-Modus: {lock_mode}")
         if not self.rootfs_path.exists():
             raise FileNotFoundError(f"RootFS-Pfad existiert nicht: {self.rootfs_path}")
 
@@ -27,50 +67,174 @@ class RootFSPackageInstaller:
     
     
 
+    # -------------------------------------------------------------
+    # Paket-Infos (pacman -Si), gebündelt und gecacht
+    # -------------------------------------------------------------
+    def _sync_db_stamp(self):
+        """Ändert sich, sobald die Sync-Datenbanken aktualisiert werden (pacman -Sy)"""
+        return sorted((db.name, db.stat().st_mtime_ns) for db in self.SYNC_DB_DIR.glob("*.db"))
+
+    def _cache_file(self):
+        return self.cache_dir / f"pacman-si-{self.arch}.json" if self.cache_dir else None
+
+    def _load_info_cache(self):
+        if self._info_cache is not None:
+            return self._info_cache
+
+        self._info_cache = {}
+        cache_file = self._cache_file()
+        if cache_file and cache_file.exists():
+            try:
+                data = json.loads(cache_file.read_text())
+                if data.get("stamp") == [list(x) for x in self._sync_db_stamp()]:
+                    self._info_cache = data["packages"]
+            except (OSError, ValueError, KeyError):
+                print(f"[WARN] Paket-Cache unlesbar, wird neu aufgebaut: {cache_file}")
+        return self._info_cache
+
+    def _save_info_cache(self):
+        cache_file = self._cache_file()
+        if not cache_file or self._info_cache is None:
+            return
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_name(cache_file.name + ".tmp")
+        tmp.write_text(json.dumps({"stamp": self._sync_db_stamp(), "packages": self._info_cache}))
+        os.replace(tmp, cache_file)
+
+    @staticmethod
+    def _parse_info_records(output):
+        """Zerlegt die Ausgabe von pacman -Si a b c in einen Datensatz pro Paket (Name -> Felder)"""
+        records = {}
+        for block in re.split(r"\n\s*\n", output.strip()):
+            fields = {}
+            key = None
+            for line in block.splitlines():
+                if " : " in line and not line.startswith(" "):
+                    key, _, value = line.partition(" : ")
+                    key = key.strip()
+                    fields[key] = value.strip()
+                elif key:
+                    # Fortsetzungszeile (lange Listen werden umgebrochen)
+                    fields[key] += " " + line.strip()
+            if "Name" in fields:
+                records[fields["Name"]] = fields
+        return records
+
+    def _query_packages(self, names):
+        """
+        Paket-Infos für names mit möglichst wenigen pacman-Aufrufen.
+        Gibt (gefunden: Name -> Felder, nicht gefunden: set) zurück.
+        """
+        cache = self._load_info_cache()
+        found = {name: cache[name] for name in names if cache.get(name) is not None}
+        todo = sorted(name for name in names if name not in cache)
+
+        env = dict(os.environ, LC_ALL="C") # Feldnamen unabhängig von der Host-Sprache
+        for i in range(0, len(todo), self.QUERY_BATCH):
+            batch = todo[i:i + self.QUERY_BATCH]
+            print(f"[INFO] Führe auf Host aus: pacman -Si ({len(batch)} Pakete)")
+            # Exit-Code != 0, sobald ein Paket fehlt – die gefundenen stehen trotzdem in stdout
+            result = subprocess.run(["pacman", "-Si", *batch], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    text=True, env=env)
+            records = self._parse_info_records(result.stdout)
+            for name, fields in records.items():
+                info = {
+                    "version": fields.get("Version", ""),
+                    "depends": [] if fields.get("Depends On", "None") == "None" else fields["Depends On"].split(),
+                }
+                cache[name] = info
+                if name in batch:
+                    found[name] = info
+            # Auch Fehlschläge merken (None), bis sich die Sync-DBs ändern
+            for name in batch:
+                cache.setdefault(name, None)
+
+        self._save_info_cache()
+        return found, set(names) - set(found)
+
+    # -------------------------------------------------------------
+    # Auflösung über die Sync-Datenbanken (in-process)
+    # -------------------------------------------------------------
+    def _open_sync_db(self):
+        """SyncDB-Index (gecacht in cache_dir), None ohne lokale Sync-DBs"""
+        if self._sync_db is None and any(self.SYNC_DB_DIR.glob("*.db")):
+            cache_dir = self.cache_dir or Path(tempfile.gettempdir())
+            self._sync_db = SyncDB(cache_dir / f"syncdb-{self.arch}.sqlite", sync_dir=self.SYNC_DB_DIR)
+        return self._sync_db
+
+    def _resolve_with_sync_db(self, db, packages):
+        """Versions- und provides-korrekte Auflösung (sh, libfoo.so=1-64, <, >, ...)"""
+        try:
+            selected, missing = db.resolve(packages, ignore_missing=self.ignore_missing)
+        except RuntimeError as e:
+            raise RuntimeError(f"Paket-Auflösung fehlgeschlagen: {e}")
+
+        for dep in missing:
+            print(f"[WARN] Abhängigkeit '{dep}' nicht erfüllbar. Wird ignoriert. (Grund: --ignore-missing gesetzt)")
+        for name, pkg in sorted(selected.items()):
+            if pkg["arch"] not in (self.arch, "any"):
+                print(f"[WARN] {name} stammt aus einer Sync-DB für {pkg['arch']}, nicht {self.arch}.")
+
+        self.resolved = selected
+        self.versions = {name: pkg["version"] for name, pkg in selected.items()}
+        return list(selected)
+
     def _resolve_dependencies(self, packages):
-        """Ermittelt alle Abhängigkeiten ohne Versionsnummern."""
+        """
+        Ermittelt alle Abhängigkeiten. Bevorzugt die Sync-DBs direkt (inkl. provides und
+        Versionsbedingungen), sonst ohne Versionsnummern – ein pacman -Si pro BFS-Ebene.
+        """
+        db = self._open_sync_db()
+        if db is not None:
+            return self._resolve_with_sync_db(db, packages)
+
         all_packages = set()
-        to_process = set(packages)
-        successful_packages = set() # Nur erfolgreich gefundene Pakete
+        unresolved = set()
+        frontier = set(packages)
 
-        while to_process:
-            pkg = to_process.pop()
-            if pkg in all_packages:
-                continue
-            
-            try:
-                # pacman -Si liefert Abhängigkeiten
-                output = self._run_host_command(["pacman", "-Si", pkg])
-                all_packages.add(pkg) # Füge nur hinzu, wenn erfolgreich gefunden
-
-                for line in output.splitlines():
-                    if line.startswith("Depends On"):
-                        deps = line.split(":", 1)[1].strip().split()
-                        for dep in deps:
-                            # Versionsangaben entfernen
-                            dep_name = dep.split(">=")[0].split("<=")[0].split("=")[0]
-                            if dep_name and dep_name not in all_packages:
-                                to_process.add(dep_name)
-            
-            except RuntimeError as e:
-                # NEU: Fehlerbehandlung
+        while frontier:
+            found, missing = self._query_packages(sorted(frontier))
+            unresolved |= missing
+
+            for pkg in sorted(missing):
                 if self.ignore_missing:
                     print(f"[WARN] Paket '{pkg}' nicht gefunden. Wird ignoriert. (Grund: --ignore-missing gesetzt)")
-                    # Fahren Sie hier einfach mit der nächsten Iteration fort (continue)
                 else:
-                    raise e # Wenn --ignore-missing nicht gesetzt ist, brechen wir ab.
+                    raise RuntimeError(f"Befehl fehlgeschlagen: pacman -Si {pkg}\nPaket nicht gefunden: {pkg}")
+
+            all_packages |= set(found)
+            self.versions.update((name, info["version"]) for name, info in found.items())
+            frontier = set()
+            for info in found.values():
+                for dep in info["depends"]:
+                    # Versionsangaben entfernen (>=, <=, =, <, >)
+                    dep_name = re.split(r"[<>=]", dep, maxsplit=1)[0]
+                    if dep_name and dep_name not in all_packages and dep_name not in unresolved:
+                        frontier.add(dep_name)
+
+        return list(all_packages) # Gibt nur erfolgreich aufgelöste Pakete zurück
 
-        return list(all_packages) # Gibt nun nur erfolgreich aufgelöste Pakete zurück
 
 
+    def _pacman_download(self, targets):
+        """
+        pacman -Sw für targets. Mit gemeinsamem Cache in dessen pacman/-Verzeichnis und
+        hostweit serialisiert (pacman sperrt seine DB, parallele Aufrufe würden scheitern).
+        """
+        cmd = ["pacman", "-Sw", "--noconfirm", "--arch", self.arch]
+        if not self.shared_cache:
+            return self._run_host_command(cmd + targets)
+
+        self.pacman_cache.mkdir(parents=True, exist_ok=True)
+        with self.shared_cache.locked("pacman-sw"):
+            return self._run_host_command(cmd + ["--cachedir", str(self.pacman_cache)] + targets)
 
     def _download_package(self, package_name):
         """Lädt das Paket für die Zielarchitektur vom Host"""
         print(f"[INFO] Lade Paket: {package_name} für Arch {self.arch}")
-        cmd = ["pacman", "-Sw", "--noconfirm", "--arch", self.arch, package_name]
         
         try:
-            self._run_host_command(cmd)
+            self._pacman_download([package_name])
             return True # Erfolgreich heruntergeladen
         except RuntimeError as e:
             # NEU: Fehlerbehandlung
@@ -82,53 +246,505 @@ class RootFSPackageInstaller:
 
 
 
+    # -------------------------------------------------------------
+    # Lockfile (exakte Hülle mit Versionen, Dateinamen, Prüfsummen)
+    # -------------------------------------------------------------
+    def _read_lock(self):
+        if not self.lock_file or not self.lock_file.exists():
+            return None
+        try:
+            lock = json.loads(self.lock_file.read_text())
+        except ValueError as e:
+            raise RuntimeError(f"Lockfile unlesbar: {self.lock_file}: {e}")
+        if lock.get("lock_version") != self.LOCK_VERSION:
+            print(f"[WARN] Lockfile-Version {lock.get('lock_version')} nicht unterstützt: {self.lock_file}")
+            return None
+        return lock
+
+    def _write_lock(self, requested, packages):
+        lock = {
+            "lock_version": self.LOCK_VERSION,
+            "arch": self.arch,
+            "requested": sorted(requested),
+            "packages": {
+                name: {key: self.resolved[name][key] for key in self.LOCK_FIELDS if key in self.resolved.get(name, {})}
+                       or {"version": self.versions.get(name)}
+                for name in sorted(packages)
+            },
+        }
+        self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.lock_file.with_name(self.lock_file.name + ".tmp")
+        tmp.write_text(json.dumps(lock, indent=2) + "\n")
+        os.replace(tmp, self.lock_file)
+        print(f"[INFO] Lockfile geschrieben: {self.lock_file} ({len(packages)} Pakete)")
+
+    def _resolve_locked(self, packages):
+        """
+        locked: Hülle exakt aus dem Lockfile (ohne Auflösung); update: auflösen und das Lockfile schreiben;
+        auto: nur auflösen – ein vorhandenes Lockfile wird weder gelesen noch verändert.
+        """
+        if self.lock_mode == "locked":
+            lock = self._read_lock()
+            if not lock or lock.get("arch") != self.arch or lock.get("requested") != sorted(packages):
+                raise RuntimeError(f"--locked: {self.lock_file} fehlt oder passt nicht zu den angeforderten Paketen "
+                                   f"(neu erzeugen mit --update-lock)")
+            print(f"[INFO] Verwende Lockfile {self.lock_file}, keine Abhängigkeitsauflösung")
+            self.locked = True
+            self.resolved = {name: dict(entry, name=name) for name, entry in lock["packages"].items()
+                             if entry.get("filename")}
+            self.versions = {name: entry.get("version") for name, entry in lock["packages"].items()}
+            return list(lock["packages"])
+
+        all_packages = self._resolve_dependencies(packages)
+        if self.lock_mode == "update" and self.lock_file:
+            self._write_lock(packages, all_packages)
+        return all_packages
+
+    def _fetch_package(self, package_name, servers, hashes):
+        """Lädt genau die Datei aus dem Lockfile von den Mirrors ihres Repos (über .part, atomar)"""
+        pkg = self.resolved[package_name]
+        urls = [f"{server}/{pkg['filename']}" for server in servers.get(pkg.get("repo"), [])]
+        if not urls:
+            urls = [f"{server}/{pkg['filename']}" for repo_urls in servers.values() for server in repo_urls]
+
+        def fetch(target):
+            for url in urls:
+                try:
+                    fetch_url(url, target)
+                    return
+                except (requests.RequestException, OSError) as e:
+                    print(f"[WARN] {url}: {e}")
+            raise RuntimeError(f"{pkg['filename']} auf keinem Mirror gefunden")
+
+        if self.shared_cache:
+            # Single-Flight: parallele Builds laden dieselbe Datei nur einmal
+            verify = lambda path: not pkg.get("sha256") or hashes.lookup(path.name, path.stat(), str(path)) == pkg["sha256"]
+            try:
+                self.shared_cache.fetch(f"pacman/{pkg['filename']}", fetch, verify=verify)
+                return True
+            except RuntimeError:
+                return False
+
+        dest = self.pacman_cache / pkg["filename"]
+        part = dest.with_name(dest.name + ".part")
+        try:
+            fetch(part)
+            os.replace(part, dest)
+            return True
+        except RuntimeError:
+            part.unlink(missing_ok=True)
+            return False
+
+    def _fetch_packages(self, packages, hashes):
+        """Paralleler Download exakter Dateinamen (Lockfile), gibt die erfolgreichen zurück"""
+        servers = repo_servers(self.arch)
+        if not servers:
+            raise RuntimeError("Keine Server in /etc/pacman.conf gefunden")
+        self.pacman_cache.mkdir(parents=True, exist_ok=True)
+        print(f"[INFO] Lade {len(packages)} Pakete aus dem Lockfile ({self.DOWNLOAD_WORKERS} parallel)")
+        with ThreadPoolExecutor(max_workers=self.DOWNLOAD_WORKERS) as pool:
+            results = list(pool.map(lambda pkg: self._fetch_package(pkg, servers, hashes), packages))
+
+        fetched = [pkg for pkg, ok in zip(packages, results) if ok]
+        for pkg in set(packages) - set(fetched):
+            message = f"{self.resolved[pkg]['filename']} ist auf keinem Mirror verfügbar (Lockfile veraltet? --update-lock)"
+            if not self.ignore_missing:
+                raise RuntimeError(message)
+            print(f"[WARN] {message}. Wird übersprungen. (Grund: --ignore-missing gesetzt)")
+        return fetched
+
+
+
+    # -------------------------------------------------------------
+    # Download der ganzen Hülle (ein pacman -Sw, ParallelDownloads)
+    # -------------------------------------------------------------
+    def _verified_in_cache(self, package_name, hashes):
+        """True, wenn die Datei aus der Sync-DB im Cache liegt und Größe/sha256 stimmen"""
+        pkg = self.resolved.get(package_name)
+        if not pkg or not pkg.get("filename"):
+            return False
+        path = self.pacman_cache / pkg["filename"]
+        try:
+            st = path.stat()
+        except OSError:
+            return False
+        if pkg.get("csize") and st.st_size != pkg["csize"]:
+            return False
+        return not pkg.get("sha256") or hashes.lookup(pkg["filename"], st, str(path)) == pkg["sha256"]
+
+    def _download_packages(self, packages):
+        """
+        Lädt alle noch nicht verifizierten Pakete mit einem einzigen pacman -Sw
+        (parallel gemäß ParallelDownloads in pacman.conf), aus dem Lockfile exakt per Dateiname.
+        Gibt die verfügbaren Pakete zurück.
+        """
+        hashes = HashCache(self.cache_dir / f"pkgcache-sha256-{self.arch}.json" if self.cache_dir else None)
+        todo = [pkg for pkg in packages if not self._verified_in_cache(pkg, hashes)]
+        print(f"[INFO] {len(packages) - len(todo)} Pakete bereits verifiziert im Cache, {len(todo)} werden geladen")
+
+        downloaded = []
+        # Aus dem Lockfile: exakt die gesperrten Dateien, nicht die aktuelle Version der Sync-DB
+        exact = [pkg for pkg in todo if self.locked and pkg in self.resolved]
+        if exact:
+            downloaded += self._fetch_packages(exact, hashes)
+
+        rest = [pkg for pkg in todo if pkg not in exact]
+        if rest:
+            # repo/name, damit pacman dasselbe Repo wählt wie die Auflösung
+            targets = [f"{self.resolved[pkg]['repo']}/{pkg}" if self.resolved.get(pkg, {}).get("repo") else pkg
+                       for pkg in rest]
+            try:
+                self._pacman_download(targets)
+                downloaded += rest
+            except RuntimeError:
+                if not self.ignore_missing:
+                    raise
+                # Ein fehlendes Ziel lässt den ganzen Aufruf scheitern – dann einzeln nachladen
+                print("[WARN] Gebündelter Download fehlgeschlagen, lade Pakete einzeln ...")
+                downloaded += [pkg for pkg in rest if self._download_package(pkg)]
+
+        if todo:
+            self._cache_index = None # neue Dateien im Cache
+            for pkg in downloaded:
+                if pkg in self.resolved and not self._verified_in_cache(pkg, hashes):
+                    raise RuntimeError(f"Größe/Prüfsumme von {self.resolved[pkg]['filename']} passt nicht zur Sync-DB/zum Lockfile")
+
+        if self.pacman_cache.is_dir():
+            hashes.save({entry.name for entry in os.scandir(self.pacman_cache)})
+
+        available = set(packages) - set(todo) | set(downloaded)
+        return [pkg for pkg in packages if pkg in available]
+
+
+
+    # -------------------------------------------------------------
+    # Paket-Cache (einmal indiziert statt glob pro Paket)
+    # -------------------------------------------------------------
+    @staticmethod
+    def _parse_package_filename(filename):
+        """'python-pip-24.0-1-any.pkg.tar.zst' -> ('python-pip', '24.0-1', 'any'), sonst None"""
+        stem, sep, ext = filename.partition(".pkg.tar")
+        if not sep or ext.endswith(".sig") or ext.endswith(".part"):
+            return None
+        parts = stem.rsplit("-", 3)
+        if len(parts) != 4:
+            return None
+        name, pkgver, pkgrel, arch = parts
+        return name, f"{pkgver}-{pkgrel}", arch
+
+    def _load_cache_index(self):
+        """Name -> [(Version, Dateiname)] für alle Pakete im pacman-Cache (ein Verzeichnis-Scan)"""
+        if self._cache_index is None:
+            self._cache_index = {}
+            if self.pacman_cache.is_dir():
+                for entry in os.scandir(self.pacman_cache):
+                    parsed = self._parse_package_filename(entry.name)
+                    if parsed and parsed[2] in (self.arch, "any"):
+                        self._cache_index.setdefault(parsed[0], []).append((parsed[1], entry.name))
+        return self._cache_index
+
+    def _package_file(self, package_name):
+        """Exakter Dateiname aus der Sync-DB, sonst die höchste Version gleichen Namens im Cache"""
+        pkg = self.resolved.get(package_name)
+        if pkg and pkg.get("filename") and (self.pacman_cache / pkg["filename"]).is_file():
+            return self.pacman_cache / pkg["filename"]
+
+        candidates = self._load_cache_index().get(package_name)
+        if not candidates:
+            return None
+        best = candidates[0]
+        for candidate in candidates[1:]:
+            if vercmp(candidate[0], best[0]) > 0:
+                best = candidate
+        return self.pacman_cache / best[1]
+
+
+
     def _extract_package(self, package_name):
-        """Extrahiert das Paket in das RootFS, nur echte Pakete ohne Signaturen"""
-        pkg_files = sorted(
-            [f for f in self.pacman_cache.glob(f"{package_name}-*.pkg.tar.*") if not f.suffix.endswith(".sig")],
-            key=lambda f: f.stat().st_mtime
-        )
-        
-        if not pkg_files:
+        """Entpackt das Paket in-process (Stream) in das RootFS, ohne pacman-Metadateien"""
+        pkg_file = self._package_file(package_name)
+        if pkg_file is None:
             raise FileNotFoundError(f"Kein heruntergeladenes Paket gefunden für: {package_name}")
 
-        pkg_file = pkg_files[-1]  # Das neueste Paket
         print(f"[INFO] Extrahiere {pkg_file} nach {self.rootfs_path}")
-        cmd = ["bsdtar", "-xpf", str(pkg_file), "-C", str(self.rootfs_path)]
-        self._run_host_command(cmd)
-        
-        
+        metadata = {}
+        files = extract_tar(pkg_file, self.rootfs_path, path_filter=self.path_filter,
+                            skip=PACMAN_METADATA, keep=metadata)
+
+        if self.meta is not None:
+            self._record_metadata(metadata.get(".MTREE"), pkg_file, package_name)
+        if ".PKGINFO" in metadata:
+            self.package_info[package_name] = parse_pkginfo(metadata[".PKGINFO"])
+        self.package_files[package_name] = files
+        return files
+
+
+
+    # -------------------------------------------------------------
+    # Parallele Extraktion mit Datei-Besitzer-Karte
+    # -------------------------------------------------------------
+    def _list_members(self, pkg_file):
+        """Dateiliste eines Pakets, Verzeichnisse mit abschließendem /"""
+        return list_members(pkg_file)
+
+    def _plan_extraction(self, packages, members):
+        """
+        Baut die Karte Pfad -> besitzende Pakete und fasst Pakete zu Gruppen zusammen,
+        die sich Dateien teilen oder deren Pfade durch einen Symlink/eine Datei eines anderen
+        Pakets führen. Innerhalb einer Gruppe bleibt die Installationsreihenfolge erhalten,
+        Gruppen untereinander sind unabhängig. Gibt (Gruppen, Konflikte) zurück.
+        """
+        parent = {pkg: pkg for pkg in packages}
+
+        def find(pkg):
+            while parent[pkg] != pkg:
+                parent[pkg] = parent[parent[pkg]]
+                pkg = parent[pkg]
+            return pkg
+
+        def union(a, b):
+            a, b = find(a), find(b)
+            if a != b:
+                parent[b] = a
+
+        owners = {}
+        for pkg in packages:
+            for member in members[pkg]:
+                path = member.rstrip("/")
+                if member.endswith("/") or path in PACMAN_METADATA:
+                    continue
+                owners.setdefault(path, []).append(pkg)
+
+        conflicts = {path: pkgs for path, pkgs in owners.items() if len(pkgs) > 1}
+        for pkgs in conflicts.values():
+            for pkg in pkgs[1:]:
+                union(pkgs[0], pkg)
+
+        # Pfad führt durch einen Nicht-Verzeichnis-Eintrag (z.B. Symlink lib -> usr/lib) eines anderen Pakets
+        for pkg in packages:
+            for member in members[pkg]:
+                parts = member.rstrip("/").split("/")
+                for i in range(1, len(parts)):
+                    for owner in owners.get("/".join(parts[:i]), ()):
+                        union(owner, pkg)
+
+        groups = {}
+        for pkg in packages:
+            groups.setdefault(find(pkg), []).append(pkg)
+        return list(groups.values()), conflicts
+
+    def _extract_packages(self, packages):
+        """Extrahiert alle Pakete auf einem Worker-Pool, überlappende Pakete seriell in Reihenfolge"""
+        if not packages:
+            return []
+        self._load_cache_index()
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            files = dict(zip(packages, pool.map(self._package_file, packages)))
+            missing = [pkg for pkg in packages if files[pkg] is None]
+            listable = [pkg for pkg in packages if files[pkg] is not None]
+            members = dict(zip(listable, pool.map(lambda pkg: self._list_members(files[pkg]), listable)))
+
+        groups, conflicts = self._plan_extraction(listable, members)
+        for path, pkgs in sorted(conflicts.items()):
+            print(f"[WARN] Dateikonflikt: /{path} in {', '.join(pkgs)} – das zuletzt installierte Paket gewinnt.")
+        print(f"[INFO] Extrahiere {len(listable)} Pakete in {len(groups)} unabhängigen Gruppen ({self.jobs} Worker)")
+
+        def extract_group(group):
+            done, failed = [], []
+            for pkg in group:
+                try:
+                    self._extract_package(pkg)
+                    done.append(pkg)
+                except (FileNotFoundError, RuntimeError) as e:
+                    failed.append((pkg, e))
+            return done, failed
+
+        installed, failures = [], [(pkg, FileNotFoundError(f"Kein heruntergeladenes Paket gefunden für: {pkg}"))
+                                   for pkg in missing]
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            # Große Gruppen zuerst, damit sie den Pool nicht am Ende allein belegen
+            for done, failed in pool.map(extract_group, sorted(groups, key=len, reverse=True)):
+                installed += done
+                failures += failed
+
+        for pkg, e in failures:
+            if self.ignore_missing:
+                print(f"[WARN] Installation von Paket '{pkg}' fehlgeschlagen/Extraktionsfehler: {e}. Wird übersprungen.")
+            else:
+                raise e
+
+        order = {pkg: i for i, pkg in enumerate(packages)}
+        return sorted(installed, key=order.get)
+
+
+
+    def _record_metadata(self, mtree, pkg_file, package_name):
+        """Übernimmt Owner, Modi und Device Nodes aus der .MTREE des Pakets in die Metadaten-DB"""
+        if not mtree:
+            print(f"[WARN] Keine .MTREE in {pkg_file}, Metadaten nicht erfasst.")
+            return
+
+        mtree = gzip.decompress(mtree).decode("utf-8", errors="replace")
+        rows = mtree_rows(mtree, source=package_name)
+        if self.path_filter:
+            rows = [row for row in rows if not self.path_filter.excluded(row[0])]
+        self.meta.record_many(rows)
+
+
+
+    # -------------------------------------------------------------
+    # Lokale Datenbank (var/lib/pacman/local) und Aufräumen
+    # -------------------------------------------------------------
+    def _remove_files(self, rels, backup=None):
+        """
+        Löscht rel-Pfade im RootFS (Symlinks innerhalb des RootFS aufgelöst), Verzeichnisse nur leer.
+        backup: rel -> md5 der Paket-Version; geänderte Konfigurationsdateien werden wie bei
+        pacman als <datei>.pacsave aufbewahrt statt gelöscht.
+        """
+        root = str(self.rootfs_path)
+        backup = backup or {}
+        files = [rel for rel in rels if not rel.endswith("/")]
+        dirs = sorted((rel.rstrip("/") for rel in rels if rel.endswith("/")), key=lambda rel: rel.count("/"), reverse=True)
+        removed = 0
+
+        for rel in files:
+            parent, _, name = rel.rpartition("/")
+            real_parent = resolve_in_dest(root, parent) if parent else ""
+            if real_parent is None:
+                continue
+            path = os.path.join(root, real_parent, name)
+            if os.path.lexists(path) and not (os.path.isdir(path) and not os.path.islink(path)):
+                if rel in backup and os.path.isfile(path) and not os.path.islink(path) \
+                        and file_md5(path) != backup[rel]:
+                    print(f"[WARN] /{rel} wurde geändert, gespeichert als /{rel}.pacsave")
+                    os.replace(path, f"{path}.pacsave")
+                else:
+                    os.unlink(path)
+                removed += 1
+                if self.meta is not None:
+                    self.meta.remove(rel)
+
+        for rel in dirs:
+            real = resolve_in_dest(root, rel)
+            try:
+                # Nur echte, leere Verzeichnisse (nie durch Symlinks wie lib -> usr/lib)
+                if real == rel:
+                    os.rmdir(os.path.join(root, rel))
+                    removed += 1
+                    if self.meta is not None:
+                        self.meta.remove(rel)
+            except OSError:
+                pass
+        return removed
+
+    def _update_local_db(self, local, previous, installed_packages, removed, explicit):
+        """
+        Trägt neu installierte Pakete in die lokale DB ein und löscht Dateien entfernter
+        bzw. alter Versionen, die kein verbleibendes Paket mehr besitzt.
+        """
+        candidates = set()
+        backup = {}
+        for pkg in removed:
+            candidates |= set(local.files(previous[pkg]))
+            backup.update(local.backup(previous[pkg]))
+            local.remove(previous[pkg])
+
+        for pkg in installed_packages:
+            pkginfo = self.package_info.get(pkg)
+            if not pkginfo or "pkgname" not in pkginfo or "pkgver" not in pkginfo:
+                print(f"[WARN] Keine .PKGINFO in {pkg}, nicht in der lokalen Datenbank erfasst.")
+                continue
+            if pkg in previous:
+                candidates |= set(local.files(previous[pkg]))
+                backup.update(local.backup(previous[pkg]))
+                local.remove(previous[pkg])
+            validation = "sha256" if self.resolved.get(pkg, {}).get("sha256") else "none"
+            local.add(pkginfo, self.package_files.get(pkg, []), explicit=pkg in explicit, validation=validation,
+                      backup_hashes=self.backup_hashes)
+
+        owned = set()
+        for entry in local.packages().values():
+            owned |= set(local.files(entry))
+        orphans = candidates - owned
+        if orphans:
+            print(f"[INFO] Entferne {self._remove_files(orphans, backup)} verwaiste Dateien/Verzeichnisse aus dem RootFS")
+
+    def _keep_modified_backups(self, local, previous, packages):
+        """
+        Sichert vom Benutzer geänderte backup-Dateien der zu aktualisierenden Pakete per Hardlink
+        (die Extraktion ersetzt die Datei, der alte Inode bleibt). Gibt rel -> (Sicherung, md5 alt) zurück.
+        """
+        kept = {}
+        for pkg in packages:
+            if pkg not in previous:
+                continue
+            for rel, md5 in local.backup(previous[pkg]).items():
+                path = self.rootfs_path / rel
+                if not path.is_file() or path.is_symlink() or file_md5(path) == md5:
+                    continue
+                keep = path.with_name(f".{path.name}.keep")
+                keep.unlink(missing_ok=True)
+                os.link(path, keep)
+                kept[rel] = (keep, md5)
+        return kept
+
+    def _restore_backups(self, kept):
+        """
+        Wie pacman: die geänderte Datei des Benutzers bleibt, eine geänderte Paket-Version
+        landet als <datei>.pacnew daneben.
+        """
+        for rel, (keep, old_md5) in kept.items():
+            path = self.rootfs_path / rel
+            if not os.path.lexists(path):
+                os.replace(keep, path)
+                continue
+            # Unverändert geblieben oder vom Paket durch Symlink/Verzeichnis ersetzt
+            if path.is_symlink() or not path.is_file() or os.path.samefile(path, keep):
+                keep.unlink()
+                continue
+            new_md5 = file_md5(path)
+            if new_md5 == file_md5(keep):
+                keep.unlink()
+                continue
+            self.backup_hashes[rel] = new_md5
+            if new_md5 != old_md5:
+                print(f"[WARN] /{rel} wurde geändert, neue Version installiert als /{rel}.pacnew")
+                os.replace(path, f"{path}.pacnew")
+            os.replace(keep, path)
+
+
 
     def install_packages(self, packages: list):
         """Installiert alle Pakete inkl. Abhängigkeiten"""
         
         # NEU: Wir brauchen eine Liste der Pakete, die erfolgreich aufgelöst wurden
         print(f"[INFO] Ermittele Abhängigkeiten für Pakete: {', '.join(packages)}")
-        all_packages = self._resolve_dependencies(packages)
+        all_packages = self._resolve_locked(packages)
         print(f"[INFO] Alle Pakete inkl. Abhängigkeiten (zum Versuch der Installation): {', '.join(all_packages)}")
         
-        installed_packages = []
+        # Nur neue oder geänderte Versionen installieren, nicht mehr benötigte entfernen
+        local = LocalDB(self.rootfs_path)
+        previous = local.packages()
+        pending = [pkg for pkg in all_packages
+                   if pkg not in previous or self.versions.get(pkg) != previous[pkg]["version"]]
+        removed = sorted(set(previous) - set(all_packages))
+        print(f"[INFO] {len(all_packages) - len(pending)} Pakete aktuell, {len(pending)} neu/aktualisiert, "
+              f"{len(removed)} werden entfernt")
 
-        for pkg in all_packages:
-            # Nur fortfahren, wenn der Download erfolgreich war (Rückgabewert von _download_package)
-            if self._download_package(pkg):
-                try:
-                    self._extract_package(pkg)
-                    installed_packages.append(pkg)
-                except (FileNotFoundError, RuntimeError) as e:
-                    # Fangen Sie Fehler beim Extrahieren ab, die z.B. auftreten,
-                    # wenn der Download-Teil zwar dachte, es sei erfolgreich,
-                    # aber das Paket nicht in der Cache ist (sehr selten).
-                    if self.ignore_missing:
-                        print(f"[WARN] Installation von Paket '{pkg}' fehlgeschlagen/Extraktionsfehler: {e}. Wird übersprungen.")
-                    else:
-                        raise e
+        kept = self._keep_modified_backups(local, previous, pending)
+        try:
+            installed_packages = self._extract_packages(self._download_packages(pending))
+        finally:
+            self._restore_backups(kept)
+        self._update_local_db(local, previous, installed_packages, removed, explicit=set(packages))
 
         # NEU: Erfolgsmeldung basierend auf tatsächlich installierten Paketen
         if installed_packages:
             print(f"[SUCCESS] {len(installed_packages)} Pakete inkl. Abhängigkeiten erfolgreich installiert: {', '.join(installed_packages)}")
-        else:
+        elif pending:
             print("[WARN] Es wurden keine Pakete erfolgreich installiert.")
+        else:
+            print("[SUCCESS] Alle Pakete sind bereits aktuell.")
             
             
 # if __name__ == "__main__":
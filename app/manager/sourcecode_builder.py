@@ -1,5 +1,6 @@
 import os
 import sys
+import shutil
 import multiprocessing
 
 
@@ -8,8 +9,9 @@ from pathlib import Path
 from utils.download import download_file, extract_archive
 from utils.execute import run_command_live
 from utils.load import load_config
+from utils.pathfilter import merge_tree
 
-from manager.opkg_builder import build_opkg
+from manager.opkg_builder import build_opkg, OPKG_REF
 
 from core.logger import success, info, warning, error
 
@@ -120,14 +122,14 @@ def resolve_build_order(packages: dict) -> list[str]:
 # ──────────────────────────────────────────────# ──────────────────────────────────────────────
 #  Generischer Builder mit GCC Multilib-Fix
 # ──────────────────────────────────────────────
-def generic_builder(args, conf, work_dir: Path, downloads_dir: Path, rootfs_dir: Path):
+def generic_builder(args, conf, work_dir: Path, downloads_dir: Path, rootfs_dir: Path, path_filter=None):
     """ Generic Build Function with GCC Multilib Fix"""
     
     name = conf["name"]
     
     # Spezielle Behandlung für opkg
     if name == "opkg":
-        build_opkg(args, conf, work_dir, downloads_dir, rootfs_dir)
+        build_opkg(args.arch, rootfs_dir, work_dir=work_dir, ref=conf.get("ref", OPKG_REF))
         return True  # Build abgeschlossen
     
     # Host-Tool-Check
@@ -203,7 +205,13 @@ def generic_builder(args, conf, work_dir: Path, downloads_dir: Path, rootfs_dir:
     make_dir = build_dir if 'build_dir' in locals() else src_dir
     
     run_command_live(["make", f"-j{num_cores}"], cwd=make_dir, env=env, desc=f"{name}: build")
-    run_command_live(["make", f"DESTDIR={rootfs_dir}", "install"], cwd=make_dir, env=env, desc=f"{name}: install")
+    # Erst in ein Staging-DESTDIR installieren, dann gefiltert per rename ins RootFS übernehmen
+    staging_dir = (work_dir / "destdir" / name).resolve()
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    run_command_live(["make", f"DESTDIR={staging_dir}", "install"], cwd=make_dir, env=env, desc=f"{name}: install")
+    moved, skipped = merge_tree(staging_dir, rootfs_dir, path_filter)
+    info(f"📂 {name}: {moved} Dateien übernommen, {skipped} gefiltert.")
 
     success(f"✅ {name} {version} erfolgreich installiert in {rootfs_dir}")
 
@@ -212,7 +220,8 @@ def generic_builder(args, conf, work_dir: Path, downloads_dir: Path, rootfs_dir:
 # ──────────────────────────────────────────────
 #  Alle Pakete in Abhängigkeitsreihenfolge bauen
 # ──────────────────────────────────────────────
-def build_all_packages_from_source(args, configs_dir: Path, work_dir: Path, downloads_dir: Path, rootfs_dir: Path):
+def build_all_packages_from_source(args, configs_dir: Path, work_dir: Path, downloads_dir: Path, rootfs_dir: Path,
+                                   path_filter=None):
     packages = load_all_packages(configs_dir)
     build_order = resolve_build_order(packages)
     info(f"📦 Build-Reihenfolge: {', '.join(build_order)}")
@@ -222,7 +231,7 @@ def build_all_packages_from_source(args, configs_dir: Path, work_dir: Path, down
     for name in build_order:
         conf = packages[name]
         try:
-            generic_builder(args, conf, work_dir, downloads_dir, rootfs_dir)
+            generic_builder(args, conf, work_dir, downloads_dir, rootfs_dir, path_filter=path_filter)
         except Exception as e:
             error(f"❌ Fehler beim Bauen von {name}: {e}")
             failed.append(name)
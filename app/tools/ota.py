@@ -0,0 +1,88 @@
+import os
+import json
+import tarfile
+import argparse
+
+from pathlib import Path
+
+from core.delta import (
+    DELTA_METHODS,
+    generate_delta,
+    apply_delta,
+    verify_tree,
+    generate_image_delta,
+    apply_image_delta,
+)
+
+from utils.fsmeta import FSMetadata
+
+from core.logger import success, error
+
+
+# -----------------------------
+# OTA Delta Tool
+# -----------------------------
+# Aufruf aus app/:
+#   python -m tools.ota generate <alt> <neu> <update.delta> [--method zstd|bsdiff] [--meta rootfs.meta.db]
+#   python -m tools.ota apply    <update.delta> <alt> <ziel>
+#   python -m tools.ota verify   <update.delta> <rootfs>
+# Sind <alt>/<neu> Dateien statt Verzeichnisse, wird ein Image-Delta erzeugt bzw. angewendet.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="NexuzCore OTA delta generator")
+    parser.add_argument("--jobs", type=int, default=None, help="Parallel jobs (default: CPU count)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Create a delta between two rootfs trees or images")
+    gen.add_argument("old", type=Path)
+    gen.add_argument("new", type=Path)
+    gen.add_argument("output", type=Path)
+    gen.add_argument("--method", choices=DELTA_METHODS, default="zstd")
+    gen.add_argument("--meta", type=Path, default=None,
+                     help="Metadata DB of the new rootfs (owners of rootless builds)")
+
+    app = sub.add_parser("apply", help="Rebuild the new rootfs/image from the old one and a delta")
+    app.add_argument("delta", type=Path)
+    app.add_argument("old", type=Path)
+    app.add_argument("target", type=Path)
+
+    ver = sub.add_parser("verify", help="Verify a rootfs tree against a delta")
+    ver.add_argument("delta", type=Path)
+    ver.add_argument("rootfs", type=Path)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.command == "generate":
+        if args.old.is_file() and args.new.is_file():
+            generate_image_delta(args.old, args.new, args.output)
+        else:
+            meta = FSMetadata(args.meta) if args.meta else None
+            try:
+                generate_delta(args.old, args.new, args.output, method=args.method, jobs=args.jobs, meta=meta)
+            finally:
+                if meta is not None:
+                    meta.close()
+
+    elif args.command == "apply":
+        if args.old.is_file():
+            apply_image_delta(args.old, args.delta, args.target)
+        else:
+            apply_delta(args.delta, args.old, args.target, jobs=args.jobs)
+
+    elif args.command == "verify":
+        with tarfile.open(args.delta) as tar:
+            entries = json.load(tar.extractfile("delta.json"))["entries"]
+        mismatches = verify_tree(args.rootfs, entries, jobs=args.jobs, check_owner=os.geteuid() == 0)
+        if mismatches:
+            error(f"[ota] {len(mismatches)} Abweichungen:\n  " + "\n  ".join(mismatches))
+            raise SystemExit(1)
+        success(f"[ota] {args.rootfs} entspricht dem Delta.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import re
+import tarfile
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Alpine APKINDEX
+# -----------------------------
+# APKINDEX.tar.gz besteht aus mehreren aneinandergehängten gzip-Streams (Signatur + Index);
+# gzip/tarfile lesen sie als ein Archiv. Die Datei "APKINDEX" enthält pro Paket einen
+# Block aus "X:wert"-Zeilen, getrennt durch Leerzeilen.
+
+INDEX_FIELDS = {
+    "P": "name",
+    "V": "version",
+    "A": "arch",
+    "S": "size",
+    "I": "installed_size",
+    "C": "checksum",
+    "o": "origin",
+    "k": "provider_priority",
+}
+LIST_FIELDS = {
+    "D": "depends",
+    "p": "provides",
+    "i": "install_if",
+}
+
+_DEP_NAME = re.compile(r"[<>=~]")
+
+
+def dep_name(dep: str) -> str:
+    """'so:libc.musl-x86_64.so.1=1' -> 'so:libc.musl-x86_64.so.1', 'busybox>=1.36' -> 'busybox'"""
+    return _DEP_NAME.split(dep, maxsplit=1)[0]
+
+
+def parse_apkindex(text: str) -> list[dict]:
+    packages = []
+    pkg: dict = {}
+    for line in text.splitlines() + [""]:
+        if not line:
+            if pkg.get("name"):
+                pkg.setdefault("depends", [])
+                pkg.setdefault("provides", [])
+                pkg.setdefault("install_if", [])
+                pkg["filename"] = f"{pkg['name']}-{pkg['version']}.apk"
+                packages.append(pkg)
+            pkg = {}
+            continue
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        if key in INDEX_FIELDS:
+            pkg[INDEX_FIELDS[key]] = int(value) if key in ("S", "I", "k") else value
+        elif key in LIST_FIELDS:
+            pkg[LIST_FIELDS[key]] = value.split()
+    return packages
+
+
+def read_apkindex(path: Path) -> list[dict]:
+    with tarfile.open(path, "r:gz") as tar:
+        member = tar.extractfile("APKINDEX")
+        if member is None:
+            raise RuntimeError(f"Kein APKINDEX in {path}")
+        return parse_apkindex(member.read().decode("utf-8", errors="replace"))
+
+
+class ApkIndex:
+    """Paket-Tabelle eines oder mehrerer APKINDEX mit provides-Auflösung"""
+
+    def __init__(self, packages: list[dict]):
+        self.packages: dict[str, dict] = {}
+        self.providers: dict[str, list[dict]] = {}
+        for pkg in packages:
+            # Bei mehreren Repos gewinnt das erste (wie die Reihenfolge in /etc/apk/repositories)
+            if pkg["name"] in self.packages:
+                continue
+            self.packages[pkg["name"]] = pkg
+            for provided in pkg["provides"]:
+                self.providers.setdefault(dep_name(provided), []).append(pkg)
+
+    @classmethod
+    def from_files(cls, paths: list[Path]) -> "ApkIndex":
+        packages = []
+        for path in paths:
+            packages += read_apkindex(path)
+        return cls(packages)
+
+    def provider(self, dep: str, selected: dict[str, dict]) -> dict | None:
+        name = dep_name(dep)
+        if name in self.packages:
+            return self.packages[name]
+        candidates = self.providers.get(name, [])
+        for pkg in candidates:
+            if pkg["name"] in selected:
+                return pkg
+        if not candidates:
+            return None
+        # Höchste provider_priority, sonst deterministisch nach Name
+        return max(sorted(candidates, key=lambda pkg: pkg["name"]), key=lambda pkg: pkg.get("provider_priority", 0))
+
+    def resolve(self, targets: list[str]) -> tuple[dict[str, dict], list[str]]:
+        """
+        Installations-Hülle wie apk: depends (inkl. so:/cmd:/Pfad-provides), danach install_if
+        bis zum Fixpunkt. Gibt (Name -> Paket, nicht erfüllbare Abhängigkeiten) zurück.
+        """
+        selected: dict[str, dict] = {}
+        missing: list[str] = []
+
+        def add(deps):
+            queue = list(deps)
+            while queue:
+                dep = queue.pop(0)
+                if dep.startswith("!"):
+                    continue
+                pkg = self.provider(dep, selected)
+                if pkg is None:
+                    if dep not in missing:
+                        missing.append(dep)
+                    continue
+                if pkg["name"] not in selected:
+                    selected[pkg["name"]] = pkg
+                    queue += pkg["depends"]
+
+        add(targets)
+        changed = True
+        while changed:
+            changed = False
+            provided = set(selected)
+            for pkg in selected.values():
+                provided |= {dep_name(p) for p in pkg["provides"]}
+            for pkg in self.packages.values():
+                if pkg["install_if"] and pkg["name"] not in selected \
+                        and all(dep_name(cond) in provided for cond in pkg["install_if"]):
+                    add([pkg["name"]])
+                    changed = True
+
+        return selected, missing
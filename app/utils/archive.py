@@ -0,0 +1,262 @@
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+import tarfile
+import subprocess
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Streaming-Entpacker (tar.zst / tar.xz / tar.gz / tar.bz2 / tar.lz4)
+# -----------------------------
+# Liest Archive sequentiell (tarfile "r|") ohne Seek und ohne Subprozess pro Archiv:
+# zstd/lz4 über die optionalen Python-Bindings (zstandard, lz4), nur ohne diese über
+# "zstd -dc" bzw. "lz4 -dc". Ziel ist ein RootFS – Symlinks werden innerhalb des
+# Ziels aufgelöst, nie auf dem Host.
+
+MAGIC = {
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"\x04\x22\x4d\x18": "lz4",
+    b"\xfd\x37\x7a\x58": "xz",
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bzip2",
+}
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".txz", ".tar.zst", ".tzst", ".tar.lz4")
+
+# Paket-Metadaten von pacman, landen nie im RootFS
+PACMAN_METADATA = (".PKGINFO", ".MTREE", ".BUILDINFO", ".INSTALL", ".CHANGELOG")
+
+_XATTR_PREFIX = "SCHILY.xattr."
+_EXTRACT_FILTER = {"filter": "fully_trusted"} if hasattr(tarfile, "fully_trusted_filter") else {}
+
+
+def detect_compression(path: Path) -> str | None:
+    with open(path, "rb") as f:
+        head = f.read(4)
+    for magic, kind in MAGIC.items():
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+@contextmanager
+def open_stream(path: Path):
+    """Dekomprimierter, sequentiell lesbarer Datenstrom eines Archivs"""
+    path = Path(path)
+    kind = detect_compression(path)
+    proc = None
+
+    if kind == "zstd":
+        try:
+            import zstandard
+            raw = open(path, "rb")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        except ImportError:
+            proc = _decompress_process("zstd", path)
+            stream = proc.stdout
+    elif kind == "lz4":
+        try:
+            import lz4.frame
+            stream = lz4.frame.open(path, "rb")
+        except ImportError:
+            proc = _decompress_process("lz4", path)
+            stream = proc.stdout
+    elif kind == "xz":
+        stream = lzma.open(path, "rb")
+    elif kind == "gzip":
+        stream = gzip.open(path, "rb")
+    elif kind == "bzip2":
+        stream = bz2.open(path, "rb")
+    else:
+        stream = open(path, "rb")
+
+    try:
+        yield stream
+    finally:
+        stream.close()
+        if proc is not None and proc.wait() != 0:
+            raise RuntimeError(f"{proc.args[0]} konnte {path} nicht entpacken: {proc.stderr.read().decode(errors='replace')}")
+
+
+def _decompress_process(tool: str, path: Path) -> subprocess.Popen:
+    if not shutil.which(tool):
+        raise RuntimeError(f"{path.name}: weder das Python-Modul noch '{tool}' ist verfügbar")
+    return subprocess.Popen([tool, "-dcq", str(path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+@contextmanager
+def open_tar(path: Path):
+    with open_stream(path) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+        yield tar
+
+
+def list_members(path: Path) -> list[str]:
+    """Member-Namen wie bsdtar -tf (Verzeichnisse mit abschließendem /)"""
+    with open_tar(path) as tar:
+        return [m.name + ("/" if m.isdir() else "") for m in tar]
+
+
+# -------------------------------------------------------------
+# Pfade innerhalb des Ziels auflösen
+# -------------------------------------------------------------
+
+def _normalize(name: str) -> str | None:
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return "/".join(parts)
+
+
+def resolve_in_dest(dest: str, rel: str, cache: dict | None = None, max_hops: int = 40) -> str | None:
+    """
+    Realer rel-Pfad von rel im Ziel: vorhandene Symlinks werden wie in einem chroot
+    aufgelöst (absolute Ziele relativ zu dest), fehlende Komponenten bleiben stehen.
+    """
+    cache = cache if cache is not None else {}
+    if rel in cache:
+        return cache[rel]
+
+    parts = rel.split("/")
+    resolved: list[str] = []
+    hops = 0
+    while parts:
+        part = parts.pop(0)
+        if part in ("", "."):
+            continue
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+        candidate = os.path.join(dest, *resolved, part)
+        if os.path.islink(candidate):
+            hops += 1
+            if hops > max_hops:
+                return None
+            target = os.readlink(candidate)
+            if target.startswith("/"):
+                resolved = []
+            parts = target.split("/") + parts
+            continue
+        resolved.append(part)
+
+    cache[rel] = "/".join(resolved)
+    return cache[rel]
+
+
+def _apply_xattrs(member: tarfile.TarInfo, target: str):
+    for key, value in member.pax_headers.items():
+        if not key.startswith(_XATTR_PREFIX):
+            continue
+        try:
+            os.setxattr(target, key[len(_XATTR_PREFIX):], value.encode("utf-8", "surrogateescape"),
+                        follow_symlinks=False)
+        except OSError as e:
+            # security.* / trusted.* nur als root, user.* nicht auf jedem Dateisystem
+            warning(f"[archive] xattr {key[len(_XATTR_PREFIX):]} für {member.name} nicht gesetzt: {e}")
+
+
+# =============================================================================
+# Entpacken
+# =============================================================================
+
+def extract_tar(archive: Path, dest: Path, path_filter=None, skip: tuple[str, ...] = (),
+                keep: dict[str, bytes] | None = None, on_member=None, preserve_dirs: bool = False) -> list[str]:
+    """
+    Entpackt archive als Stream nach dest. Rechte, mtimes, xattrs (PAX SCHILY.xattr.*),
+    Hard- und Symlinks bleiben erhalten, Owner nur als root.
+    skip:   Member-Namen, die nicht entpackt werden (z.B. PACMAN_METADATA).
+    keep:   dict, in das übersprungene Member mit Inhalt eingetragen werden (z.B. .MTREE).
+    preserve_dirs: bereits vorhandene Verzeichnisse behalten Modus/Owner/mtime und zählen
+            nicht als entpackt (z.B. /usr aus einem DESTDIR-Archiv).
+    Gibt die entpackten rel-Pfade zurück (Verzeichnisse mit abschließendem /, wie pacman).
+    """
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    root = str(dest)
+    as_root = os.geteuid() == 0
+    resolved: dict[str, str] = {}
+    extracted = []
+    directories = []
+
+    with open_tar(archive) as tar:
+        for member in tar:
+            rel = _normalize(member.name)
+            if rel is None:
+                if member.name.strip("./"):
+                    warning(f"[archive] Unsicherer Pfad in {Path(archive).name} übersprungen: {member.name}")
+                continue
+
+            if rel in skip:
+                if keep is not None and member.isfile():
+                    keep[rel] = tar.extractfile(member).read()
+                continue
+            if path_filter and path_filter.excluded(rel):
+                continue
+
+            # Verzeichnisse komplett, alles andere nur bis zum Elternverzeichnis auflösen
+            if member.isdir():
+                real = resolve_in_dest(root, rel, resolved)
+            else:
+                parent, _, name = rel.rpartition("/")
+                real_parent = resolve_in_dest(root, parent, resolved) if parent else ""
+                real = None if real_parent is None else f"{real_parent}/{name}" if real_parent else name
+            if real is None:
+                warning(f"[archive] Symlink-Schleife bei {rel}, übersprungen.")
+                continue
+
+            target = os.path.join(root, real)
+            if preserve_dirs and member.isdir() and os.path.isdir(target):
+                continue
+            if member.islnk():
+                link = _normalize(member.linkname)
+                if link is None:
+                    continue
+                link_parent, _, link_name = link.rpartition("/")
+                real_link_parent = resolve_in_dest(root, link_parent, resolved) if link_parent else ""
+                member.linkname = f"{real_link_parent}/{link_name}" if real_link_parent else link_name
+                if not os.path.lexists(os.path.join(root, member.linkname)):
+                    # Ziel wurde gefiltert – im Stream lässt es sich nicht nachträglich holen
+                    warning(f"[archive] Hardlink {rel} -> {link} ohne Ziel, übersprungen.")
+                    continue
+
+            if not member.isdir() and os.path.lexists(target):
+                if os.path.isdir(target) and not os.path.islink(target):
+                    warning(f"[archive] {rel} ist im Ziel ein Verzeichnis, übersprungen.")
+                    continue
+                # Nie durch einen vorhandenen Symlink hindurch schreiben
+                os.unlink(target)
+            if member.issym():
+                # Neuer Symlink kann bereits aufgelöste Pfade umlenken
+                resolved.clear()
+
+            member.name = real
+            try:
+                tar.extract(member, root, set_attrs=not member.isdir(), numeric_owner=True, **_EXTRACT_FILTER)
+            except (OSError, tarfile.TarError) as e:
+                raise RuntimeError(f"{Path(archive).name}: {rel} konnte nicht entpackt werden: {e}")
+            if member.isdir():
+                directories.append((member, target))
+            elif member.pax_headers:
+                _apply_xattrs(member, target)
+
+            extracted.append(rel + "/" if member.isdir() else rel)
+            if on_member:
+                on_member(member)
+
+    # Verzeichnis-Rechte erst zum Schluss (schreibgeschützte Verzeichnisse)
+    for member, target in reversed(directories):
+        if as_root:
+            os.lchown(target, member.uid, member.gid)
+        os.chmod(target, member.mode)
+        os.utime(target, (member.mtime, member.mtime))
+        if member.pax_headers:
+            _apply_xattrs(member, target)
+
+    return extracted
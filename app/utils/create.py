@@ -10,6 +10,9 @@ import shutil
 
 from pathlib import Path
 
+from utils.layout import apply_layout, dir_entry, file_entry, symlink_entry, node_entry
+from utils.permissions import apply_permissions, SPECIAL_DIR_MODES
+
 from core.logger import success, info, warning, error
 
 
@@ -105,144 +108,126 @@ echo "Root filesystem ready."
 exec /bin/sh
 """
 
+# -----------------------------
+# Device Nodes (name, typ, major, minor, rechte)
+# -----------------------------
+dev_nodes = [
+    ("null", "chr", 1, 3, 0o666),
+    ("zero", "chr", 1, 5, 0o666),
+    ("console", "chr", 5, 1, 0o666),
+    ("tty", "chr", 5, 0, 0o666),
+    ("tty0", "chr", 4, 0, 0o666),
+    ("tty1", "chr", 4, 1, 0o666),
+    ("random", "chr", 1, 8, 0o444),
+    ("urandom", "chr", 1, 9, 0o444),
+]
+
+# -----------------------------
+# Symlinks (pfad, ziel, benötigt)
+# -----------------------------
+rootfs_symlinks = [
+    ("sbin/init", "../bin/busybox", "bin/busybox"),
+    ("bin/sh", "busybox", "bin/busybox"),
+]
+
+
+# -----------------------------
+# RootFS-Manifest
+# -----------------------------
+
+def directory_layout() -> list[dict]:
+    # tmp, var/log, ... gleich mit dem Endmodus, damit der Permission-Pass nichts nachziehen muss
+    return [dir_entry(sub, SPECIAL_DIR_MODES.get(sub, 0o755)) for sub in rootfs_subdirs]
+
+
+def etc_layout() -> list[dict]:
+    entries = []
+    for filename, content in etc_files.items():
+        rel_path = filename.replace("etc/", "") if filename.startswith("etc/") else filename
+        mode = 0o755 if rel_path.endswith("rcS") or rel_path.endswith(".sh") else 0o644
+        entries.append(file_entry(f"etc/{rel_path}", content, mode))
+    return entries
+
+
+def dev_layout() -> list[dict]:
+    entries = [dir_entry("dev")]
+    entries += [node_entry(f"dev/{name}", kind, major, minor, mode) for name, kind, major, minor, mode in dev_nodes]
+    entries.append(dir_entry("dev/pts"))
+    return entries
+
+
+def init_layout() -> list[dict]:
+    return [file_entry("init", init_script_content, 0o755)]
+
+
+def symlink_layout() -> list[dict]:
+    return [symlink_entry(path, target, requires) for path, target, requires in rootfs_symlinks]
+
+
+def rootfs_layout() -> list[dict]:
+    """Das vollständige RootFS-Skelett als ein Manifest"""
+    return directory_layout() + etc_layout() + dev_layout() + init_layout() + symlink_layout()
+
+
 # -----------------------------
 # Funktionen
 # -----------------------------
 
-def create_directories(extra_dir: str | None = None):
-    """Erstellt Workspace und RootFS-Verzeichnisse"""
-    
-    
-    info("[INFO] Creating main directories...")
+def create_workspace(extra_dir: str | None = None):
+    """Erstellt die Workspace-Verzeichnisse"""
     for d in workspace_dirs:
         d.mkdir(parents=True, exist_ok=True)
-        success(f"[INFO] Created {d}")
-
-    info("[INFO] Creating rootfs directories...")
-    for sub in rootfs_subdirs:
-        path = rootfs_dir / sub
-        path.mkdir(parents=True, exist_ok=True)
-        path.chmod(0o755)
-        success(f"[INFO] Created {path}")
-    
+
     if extra_dir:
-        extra_path = Path(extra_dir)
-        extra_path.mkdir(parents=True, exist_ok=True)
-        info(f"[INFO] Created extra directory {extra_path}")
+        Path(extra_dir).mkdir(parents=True, exist_ok=True)
 
-    success("[INFO] All directories created.")
 
+def create_rootfs_layout(extra_dir: str | None = None, meta=None) -> dict:
+    """
+    Erstellt Workspace und das komplette RootFS-Skelett in einem Durchlauf (idempotent).
+    Mit meta (FSMetadata) werden Owner, Modi und Device Nodes rootless erfasst.
+    """
+    create_workspace(extra_dir)
+    summary = apply_layout(rootfs_dir, rootfs_layout(), meta=meta)
+    success("[INFO] RootFS layout applied.")
+    return summary
 
 
+def create_directories(extra_dir: str | None = None, meta=None):
+    """Erstellt Workspace und RootFS-Verzeichnisse"""
+    create_workspace(extra_dir)
+    apply_layout(rootfs_dir, directory_layout(), meta=meta)
 
 
-def create_etc_files():
+def create_etc_files(meta=None):
     """Erstellt alle minimalen /etc Konfig-Dateien"""
-    
-    etc_path = rootfs_dir / "etc"
-    info("[INFO] Creating /etc configuration files...")
-    for filename, content in etc_files.items():
-        rel_path = filename.replace("etc/", "") if filename.startswith("etc/") else filename
-        file_path = etc_path / rel_path
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        file_path.write_text(content)
-        if file_path.name == "rcS" or file_path.suffix == ".sh":
-            file_path.chmod(0o755)
-        success(f"[INFO] Created {file_path}")
-
+    apply_layout(rootfs_dir, etc_layout(), meta=meta)
 
 
-
-
-def create_dev_nodes():
+def create_dev_nodes(meta=None):
     """Erstellt Device Nodes; simuliert, falls keine Rootrechte"""
-    
-    dev_path = rootfs_dir / "dev"
-    dev_path.mkdir(parents=True, exist_ok=True)
-    info("[INFO] Creating device nodes in /dev...")
-
-    devices = [
-        ("null", stat.S_IFCHR, 1, 3, 0o666),
-        ("zero", stat.S_IFCHR, 1, 5, 0o666),
-        ("console", stat.S_IFCHR, 5, 1, 0o666),
-        ("tty", stat.S_IFCHR, 5, 0, 0o666),
-        ("tty0", stat.S_IFCHR, 4, 0, 0o666),
-        ("tty1", stat.S_IFCHR, 4, 1, 0o666),
-        ("random", stat.S_IFCHR, 1, 8, 0o444),
-        ("urandom", stat.S_IFCHR, 1, 9, 0o444),
-    ]
-
-    for name, typ, major, minor, perms in devices:
-        node_path = dev_path / name
-        if not node_path.exists():
-            try:
-                os.mknod(node_path, typ | perms, os.makedev(major, minor))
-                success(f"[INFO] Created device node {node_path}")
-            except PermissionError:
-                node_path.touch()
-                node_path.chmod(perms)
-                warning(f"[WARN] Permission denied; created simulated device node {node_path}")
-
-    (dev_path / "pts").mkdir(exist_ok=True)
-    success("[SUCCESS] Created /dev/pts directory")
-
-
-
-
-def create_busybox_init():
-    """Erstellt init Skript für BusyBox"""
-    
-    init_path = rootfs_dir / "init"
-    init_path.write_text(init_script_content)
-    init_path.chmod(0o755)
-    success(f"[SUCCESS] Created BusyBox init script at {init_path}")
+    apply_layout(rootfs_dir, dev_layout(), meta=meta)
 
 
+def create_busybox_init(meta=None):
+    """Erstellt init Skript für BusyBox"""
+    apply_layout(rootfs_dir, init_layout(), meta=meta)
 
 
-def create_symlinks():
-    """Erstellt Standard-Symlinks /sbin/init und /bin/sh zu BusyBox"""
-    
-    busybox_path = rootfs_dir / "bin/busybox"
-    if busybox_path.exists():
-        (rootfs_dir / "sbin/init").symlink_to("../bin/busybox")
-        (rootfs_dir / "bin/sh").symlink_to("busybox")
-        info("[INFO] BusyBox symlinks created")
-    else:
-        warning("[WARN] BusyBox not found; symlinks skipped")
+def create_symlinks(meta=None):
+    """Erstellt Standard-Symlinks /sbin/init und /bin/sh zu BusyBox (falls vorhanden)"""
+    apply_layout(rootfs_dir, symlink_layout(), meta=meta)
 
 
 
 
 
-def set_rootfs_permissions():
-    """Setzt Berechtigungen für RootFS"""
+def set_rootfs_permissions(rules: list | None = None, jobs: int | None = None, meta=None):
+    """Setzt Berechtigungen für RootFS (regelbasiert, nur wo nötig), mit meta auch in der Metadaten-DB"""
     
     info(f"[INFO] Setting permissions for {rootfs_dir}...")
-
-    for dirpath, _, filenames in os.walk(rootfs_dir):
-        path = Path(dirpath)
-        if path.name not in ["tmp", "run", "lock", "log", "dev"]:
-            path.chmod(0o755)
-
-        for file in filenames:
-            f = path / file
-            if f.suffix == ".sh" or f.name == "rcS":
-                f.chmod(0o755)
-            else:
-                f.chmod(0o644)
-
-    # Spezielle Verzeichnisse
-    for d in [rootfs_dir / "tmp", rootfs_dir / "var/tmp"]:
-        if d.exists():
-            d.chmod(0o1777)
-    for d in [rootfs_dir / "var/log", rootfs_dir / "var/run", rootfs_dir / "var/lock"]:
-        if d.exists():
-            d.chmod(0o777)
-    if (rootfs_dir / "dev").exists():
-        (rootfs_dir / "dev").chmod(0o755)
-    rootfs_dir.chmod(0o755)
-    success("[INFO] Permissions set.")
+    changed = apply_permissions(rootfs_dir, rules=rules, jobs=jobs, meta=meta)
+    success(f"[INFO] Permissions set ({changed} changed).")
 
 
 
@@ -0,0 +1,134 @@
+import os
+import stat
+import fcntl
+import errno
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils.fswalk import parallel_walk
+from utils.fsmeta import resolve_metadata
+from utils.manifest import hash_file
+from utils.pacman_db import LocalDB
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Deduplizierung identischer Dateien
+# -----------------------------
+# Kandidaten werden nach (größe, owner, modus) gruppiert, nur Gruppen mit mehr als
+# einem Inode werden gehasht. Duplikate werden atomar (os.replace) durch einen
+# Hardlink auf die erste Datei ersetzt – oder durch einen Reflink (FICLONE), der
+# eigenständige Inodes behält, aber die Datenblöcke teilt.
+
+DEDUP_METHODS = ("hardlink", "reflink")
+
+# Konfiguration bleibt unabhängig: ein Hardlink würde Änderungen an einer Datei
+# in allen anderen sichtbar machen. Dazu kommen die %BACKUP%-Dateien der Pakete.
+DEDUP_SKIP_PREFIXES = ("etc/",)
+
+# ioctl FICLONE = _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str) -> bool:
+    """Klont src nach dest. False, wenn das Dateisystem keine Reflinks kann."""
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                return False
+            raise
+    return True
+
+
+def _replace(canonical: str, dup: str, st: os.stat_result, method: str) -> str:
+    """Ersetzt dup atomar durch einen Hardlink/Reflink auf canonical. Gibt die genutzte Methode zurück."""
+    tmp = f"{dup}.dedup-{os.getpid()}"
+    try:
+        if method == "reflink":
+            if _reflink(canonical, tmp):
+                os.chmod(tmp, stat.S_IMODE(st.st_mode))
+                os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+                os.replace(tmp, dup)
+                return "reflink"
+            os.unlink(tmp)
+        os.link(canonical, tmp)
+        os.replace(tmp, dup)
+        return "hardlink"
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def dedup_rootfs(root: Path, meta=None, method: str = "hardlink", jobs: int | None = None,
+                 min_size: int = 1, exclude: set[str] | None = None) -> dict:
+    """
+    Ersetzt inhaltsgleiche Dateien im RootFS durch Hardlinks (oder Reflinks).
+    Dateien mit unterschiedlichem Soll-Owner/-Modus (FSMetadata) werden nie zusammengelegt,
+    /etc, pacman-%BACKUP%-Dateien und exclude (rel-Pfade) werden nie angefasst.
+    Gibt einen Report mit files, bytes und methods zurück.
+    """
+    if method not in DEDUP_METHODS:
+        raise ValueError(f"Unbekannte Dedup-Methode: {method}")
+
+    root = Path(root)
+    meta_entries = meta.snapshot() if meta is not None else {}
+    skip = set(exclude or ()) | LocalDB(root).backup_files()
+
+    def visit(entry: os.DirEntry, rel: str):
+        if rel.startswith(DEDUP_SKIP_PREFIXES) or rel in skip:
+            return None
+        st = entry.stat(follow_symlinks=False)
+        if not stat.S_ISREG(st.st_mode) or st.st_size < min_size:
+            return None
+        md = resolve_metadata(meta_entries.get(rel), st)
+        return (st.st_size, md["uid"], md["gid"], md["mode"]), rel, entry.path, st
+
+    # Gruppen: schlüssel -> inode -> [(rel, pfad, stat)]
+    groups: dict[tuple, dict[tuple, list]] = {}
+    for key, rel, path, st in parallel_walk(root, visit, jobs=jobs):
+        groups.setdefault(key, {}).setdefault((st.st_dev, st.st_ino), []).append((rel, path, st))
+
+    candidates = [inodes for inodes in groups.values() if len(inodes) > 1]
+
+    # Ein Hash pro Inode (Hardlinks wurden oben schon zusammengefasst)
+    to_hash = [links[0] for inodes in candidates for links in inodes.values()]
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        digests = dict(zip(
+            ((st.st_dev, st.st_ino) for _, _, st in to_hash),
+            pool.map(lambda item: hash_file(item[1], item[2].st_size), to_hash)
+        ))
+
+    saved_bytes = 0
+    replaced = 0
+    methods: dict[str, int] = {}
+
+    for inodes in candidates:
+        by_digest: dict[str, list[list]] = {}
+        for inode, links in inodes.items():
+            by_digest.setdefault(digests[inode], []).append(sorted(links))
+
+        for same in by_digest.values():
+            if len(same) < 2:
+                continue
+            # Reproduzierbar: der alphabetisch erste Pfad bleibt das Original
+            same.sort()
+            canonical = same[0][0][1]
+            for links in same[1:]:
+                for rel, path, st in links:
+                    used = _replace(canonical, path, st, method)
+                    methods[used] = methods.get(used, 0) + 1
+                    replaced += 1
+                # Der Platz wird erst frei, wenn alle Links des Inodes ersetzt sind
+                if len(links) >= links[0][2].st_nlink:
+                    saved_bytes += links[0][2].st_size
+
+    if method == "reflink" and methods.get("hardlink"):
+        warning(f"[dedup] Reflinks nicht unterstützt, {methods['hardlink']} Dateien wurden per Hardlink zusammengelegt.")
+
+    success(f"[dedup] {replaced} Duplikate ersetzt, {saved_bytes / 1024 / 1024:.1f} MiB gespart.")
+    return {"files": replaced, "bytes": saved_bytes, "methods": methods}
@@ -1,3 +1,6 @@
+import os
+import shutil
+import hashlib
 import requests
 import tarfile
 import zipfile
@@ -13,19 +16,86 @@ from rich.progress import (
 )
 from rich.console import Console
 from core.logger import success, info, warning, error
+from utils.archive import extract_tar
+from utils.shared_cache import SharedCache, default_cache
 
 console = Console()
 
 
-def download_file(urls, dest_dir: Path, timeout: int = 60, max_retries: int = 3, backoff_factor: float = 2.0) -> Path:
+def _fetch_url(url: str, target: Path, timeout: int, max_retries: int, backoff_factor: float):
+    """Lädt url nach target (mit Wiederholungen und Backoff), wirft den letzten Fehler"""
+    attempt = 0
+    current_timeout = timeout
+
+    while True:
+        try:
+            with requests.get(url, stream=True, timeout=current_timeout) as response:
+                response.raise_for_status()
+                total = int(response.headers.get("content-length", 0))
+
+                progress = Progress(
+                    TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+                    BarColumn(bar_width=None),
+                    DownloadColumn(),
+                    TransferSpeedColumn(),
+                    TimeRemainingColumn(),
+                    TextColumn("[green]{task.fields[path]}"),
+                )
+
+                with progress:
+                    task = progress.add_task(
+                        "download",
+                        filename=url.split("/")[-1],
+                        path=str(target.parent),
+                        total=total,
+                    )
+
+                    with open(target, "wb") as f:
+                        for chunk in response.iter_content(chunk_size=1024 * 32):
+                            f.write(chunk)
+                            progress.update(task, advance=len(chunk))
+            return
+
+        except Exception as e:
+            attempt += 1
+            wait_time = backoff_factor ** attempt
+            warning(f"⚠️ Fehler beim Download von {url} (Versuch {attempt}/{max_retries}): {e}")
+            if attempt >= max_retries:
+                info("Maximale Wiederholungen für diese URL erreicht, versuche nächsten Mirror ...")
+                raise
+            info(f"Warte {wait_time:.1f}s vor erneutem Versuch ...")
+            time.sleep(wait_time)
+            current_timeout *= 1.5  # Timeout erhöhen für langsame Server
+
+
+def fetch_url(url: str, target: Path, timeout: int = 60):
+    """
+    Lädt url ohne Fortschrittsanzeige nach target (für parallele Worker).
+    Lokale Pfade und file://-URLs werden kopiert (lokaler Mirror, Tests).
+    """
+    if url.startswith("file://") or url.startswith("/"):
+        shutil.copyfile(url[len("file://"):] if url.startswith("file://") else url, target)
+        return
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with open(target, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1024 * 256):
+                f.write(chunk)
+
+
+def download_file(urls, dest_dir: Path, timeout: int = 60, max_retries: int = 3, backoff_factor: float = 2.0,
+                  cache: SharedCache | None = None) -> Path:
     """
     Lädt eine Datei via HTTP/HTTPS herunter.
     Unterstützt mehrere Mirror-URLs als Fallback.
     Zeigt modernes TUI mit ETA, Fortschritt, Dateigröße und Zielpfad.
     Fügt automatische Wiederholungen und Backoff hinzu.
+    Mit gemeinsamem Cache (cache oder default_cache()) lädt bei parallelen Builds nur einer,
+    die anderen warten und bekommen einen Hardlink.
     """
     dest_dir = Path(dest_dir)
     dest_dir.mkdir(parents=True, exist_ok=True)
+    cache = cache or default_cache()
 
     if isinstance(urls, str):
         urls = [urls]
@@ -40,52 +110,23 @@ def download_file(urls, dest_dir: Path, timeout: int = 60, max_retries: int = 3,
             return dest
 
         info(f"Versuche Download von {url} ...")
-        attempt = 0
-        current_timeout = timeout
-
-        while attempt < max_retries:
-            try:
-                with requests.get(url, stream=True, timeout=current_timeout) as response:
-                    response.raise_for_status()
-                    total = int(response.headers.get("content-length", 0))
-
-                    progress = Progress(
-                        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-                        BarColumn(bar_width=None),
-                        DownloadColumn(),
-                        TransferSpeedColumn(),
-                        TimeRemainingColumn(),
-                        TextColumn("[green]{task.fields[path]}"),
-                    )
+        try:
+            if cache is not None:
+                # Schlüssel über die URL: gleiche Dateinamen verschiedener Projekte (v1.0.tar.gz) kollidieren nicht
+                key = f"downloads/{hashlib.sha256(url.encode()).hexdigest()[:16]}/{filename}"
+                cache.fetch(key, lambda tmp: _fetch_url(url, tmp, timeout, max_retries, backoff_factor))
+                cache.link_into(key, dest)
+            else:
+                # Erst nach vollständigem Download sichtbar – abgebrochene Downloads gelten nicht als vorhanden
+                part = dest.with_name(dest.name + ".part")
+                _fetch_url(url, part, timeout, max_retries, backoff_factor)
+                os.replace(part, dest)
+
+            success(f"Download abgeschlossen: {dest}")
+            return dest
 
-                    with progress:
-                        task = progress.add_task(
-                            "download",
-                            filename=filename,
-                            path=str(dest_dir),
-                            total=total,
-                        )
-
-                        with open(dest, "wb") as f:
-                            for chunk in response.iter_content(chunk_size=1024 * 32):
-                                f.write(chunk)
-                                progress.update(task, advance=len(chunk))
-
-                success(f"Download abgeschlossen: {dest}")
-                return dest
-
-            except Exception as e:
-                attempt += 1
-                last_error = e
-                wait_time = backoff_factor ** attempt
-                warning(f"⚠️ Fehler beim Download von {url} (Versuch {attempt}/{max_retries}): {e}")
-                if attempt < max_retries:
-                    info(f"Warte {wait_time:.1f}s vor erneutem Versuch ...")
-                    time.sleep(wait_time)
-                    current_timeout *= 1.5  # Timeout erhöhen für langsame Server
-                else:
-                    info("Maximale Wiederholungen für diese URL erreicht, versuche nächsten Mirror ...")
-                    break
+        except Exception as e:
+            last_error = e
 
     raise RuntimeError(f"Download fehlgeschlagen. Letzter Fehler: {last_error}")
 
@@ -107,7 +148,12 @@ def extract_archive(archive_path: Path, extract_to: Path) -> Path:
     )
 
     with progress:
-        if name.endswith((".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".tar")):
+        if name.endswith((".tar.zst", ".tzst", ".tar.lz4")):
+            # Ohne Index im Archiv: als Stream entpacken, Gesamtzahl unbekannt
+            task = progress.add_task("extract", filename=archive_path.name, total=None)
+            extract_tar(archive_path, extract_to, on_member=lambda member: progress.update(task, advance=1))
+
+        elif name.endswith((".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".tar")):
             mode = "r"
             if name.endswith(".tar.gz") or name.endswith(".tgz"):
                 mode = "r:gz"
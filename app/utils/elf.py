@@ -0,0 +1,248 @@
+import os
+import struct
+
+from pathlib import Path
+
+
+# -----------------------------
+# Minimaler ELF-Parser
+# -----------------------------
+# Liest nur die Header, die der Build braucht (Typ, Maschine, Sections,
+# Build-ID, dynamische Abhängigkeiten) – reines Python, funktioniert für jede
+# Zielarchitektur ohne qemu.
+
+ELF_MAGIC = b"\x7fELF"
+
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+# e_machine -> Toolchain-Präfix
+MACHINE_PREFIXES = {
+    0x3E: "x86_64-linux-gnu-",   # EM_X86_64
+    0xB7: "aarch64-linux-gnu-",  # EM_AARCH64
+    0x28: "arm-linux-gnueabihf-",  # EM_ARM
+    0x03: "i686-linux-gnu-",     # EM_386
+    0xF3: "riscv64-linux-gnu-",  # EM_RISCV
+}
+
+# Architektur-Namen des Builds (--arch) -> e_machine
+ARCH_MACHINES = {
+    "x86_64": 0x3E,
+    "arm64": 0xB7,
+    "aarch64": 0xB7,
+}
+
+_EHDR = {
+    32: "HHIIIIIHHHHHH",
+    64: "HHIQQQIHHHHHH",
+}
+_SHDR = {
+    32: "IIIIIIIIII",
+    64: "IIQQQQIIQQ",
+}
+# Reihenfolge der Felder unterscheidet sich zwischen 32 und 64 Bit (p_flags)
+_PHDR = {
+    32: ("IIIIIIII", ("type", "offset", "vaddr", "paddr", "filesz", "memsz", "flags", "align")),
+    64: ("IIQQQQQQ", ("type", "flags", "offset", "vaddr", "paddr", "filesz", "memsz", "align")),
+}
+_DYN = {
+    32: "iI",
+    64: "qQ",
+}
+
+
+def is_elf(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == ELF_MAGIC
+    except OSError:
+        return False
+
+
+class ElfFile:
+    """
+    Geöffnete ELF-Datei (nur lesend).
+    Attribute: bits, endian, type, machine, sections (Liste aus dicts mit name/type/offset/size/...)
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = str(path)
+        self._f = open(self.path, "rb")
+        try:
+            self._parse_header()
+            self._parse_segments()
+            self._parse_sections()
+        except (struct.error, ValueError):
+            self._f.close()
+            raise ValueError(f"Keine gültige ELF-Datei: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._f.close()
+
+    def read(self, offset: int, size: int) -> bytes:
+        self._f.seek(offset)
+        return self._f.read(size)
+
+    def _parse_header(self):
+        ident = self.read(0, 16)
+        if ident[:4] != ELF_MAGIC or ident[4] not in (1, 2) or ident[5] not in (1, 2):
+            raise ValueError("bad ident")
+        self.bits = 32 if ident[4] == 1 else 64
+        self.endian = "<" if ident[5] == 1 else ">"
+
+        fmt = self.endian + _EHDR[self.bits]
+        (self.type, self.machine, _, self.entry, self.phoff, self.shoff, _, _,
+         self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = struct.unpack(
+            fmt, self.read(16, struct.calcsize(fmt))
+        )
+
+    def _parse_segments(self):
+        self.segments = []
+        if not self.phoff or not self.phnum:
+            return
+
+        fmt, keys = _PHDR[self.bits]
+        fmt = self.endian + fmt
+        raw = self.read(self.phoff, self.phentsize * self.phnum)
+        for i in range(self.phnum):
+            self.segments.append(dict(zip(keys, struct.unpack_from(fmt, raw, i * self.phentsize))))
+
+    def _parse_sections(self):
+        self.sections = []
+        if not self.shoff or not self.shnum:
+            return
+
+        fmt = self.endian + _SHDR[self.bits]
+        raw = self.read(self.shoff, self.shentsize * self.shnum)
+        for i in range(self.shnum):
+            name, stype, flags, addr, offset, size, link, info, _, entsize = struct.unpack_from(
+                fmt, raw, i * self.shentsize
+            )
+            self.sections.append({"name_off": name, "type": stype, "flags": flags, "addr": addr,
+                                  "offset": offset, "size": size, "link": link, "info": info, "entsize": entsize})
+
+        if self.shstrndx < len(self.sections):
+            strtab = self.sections[self.shstrndx]
+            names = self.read(strtab["offset"], strtab["size"])
+            for section in self.sections:
+                end = names.find(b"\0", section["name_off"])
+                section["name"] = names[section["name_off"]:end].decode(errors="replace")
+        for section in self.sections:
+            section.setdefault("name", "")
+
+    # -------------------------------------------------------------
+    # Abfragen
+    # -------------------------------------------------------------
+    def section(self, name: str) -> dict | None:
+        return next((s for s in self.sections if s["name"] == name), None)
+
+    def has_debug(self, symbols: bool = True) -> bool:
+        """True, wenn Debug-Infos (und mit symbols=True: eine Symboltabelle) vorhanden sind"""
+        return any(
+            s["name"].startswith((".debug_", ".zdebug_")) or (symbols and s["type"] == SHT_SYMTAB)
+            for s in self.sections
+        )
+
+    def build_id(self) -> str | None:
+        for section in self.sections:
+            if section["type"] != SHT_NOTE:
+                continue
+            data = self.read(section["offset"], section["size"])
+            pos = 0
+            while pos + 12 <= len(data):
+                namesz, descsz, ntype = struct.unpack_from(self.endian + "III", data, pos)
+                pos += 12
+                name = data[pos:pos + namesz]
+                pos += (namesz + 3) & ~3
+                desc = data[pos:pos + descsz]
+                pos += (descsz + 3) & ~3
+                if ntype == NT_GNU_BUILD_ID and name.rstrip(b"\0") == b"GNU":
+                    return desc.hex()
+        return None
+
+
+    def _vaddr_to_offset(self, addr: int) -> int | None:
+        for seg in self.segments:
+            if seg["type"] == PT_LOAD and seg["vaddr"] <= addr < seg["vaddr"] + seg["filesz"]:
+                return seg["offset"] + addr - seg["vaddr"]
+        return None
+
+    def interpreter(self) -> str | None:
+        """Programm-Interpreter (PT_INTERP), z.B. /lib/ld-linux-aarch64.so.1"""
+        for seg in self.segments:
+            if seg["type"] == PT_INTERP:
+                return self.read(seg["offset"], seg["filesz"]).rstrip(b"\0").decode(errors="replace")
+        return None
+
+    def dynamic(self) -> dict:
+        """
+        Liest die dynamische Sektion über PT_DYNAMIC (klappt auch bei gestrippten Dateien).
+        Liefert needed (Liste), soname, rpath und runpath (Listen der Pfade).
+        """
+        result = {"needed": [], "soname": None, "rpath": [], "runpath": []}
+        seg = next((s for s in self.segments if s["type"] == PT_DYNAMIC), None)
+        if seg is None:
+            return result
+
+        fmt = self.endian + _DYN[self.bits]
+        size = struct.calcsize(fmt)
+        raw = self.read(seg["offset"], seg["filesz"])
+        entries = []
+        for pos in range(0, len(raw) - size + 1, size):
+            tag, val = struct.unpack_from(fmt, raw, pos)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, val))
+
+        tags = dict(entries)
+        strtab = self._vaddr_to_offset(tags.get(DT_STRTAB, 0)) if DT_STRTAB in tags else None
+        if strtab is None:
+            return result
+        strings = self.read(strtab, tags.get(DT_STRSZ, 0))
+
+        def string(offset: int) -> str:
+            end = strings.find(b"\0", offset)
+            return strings[offset:end if end >= 0 else None].decode(errors="replace")
+
+        for tag, val in entries:
+            if tag == DT_NEEDED:
+                result["needed"].append(string(val))
+            elif tag == DT_SONAME:
+                result["soname"] = string(val)
+            elif tag == DT_RPATH:
+                result["rpath"] += [p for p in string(val).split(":") if p]
+            elif tag == DT_RUNPATH:
+                result["runpath"] += [p for p in string(val).split(":") if p]
+        return result
+
+
+def toolchain_prefix(machine: int) -> str:
+    """Präfix der Binutils für e_machine, z.B. 'aarch64-linux-gnu-'"""
+    return MACHINE_PREFIXES.get(machine, "")
+
+
+def host_machine() -> int | None:
+    return ARCH_MACHINES.get(os.uname().machine)
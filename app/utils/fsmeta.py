@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# fsmeta.py
+# Rootless Metadaten-Overlay (fakeroot-artig) für das RootFS:
+# speichert Soll-Owner, -Modus und Device-Nummern pro Pfad in SQLite,
+# damit Image-Writer ohne Rootrechte korrekte Images erzeugen können.
+
+import os
+import re
+import stat
+import sqlite3
+import threading
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# Typen wie in mtree/tar, unabhängig vom tatsächlichen Dateityp auf der Platte
+KIND_FROM_MODE = {
+    stat.S_IFREG: "file",
+    stat.S_IFDIR: "dir",
+    stat.S_IFLNK: "link",
+    stat.S_IFCHR: "char",
+    stat.S_IFBLK: "block",
+    stat.S_IFIFO: "fifo",
+}
+
+MODE_FROM_KIND = {kind: fmt for fmt, kind in KIND_FROM_MODE.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path   TEXT PRIMARY KEY,
+    uid    INTEGER,
+    gid    INTEGER,
+    mode   INTEGER,
+    kind   TEXT,
+    major  INTEGER,
+    minor  INTEGER,
+    source TEXT
+) WITHOUT ROWID;
+"""
+
+
+def normalize_path(path: str) -> str:
+    """'./usr/bin/', '/usr/bin' und 'usr/bin' -> 'usr/bin'"""
+    path = str(path)
+    if path.startswith("./"):
+        path = path[2:]
+    return path.strip("/")
+
+
+class FSMetadata:
+    """
+    Soll-Metadaten für RootFS-Pfade.
+
+    Ein Eintrag überschreibt, was auf der Platte steht (Owner, Modus, Typ/Device).
+    Für Pfade ohne Eintrag gilt: Owner root:root, Modus und Typ von der Platte.
+    Alle Schreibzugriffe sind thread-sicher.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    # -------------------------------------------------------------
+    # Schreiben
+    # -------------------------------------------------------------
+    def record(self, path: str, uid: int = 0, gid: int = 0, mode: int | None = None, kind: str | None = None,
+               major: int | None = None, minor: int | None = None, source: str | None = None):
+        self.record_many([(path, uid, gid, mode, kind, major, minor, source)])
+
+    def record_many(self, rows):
+        """rows: Iterable aus (path, uid, gid, mode, kind, major, minor, source)"""
+        rows = [(normalize_path(row[0]), *row[1:]) for row in rows]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def remove(self, path: str):
+        """Entfernt path und alles darunter"""
+        path = normalize_path(path)
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (path, path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "/%")
+            )
+            self._conn.commit()
+
+    def set_modes(self, modes):
+        """modes: Iterable aus (path, mode) – ändert nur den Modus vorhandener Einträge"""
+        rows = [(mode, normalize_path(path)) for path, mode in modes]
+        with self._lock:
+            self._conn.executemany("UPDATE entries SET mode = ? WHERE path = ?", rows)
+            self._conn.commit()
+
+    def prune_missing(self, root: Path) -> int:
+        """Entfernt Einträge, deren Pfad unter root nicht mehr existiert (Reste früherer Läufe)"""
+        root = Path(root)
+        stale = [(e["path"],) for e in self.entries() if e["path"] and not os.path.lexists(root / e["path"])]
+        with self._lock:
+            self._conn.executemany("DELETE FROM entries WHERE path = ?", stale)
+            self._conn.commit()
+        return len(stale)
+
+    # -------------------------------------------------------------
+    # Lesen
+    # -------------------------------------------------------------
+    def get(self, path: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, uid, gid, mode, kind, major, minor, source FROM entries WHERE path = ?",
+                (normalize_path(path),)
+            ).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def entries(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, uid, gid, mode, kind, major, minor, source FROM entries ORDER BY path"
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def devices(self) -> list[dict]:
+        return [e for e in self.entries() if e["kind"] in ("char", "block")]
+
+    def resolve(self, path: str, st: os.stat_result) -> dict:
+        """Effektive Metadaten für einen Pfad (siehe resolve_metadata)"""
+        return resolve_metadata(self.get(path), st)
+
+    def snapshot(self) -> dict[str, dict]:
+        """Alle Einträge als dict path -> Eintrag (für Massenabfragen in Image-Writern)"""
+        return {entry["path"]: entry for entry in self.entries()}
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        keys = ("path", "uid", "gid", "mode", "kind", "major", "minor", "source")
+        return dict(zip(keys, row))
+
+
+def resolve_metadata(entry: dict | None, st: os.stat_result) -> dict:
+    """
+    Effektive Metadaten: Eintrag aus der DB vor den Werten von der Platte.
+    Liefert uid, gid, mode (inkl. Typ-Bits), kind, major, minor.
+    """
+    entry = entry or {}
+    kind = entry.get("kind") or KIND_FROM_MODE.get(stat.S_IFMT(st.st_mode), "file")
+    perm = entry.get("mode")
+    if perm is None:
+        perm = stat.S_IMODE(st.st_mode)
+
+    major = entry.get("major")
+    minor = entry.get("minor")
+    if major is None and kind in ("char", "block") and stat.S_IFMT(st.st_mode) in (stat.S_IFCHR, stat.S_IFBLK):
+        major, minor = os.major(st.st_rdev), os.minor(st.st_rdev)
+
+    return {
+        "uid": entry.get("uid") or 0,
+        "gid": entry.get("gid") or 0,
+        "mode": MODE_FROM_KIND[kind] | perm,
+        "kind": kind,
+        "major": major,
+        "minor": minor,
+    }
+
+
+# -----------------------------
+# mtree (pacman .MTREE)
+# -----------------------------
+
+_MTREE_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _mtree_unescape(value: str) -> str:
+    return _MTREE_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), value).replace("\\\\", "\\")
+
+
+def parse_mtree(text: str):
+    """
+    Liefert (pfad, attribute) für jede Zeile eines mtree-Manifests.
+    Unterstützt /set, /unset und Zeilenfortsetzung mit Backslash.
+    """
+    defaults: dict[str, str] = {}
+    pending = ""
+
+    for raw in text.splitlines():
+        line = pending + raw.strip()
+        if line.endswith("\\") and not line.endswith("\\\\"):
+            pending = line[:-1] + " "
+            continue
+        pending = ""
+
+        if not line or line.startswith("#"):
+            continue
+
+        fields = line.split()
+        keyword, rest = fields[0], fields[1:]
+
+        if keyword == "/set":
+            for item in rest:
+                key, _, val = item.partition("=")
+                defaults[key] = val
+            continue
+        if keyword == "/unset":
+            for key in rest:
+                defaults.pop(key, None)
+            continue
+
+        attrs = dict(defaults)
+        for item in rest:
+            key, _, val = item.partition("=")
+            attrs[key] = val
+
+        yield normalize_path(_mtree_unescape(keyword)), attrs
+
+
+MTREE_KINDS = {"file": "file", "dir": "dir", "link": "link", "char": "char", "block": "block", "fifo": "fifo"}
+
+
+def mtree_rows(text: str, source: str | None = None) -> list[tuple]:
+    """Wandelt ein mtree-Manifest in FSMetadata-Zeilen um (pacman-Metadateien werden übersprungen)"""
+    rows = []
+    for path, attrs in parse_mtree(text):
+        if not path or path.startswith("."):
+            continue
+
+        major = minor = None
+        device = attrs.get("device")
+        if device:
+            # Format: native,<major>,<minor>
+            parts = device.split(",")
+            if len(parts) == 3:
+                major, minor = int(parts[1]), int(parts[2])
+
+        rows.append((
+            path,
+            int(attrs.get("uid", 0)),
+            int(attrs.get("gid", 0)),
+            int(attrs["mode"], 8) if "mode" in attrs else None,
+            MTREE_KINDS.get(attrs.get("type", "file"), "file"),
+            major,
+            minor,
+            source,
+        ))
+    return rows
+
+
+# -----------------------------
+# tar (vorgebaute Installationsbäume)
+# -----------------------------
+
+def tar_member_row(member, source: str | None = None) -> tuple:
+    """Eintrag (path, uid, gid, mode, kind, major, minor, source) für ein tarfile.TarInfo"""
+    if member.isdir():
+        kind = "dir"
+    elif member.issym():
+        kind = "link"
+    elif member.ischr():
+        kind = "char"
+    elif member.isblk():
+        kind = "block"
+    elif member.isfifo():
+        kind = "fifo"
+    else:
+        kind = "file"
+    is_node = kind in ("char", "block")
+    return (
+        member.name, member.uid, member.gid, stat.S_IMODE(member.mode), kind,
+        member.devmajor if is_node else None, member.devminor if is_node else None, source
+    )
+
+
+# -----------------------------
+# apk (lib/apk/db/installed)
+# -----------------------------
+
+def apk_installed_rows(installed_db: Path) -> list[tuple]:
+    """
+    Liest Owner/Modi aus der apk-Datenbank:
+    F:<dir> + M:uid:gid:mode für Verzeichnisse, R:<datei> + a:uid:gid:mode für Dateien.
+    """
+    rows = []
+    package = None
+    current_dir = ""
+    current_file = None
+
+    for line in Path(installed_db).read_text(errors="replace").splitlines():
+        key, _, value = line.partition(":")
+        if key == "P":
+            package = value
+        elif key == "F":
+            current_dir = value
+            current_file = None
+        elif key == "R":
+            current_file = f"{current_dir}/{value}" if current_dir else value
+        elif key in ("M", "a"):
+            uid, gid, mode = value.split(":")[:3]
+            path = current_dir if key == "M" else current_file
+            if path:
+                rows.append((path, int(uid), int(gid), int(mode, 8), "dir" if key == "M" else None, None, None, package))
+
+    return rows
+
+
+def record_apk_installed(meta: FSMetadata, rootfs_dir: Path, path_filter=None) -> int:
+    installed_db = Path(rootfs_dir) / "lib/apk/db/installed"
+    if not installed_db.exists():
+        warning(f"[meta] apk-Datenbank nicht gefunden: {installed_db}")
+        return 0
+
+    rows = apk_installed_rows(installed_db)
+    if path_filter:
+        rows = [row for row in rows if not path_filter.excluded(row[0])]
+    meta.record_many(rows)
+    info(f"[meta] {len(rows)} Einträge aus der apk-Datenbank übernommen.")
+    return len(rows)
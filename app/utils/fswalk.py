@@ -0,0 +1,50 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+
+# -----------------------------
+# Paralleler Verzeichnis-Walker
+# -----------------------------
+# Jedes Verzeichnis wird als eigener Task per os.scandir gelesen, Unterverzeichnisse
+# werden sofort wieder in den Pool gegeben. stat/chmod/read geben die GIL frei,
+# daher skaliert das auch mit Threads auf großen RootFS-Bäumen.
+
+
+def _scan(path: str, rel: str, visit) -> tuple[list[tuple[str, str]], list]:
+    subdirs, results = [], []
+
+    with os.scandir(path) as it:
+        for entry in it:
+            entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+            result = visit(entry, entry_rel)
+            if result is not None:
+                results.append(result)
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, entry_rel))
+
+    return subdirs, results
+
+
+def parallel_walk(root: Path, visit, jobs: int | None = None) -> list:
+    """
+    Ruft visit(entry: os.DirEntry, rel: str) für jeden Eintrag unter root auf
+    (Symlinks werden nicht verfolgt) und sammelt alle Rückgabewerte != None.
+    visit läuft in Worker-Threads und muss thread-sicher sein.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    results = []
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = {pool.submit(_scan, str(root), "", visit)}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, found = future.result()
+                results.extend(found)
+                for path, rel in subdirs:
+                    pending.add(pool.submit(_scan, path, rel, visit))
+
+    return results
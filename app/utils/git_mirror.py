@@ -0,0 +1,154 @@
+import re
+import shutil
+import hashlib
+import subprocess
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Git Mirror Store
+# -----------------------------
+# Ein Bare-Repository pro Upstream-URL unter <work_dir>/mirrors.
+# Builds holen nur den gepinnten Ref inkrementell nach und arbeiten
+# in eigenen `git worktree`-Checkouts, statt jedes Mal neu zu klonen.
+
+MIRRORS_SUBDIR = "mirrors"
+
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def _git(args: list[str], git_dir: Path | None = None, cwd: Path | None = None) -> str:
+    """Führt einen git-Befehl aus und liefert stdout, wirft RuntimeError bei Fehler"""
+    cmd = ["git"]
+    if git_dir is not None:
+        cmd += ["--git-dir", str(git_dir)]
+    cmd += args
+
+    result = subprocess.run(
+        cmd,
+        cwd=str(cwd) if cwd else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Befehl fehlgeschlagen: {' '.join(cmd)}\n{result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+def mirror_path(repo_url: str, mirrors_dir: Path) -> Path:
+    """Stabiler Verzeichnisname für eine Upstream-URL, z.B. linux-3f2a9c1d.git"""
+    name = repo_url.rstrip("/").split("/")[-1].removesuffix(".git") or "repo"
+    digest = hashlib.sha1(repo_url.encode()).hexdigest()[:8]
+    return Path(mirrors_dir) / f"{name}-{digest}.git"
+
+
+def ensure_mirror(repo_url: str, mirrors_dir: Path) -> Path:
+    """Legt das Bare-Repository für repo_url an, falls es noch nicht existiert"""
+    mirror = mirror_path(repo_url, mirrors_dir)
+
+    if (mirror / "HEAD").exists():
+        return mirror
+
+    info(f"[git] Lege Mirror an: {mirror}")
+    mirror.parent.mkdir(parents=True, exist_ok=True)
+    _git(["init", "--bare", "--quiet", str(mirror)])
+    _git(["remote", "add", "origin", repo_url], git_dir=mirror)
+    return mirror
+
+
+def _has_commit(mirror: Path, rev: str) -> bool:
+    try:
+        _git(["cat-file", "-e", f"{rev}^{{commit}}"], git_dir=mirror)
+        return True
+    except RuntimeError:
+        return False
+
+
+def fetch_ref(mirror: Path, ref: str, depth: int | None = 1) -> str:
+    """
+    Holt `ref` (Branch, Tag oder Commit) inkrementell in den Mirror und
+    liefert den aufgelösten Commit-SHA.
+
+    Ein bereits vorhandener, voll ausgeschriebener Commit-SHA wird ohne
+    Netzwerkzugriff aufgelöst.
+    """
+    if SHA_RE.match(ref) and _has_commit(mirror, ref):
+        info(f"[git] {ref[:12]} bereits im Mirror vorhanden, überspringe Fetch.")
+        return ref
+
+    local_ref = f"refs/pinned/{_ref_slug(ref)}"
+
+    info(f"[git] Fetch {ref} -> {mirror.name} ...")
+    fetch_cmd = ["fetch", "--quiet", "--no-tags"]
+    if depth:
+        fetch_cmd.append(f"--depth={depth}")
+    fetch_cmd += ["origin", f"+{ref}:{local_ref}"]
+
+    try:
+        _git(fetch_cmd, git_dir=mirror)
+    except RuntimeError:
+        # Manche Server erlauben keinen direkten Fetch von Commits per SHA
+        if not SHA_RE.match(ref):
+            raise
+        warning(f"[git] Fetch von Commit {ref[:12]} abgelehnt, hole vollständige Historie ...")
+        _git(["fetch", "--quiet", "--no-tags", "origin", "+refs/heads/*:refs/heads/*"], git_dir=mirror)
+
+        return _git(["rev-parse", f"{ref}^{{commit}}"], git_dir=mirror)
+
+    return _git(["rev-parse", f"{local_ref}^{{commit}}"], git_dir=mirror)
+
+
+def _ref_slug(ref: str) -> str:
+    return ref.removeprefix("refs/").replace("/", "_")
+
+
+def checkout_worktree(mirror: Path, commit: str, dest: Path) -> Path:
+    """
+    Checkt `commit` als eigenständigen Worktree des Mirrors nach dest aus.
+    Ein bestehender Worktree wird nur umgeschaltet, Build-Artefakte bleiben erhalten.
+    """
+    dest = Path(dest).resolve()
+
+    # Verwaiste Worktree-Einträge (gelöschte Verzeichnisse) aufräumen
+    _git(["worktree", "prune"], git_dir=mirror)
+
+    if (dest / ".git").is_file():
+        try:
+            current = _git(["rev-parse", "HEAD"], cwd=dest)
+            common = Path(_git(["rev-parse", "--git-common-dir"], cwd=dest))
+            if not common.is_absolute():
+                common = (dest / common).resolve()
+            if common == mirror.resolve():
+                if current != commit:
+                    info(f"[git] Wechsle Worktree {dest.name} auf {commit[:12]} ...")
+                    _git(["checkout", "--quiet", "--force", "--detach", commit], cwd=dest)
+                return dest
+        except RuntimeError:
+            pass
+
+    if dest.exists():
+        # Alter Vollklon oder fremder Worktree: durch Mirror-Worktree ersetzen
+        warning(f"[git] {dest} ist kein Worktree von {mirror.name}, ersetze Verzeichnis.")
+        shutil.rmtree(dest)
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    info(f"[git] Lege Worktree {dest} @ {commit[:12]} an ...")
+    _git(["worktree", "add", "--quiet", "--force", "--detach", str(dest), commit], git_dir=mirror)
+    return dest
+
+
+def prepare_source(repo_url: str, ref: str, dest: Path, work_dir: Path, depth: int | None = 1) -> tuple[Path, str]:
+    """
+    Mirror anlegen/aktualisieren, `ref` auflösen und als Worktree nach dest auschecken.
+    Gibt (Quellverzeichnis, Commit-SHA) zurück.
+    """
+    mirrors_dir = Path(work_dir) / MIRRORS_SUBDIR
+    mirror = ensure_mirror(repo_url, mirrors_dir)
+    commit = fetch_ref(mirror, ref, depth=depth)
+    src = checkout_worktree(mirror, commit, dest)
+    success(f"[git] {repo_url} @ {ref} ({commit[:12]}) -> {src}")
+    return src, commit
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# layout.py
+# Wendet ein deklaratives RootFS-Manifest (Verzeichnisse, Dateien, Symlinks,
+# Device Nodes) in einem einzigen Durchlauf an.
+
+import os
+import stat
+import hashlib
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error, debug
+
+
+# -----------------------------
+# Manifest-Einträge
+# -----------------------------
+# Jeder Eintrag ist ein dict mit "path" (relativ zum RootFS), "type" und "mode":
+#   {"path": "etc",          "type": "dir",     "mode": 0o755}
+#   {"path": "etc/hostname", "type": "file",    "mode": 0o644, "content": "...", "sha256": "..."}
+#   {"path": "bin/sh",       "type": "symlink", "target": "busybox", "requires": "bin/busybox"}
+#   {"path": "dev/null",     "type": "chr",     "mode": 0o666, "major": 1, "minor": 3}
+
+NODE_TYPES = {
+    "chr": stat.S_IFCHR,
+    "blk": stat.S_IFBLK,
+}
+
+# Manifest-Typ -> Typ in der Metadaten-DB (utils/fsmeta.py)
+META_KINDS = {
+    "dir": "dir",
+    "file": "file",
+    "symlink": "link",
+    "chr": "char",
+    "blk": "block",
+}
+
+
+def dir_entry(path: str, mode: int = 0o755) -> dict:
+    return {"path": path, "type": "dir", "mode": mode}
+
+
+def file_entry(path: str, content: str, mode: int = 0o644) -> dict:
+    data = content.encode()
+    return {
+        "path": path,
+        "type": "file",
+        "mode": mode,
+        "content": data,
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+
+
+def symlink_entry(path: str, target: str, requires: str | None = None) -> dict:
+    return {"path": path, "type": "symlink", "target": target, "requires": requires}
+
+
+def node_entry(path: str, kind: str, major: int, minor: int, mode: int) -> dict:
+    return {"path": path, "type": kind, "mode": mode, "major": major, "minor": minor}
+
+
+# -----------------------------
+# Applier
+# -----------------------------
+
+def _file_matches(path: Path, st: os.stat_result, entry: dict) -> bool:
+    """Vergleicht Größe und erst dann den Inhalts-Hash"""
+    if st.st_size != len(entry["content"]):
+        return False
+    return hashlib.sha256(path.read_bytes()).hexdigest() == entry["sha256"]
+
+
+def _apply_entry(root: Path, entry: dict) -> str:
+    """Wendet einen Eintrag an; liefert 'created', 'updated', 'unchanged' oder 'skipped'"""
+    path = root / entry["path"]
+    kind = entry["type"]
+    mode = entry.get("mode")
+
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        st = None
+
+    if kind == "dir":
+        if st is None:
+            path.mkdir(parents=True, exist_ok=True)
+            path.chmod(mode)
+            return "created"
+        if not stat.S_ISDIR(st.st_mode):
+            # z.B. bin -> usr/bin aus einem Merged-/usr Paket
+            return "skipped"
+        if stat.S_IMODE(st.st_mode) != mode:
+            path.chmod(mode)
+            return "updated"
+        return "unchanged"
+
+    if kind == "file":
+        if st is not None and stat.S_ISREG(st.st_mode) and _file_matches(path, st, entry):
+            if stat.S_IMODE(st.st_mode) != mode:
+                path.chmod(mode)
+                return "updated"
+            return "unchanged"
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            return "skipped"
+        if st is not None:
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(entry["content"])
+        path.chmod(mode)
+        return "created" if st is None else "updated"
+
+    if kind == "symlink":
+        requires = entry.get("requires")
+        if requires and not (root / requires).exists():
+            return "skipped"
+        if st is not None and stat.S_ISLNK(st.st_mode) and os.readlink(path) == entry["target"]:
+            return "unchanged"
+        if st is not None and stat.S_ISDIR(st.st_mode):
+            return "skipped"
+        if st is not None:
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.symlink_to(entry["target"])
+        return "created" if st is None else "updated"
+
+    if kind in NODE_TYPES:
+        rdev = os.makedev(entry["major"], entry["minor"])
+        if st is not None:
+            is_node = stat.S_IFMT(st.st_mode) == NODE_TYPES[kind] and st.st_rdev == rdev
+            # Simulierte Nodes (ohne Rootrechte) sind leere reguläre Dateien
+            is_placeholder = stat.S_ISREG(st.st_mode) and st.st_size == 0
+            if is_node or is_placeholder:
+                if stat.S_IMODE(st.st_mode) != mode:
+                    path.chmod(mode)
+                    return "updated"
+                return "unchanged"
+            path.unlink()
+        try:
+            os.mknod(path, NODE_TYPES[kind] | mode, rdev)
+        except PermissionError:
+            # Ohne Rootrechte: Platzhalter, der echte Node steht in der Metadaten-DB
+            path.touch()
+        path.chmod(mode)
+        return "created" if st is None else "updated"
+
+    raise ValueError(f"Unbekannter Manifest-Typ '{kind}' für {entry['path']}")
+
+
+def apply_layout(root: Path, entries: list[dict], meta=None) -> dict:
+    """
+    Wendet alle Manifest-Einträge in einem Durchlauf auf root an.
+    Jeder Pfad wird genau einmal per lstat geprüft und nur bei Abweichung angefasst.
+    Mit meta (FSMetadata) werden Owner root:root, Modi und Device-Nummern
+    zusätzlich als Soll-Metadaten erfasst. Gibt die Anzahl je Aktion zurück.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+
+    summary = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    markers = {"created": "+", "updated": "~"}
+
+    meta_rows = []
+
+    for entry in entries:
+        action = _apply_entry(root, entry)
+        summary[action] += 1
+        if action in markers:
+            debug(f"[layout] {markers[action]} /{entry['path']}")
+        if action != "skipped":
+            meta_rows.append((
+                entry["path"], 0, 0, entry.get("mode"), META_KINDS[entry["type"]],
+                entry.get("major"), entry.get("minor"), "layout"
+            ))
+
+    if meta is not None:
+        meta.record_many(meta_rows)
+
+    info(
+        f"[layout] {root}: +{summary['created']} ~{summary['updated']} "
+        f"={summary['unchanged']} !{summary['skipped']} (neu/geändert/unverändert/übersprungen)"
+    )
+    return summary
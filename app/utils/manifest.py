@@ -0,0 +1,167 @@
+import os
+import json
+import mmap
+import stat
+import hashlib
+import threading
+
+from pathlib import Path
+
+from utils.fswalk import parallel_walk
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# RootFS Hash-Manifest
+# -----------------------------
+# Eine Zeile pro Pfad, sortiert, Tab-getrennt:
+#   <pfad>\t<modus oktal>\t<größe>\t<sha256 | ->\t<symlink-ziel | ->
+# Hashes werden pro (inode, größe, mtime_ns) gecacht, sodass ein erneutes
+# Manifest nur geänderte Dateien neu liest.
+
+MANIFEST_HEADER = "# nexuzcore-manifest v1\n"
+NO_VALUE = "-"
+
+
+def hash_file(path: str, size: int) -> str:
+    """sha256 über mmap (hashlib gibt dabei die GIL frei)"""
+    digest = hashlib.sha256()
+    if size:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            digest.update(mm)
+    return digest.hexdigest()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def _unescape(value: str) -> str:
+    out, i = [], 0
+    while i < len(value):
+        c = value[i]
+        if c == "\\" and i + 1 < len(value):
+            out.append({"t": "\t", "n": "\n"}.get(value[i + 1], value[i + 1]))
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+
+class HashCache:
+    """Persistenter Hash-Cache: rel -> (inode, größe, mtime_ns, sha256)"""
+
+    def __init__(self, path: Path | None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._entries: dict[str, list] = {}
+        self.hits = 0
+        self.misses = 0
+        if self.path and self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                warning(f"[manifest] Hash-Cache unlesbar, wird neu aufgebaut: {self.path}")
+
+    def lookup(self, rel: str, st: os.stat_result, path: str) -> str:
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        cached = self._entries.get(rel)
+        if cached and cached[:3] == key:
+            with self._lock:
+                self.hits += 1
+            return cached[3]
+
+        digest = hash_file(path, st.st_size)
+        with self._lock:
+            self.misses += 1
+            self._entries[rel] = key + [digest]
+        return digest
+
+    def save(self, keep: set[str]):
+        if not self.path:
+            return
+        # Einträge gelöschter Dateien verwerfen
+        entries = {rel: value for rel, value in self._entries.items() if rel in keep}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(entries, separators=(",", ":")))
+        os.replace(tmp, self.path)
+
+
+def scan_rootfs(rootfs_dir: Path, cache_path: Path | None = None, jobs: int | None = None) -> dict[str, tuple]:
+    """
+    Liest das RootFS parallel ein und liefert rel -> (modus, größe, sha256, ziel).
+    Nur reguläre Dateien werden gehasht; Symlinks tragen ihr Ziel.
+    """
+    cache = HashCache(cache_path)
+
+    def visit(entry: os.DirEntry, rel: str):
+        st = entry.stat(follow_symlinks=False)
+        digest = target = NO_VALUE
+        size = 0
+        if stat.S_ISREG(st.st_mode):
+            size = st.st_size
+            digest = cache.lookup(rel, st, entry.path)
+        elif stat.S_ISLNK(st.st_mode):
+            target = os.readlink(entry.path)
+            size = len(target)
+        return rel, (st.st_mode, size, digest, target)
+
+    entries = dict(parallel_walk(Path(rootfs_dir), visit, jobs=jobs))
+    cache.save(set(entries))
+    info(f"[manifest] {len(entries)} Pfade, {cache.misses} gehasht, {cache.hits} aus dem Cache.")
+    return entries
+
+
+def write_manifest(entries: dict[str, tuple], manifest_path: Path) -> Path:
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(MANIFEST_HEADER)
+        for rel in sorted(entries):
+            mode, size, digest, target = entries[rel]
+            f.write(f"{_escape(rel)}\t{mode:o}\t{size}\t{digest}\t{_escape(target)}\n")
+    os.replace(tmp, manifest_path)
+    return manifest_path
+
+
+def read_manifest(manifest_path: Path) -> dict[str, tuple]:
+    entries = {}
+    with open(manifest_path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            rel, mode, size, digest, target = line.rstrip("\n").split("\t")
+            entries[_unescape(rel)] = (int(mode, 8), int(size), digest, _unescape(target))
+    return entries
+
+
+def diff_manifests(old: dict[str, tuple], new: dict[str, tuple]) -> dict[str, list[str]]:
+    """Vergleicht zwei Manifeste: added, removed, changed (Inhalt/Ziel/Typ) und mode (nur Rechte)"""
+    added = sorted(new.keys() - old.keys())
+    removed = sorted(old.keys() - new.keys())
+    changed, mode = [], []
+    for rel in sorted(old.keys() & new.keys()):
+        a, b = old[rel], new[rel]
+        if stat.S_IFMT(a[0]) != stat.S_IFMT(b[0]) or a[1:] != b[1:]:
+            changed.append(rel)
+        elif a[0] != b[0]:
+            mode.append(rel)
+    return {"added": added, "removed": removed, "changed": changed, "mode": mode}
+
+
+def generate_manifest(rootfs_dir: Path, manifest_path: Path, cache_path: Path | None = None,
+                      jobs: int | None = None) -> dict[str, tuple]:
+    """Erzeugt das Manifest für rootfs_dir und gibt die Einträge zurück"""
+    rootfs_dir = Path(rootfs_dir)
+    if not rootfs_dir.is_dir():
+        error(f"[manifest] RootFS nicht gefunden: {rootfs_dir}")
+        raise SystemExit(1)
+
+    entries = scan_rootfs(rootfs_dir, cache_path=cache_path, jobs=jobs)
+    write_manifest(entries, manifest_path)
+    success(f"[manifest] Manifest geschrieben: {manifest_path}")
+    return entries
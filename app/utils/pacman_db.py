@@ -0,0 +1,561 @@
+import io
+import os
+import re
+import time
+import shutil
+import hashlib
+import sqlite3
+import tarfile
+import threading
+import subprocess
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# pacman Sync-Datenbanken
+# -----------------------------
+# Liest /var/lib/pacman/sync/<repo>.db (tar + gzip/zstd/xz, ein desc pro Paket)
+# direkt in Python und legt eine indizierte Paket-Tabelle in SQLite ab.
+# Ein Repo wird nur neu eingelesen, wenn sich mtime/Größe seiner .db ändert.
+# Versionsvergleich und Dependency-Matching folgen libalpm (vercmp, provides).
+
+SYNC_DB_DIR = Path("/var/lib/pacman/sync")
+PACMAN_CONF = Path("/etc/pacman.conf")
+
+DEP_KINDS = ("depends", "provides", "conflicts", "replaces")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    name     TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size     INTEGER
+);
+CREATE TABLE IF NOT EXISTS packages (
+    id       INTEGER PRIMARY KEY,
+    repo     TEXT,
+    name     TEXT,
+    version  TEXT,
+    arch     TEXT,
+    filename TEXT,
+    csize    INTEGER,
+    isize    INTEGER,
+    sha256   TEXT
+);
+CREATE TABLE IF NOT EXISTS deps (
+    pkg_id   INTEGER,
+    kind     TEXT,
+    name     TEXT,
+    op       TEXT,
+    version  TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE INDEX IF NOT EXISTS packages_repo ON packages (repo);
+CREATE INDEX IF NOT EXISTS deps_lookup ON deps (kind, name);
+CREATE INDEX IF NOT EXISTS deps_pkg ON deps (pkg_id, kind);
+"""
+
+
+# -------------------------------------------------------------
+# Versionen (libalpm: alpm_pkg_vercmp)
+# -------------------------------------------------------------
+
+def _rpmvercmp(a: str, b: str) -> int:
+    if a == b:
+        return 0
+
+    i = j = 0
+    seg1 = seg2 = 0
+    while i < len(a) and j < len(b):
+        while i < len(a) and not a[i].isalnum():
+            i += 1
+        while j < len(b) and not b[j].isalnum():
+            j += 1
+        if i >= len(a) or j >= len(b):
+            break
+
+        # Unterschiedlich lange Trenner entscheiden sofort
+        if i - seg1 != j - seg2:
+            return -1 if i - seg1 < j - seg2 else 1
+
+        p1, p2 = i, j
+        if a[p1].isdigit():
+            while p1 < len(a) and a[p1].isdigit():
+                p1 += 1
+            while p2 < len(b) and b[p2].isdigit():
+                p2 += 1
+            isnum = True
+        else:
+            while p1 < len(a) and a[p1].isalpha():
+                p1 += 1
+            while p2 < len(b) and b[p2].isalpha():
+                p2 += 1
+            isnum = False
+
+        one, two = a[i:p1], b[j:p2]
+        # Numerische Segmente sind immer neuer als alphabetische
+        if not two:
+            return 1 if isnum else -1
+
+        if isnum:
+            one, two = one.lstrip("0"), two.lstrip("0")
+            if len(one) != len(two):
+                return 1 if len(one) > len(two) else -1
+
+        if one != two:
+            return -1 if one < two else 1
+
+        i, j = p1, p2
+        seg1, seg2 = i, j
+
+    if i >= len(a) and j >= len(b):
+        return 0
+
+    # Ein übrig gebliebener Alpha-Rest ist nie neuer als ein leerer String
+    rest1 = a[i:] if i < len(a) else ""
+    rest2 = b[j:] if j < len(b) else ""
+    if (not rest1 and not rest2[:1].isalpha()) or rest1[:1].isalpha():
+        return -1
+    return 1
+
+
+def _parse_evr(evr: str) -> tuple[str, str, str | None]:
+    match = re.match(r"(\d*):", evr)
+    if match:
+        epoch = match.group(1) or "0"
+        evr = evr[match.end():]
+    else:
+        epoch = "0"
+    version, sep, release = evr.rpartition("-")
+    if not sep:
+        return epoch, evr, None
+    return epoch, version, release
+
+
+def vercmp(a: str, b: str) -> int:
+    """Wie pacman's vercmp: -1 (a älter), 0 (gleich), 1 (a neuer)"""
+    if a == b:
+        return 0
+    e1, v1, r1 = _parse_evr(a)
+    e2, v2, r2 = _parse_evr(b)
+    ret = _rpmvercmp(e1, e2)
+    if ret == 0:
+        ret = _rpmvercmp(v1, v2)
+        if ret == 0 and r1 and r2:
+            ret = _rpmvercmp(r1, r2)
+    return ret
+
+
+# -------------------------------------------------------------
+# Abhängigkeiten
+# -------------------------------------------------------------
+
+_DEP = re.compile(r"^([^<>=:]+?)(?:(>=|<=|=|<|>)([^:\s]+))?(?::\s.*)?$")
+
+
+def parse_dep(dep: str) -> tuple[str, str | None, str | None]:
+    """'glibc>=2.27' -> ('glibc', '>=', '2.27'); 'sh' -> ('sh', None, None)"""
+    match = _DEP.match(dep.strip())
+    if not match:
+        return dep.strip(), None, None
+    return match.group(1), match.group(2), match.group(3)
+
+
+def version_satisfies(version: str | None, op: str | None, wanted: str | None) -> bool:
+    if op is None:
+        return True
+    if version is None:
+        # Unversionierte provides erfüllen keine versionierte Abhängigkeit (wie libalpm)
+        return False
+    cmp = vercmp(version, wanted)
+    return {
+        "=": cmp == 0,
+        ">=": cmp >= 0,
+        "<=": cmp <= 0,
+        ">": cmp > 0,
+        "<": cmp < 0,
+    }[op]
+
+
+# -------------------------------------------------------------
+# .db Dateien lesen
+# -------------------------------------------------------------
+
+def _open_db(path: Path) -> tarfile.TarFile:
+    data = Path(path).read_bytes()
+    if data[:4] == b"\x28\xb5\x2f\xfd":
+        try:
+            import zstandard
+            data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+        except ImportError:
+            if not shutil.which("zstd"):
+                raise RuntimeError(f"{path} ist zstd-komprimiert, aber weder zstandard noch zstd ist verfügbar")
+            data = subprocess.run(["zstd", "-dcq"], input=data, stdout=subprocess.PIPE, check=True).stdout
+    # gzip/xz/bzip2/unkomprimiert erkennt tarfile selbst
+    return tarfile.open(fileobj=io.BytesIO(data), mode="r:*")
+
+
+def parse_desc(text: str) -> dict[str, list[str]]:
+    """%KEY%-Blöcke einer desc/depends-Datei -> {KEY: [werte]}"""
+    fields: dict[str, list[str]] = {}
+    key = None
+    for line in text.splitlines():
+        if line.startswith("%") and line.endswith("%") and len(line) > 2:
+            key = line[1:-1]
+            fields[key] = []
+        elif line and key:
+            fields[key].append(line)
+    return fields
+
+
+def read_sync_db(path: Path):
+    """Liefert pro Paket ein dict aus allen Feldern (neues Format: desc, altes: desc + depends)"""
+    entries: dict[str, dict[str, list[str]]] = {}
+    with _open_db(path) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            pkgdir, _, fname = member.name.rpartition("/")
+            if fname not in ("desc", "depends"):
+                continue
+            text = tar.extractfile(member).read().decode("utf-8", errors="replace")
+            entries.setdefault(pkgdir, {}).update(parse_desc(text))
+    return list(entries.values())
+
+
+def repo_order(conf: Path = PACMAN_CONF, available: list[str] | None = None) -> list[str]:
+    """Repos in der Reihenfolge aus pacman.conf (Priorität), unbekannte dahinter"""
+    order = []
+    if conf.exists():
+        for line in conf.read_text(errors="replace").splitlines():
+            line = line.strip()
+            if line.startswith("[") and line.endswith("]") and line != "[options]":
+                order.append(line[1:-1])
+    for repo in sorted(available or []):
+        if repo not in order:
+            order.append(repo)
+    return [repo for repo in order if available is None or repo in available]
+
+
+def repo_servers(arch: str, conf: Path = PACMAN_CONF) -> dict[str, list[str]]:
+    """Server-URLs pro Repo aus pacman.conf (inkl. Include=mirrorlist), $repo/$arch ersetzt"""
+    servers: dict[str, list[str]] = {}
+
+    def read(path: Path, repo: str | None):
+        if not path.is_file():
+            return
+        for line in path.read_text(errors="replace").splitlines():
+            line = line.split("#", 1)[0].strip()
+            if line.startswith("[") and line.endswith("]"):
+                repo = None if line == "[options]" else line[1:-1]
+                continue
+            key, _, value = (part.strip() for part in line.partition("="))
+            if repo is None or not value:
+                continue
+            if key == "Server":
+                url = value.replace("$repo", repo).replace("$arch", arch)
+                servers.setdefault(repo, []).append(url.rstrip("/"))
+            elif key == "Include":
+                read(Path(value), repo)
+
+    read(Path(conf), None)
+    return servers
+
+
+# =============================================================================
+# Paket-Index
+# =============================================================================
+
+class SyncDB:
+    """
+    Indizierte Sicht auf alle Sync-Repos.
+    Die Tabelle liegt in SQLite (mmap), wird pro Repo anhand von mtime/Größe aktualisiert
+    und kann gefahrlos zwischen Läufen wiederverwendet werden.
+    """
+
+    def __init__(self, cache_file: Path, sync_dir: Path = SYNC_DB_DIR, pacman_conf: Path = PACMAN_CONF):
+        self.sync_dir = Path(sync_dir)
+        self.cache_file = Path(cache_file)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.cache_file), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA mmap_size=268435456")
+        self._conn.executescript(SCHEMA)
+
+        self.repos = repo_order(Path(pacman_conf), [db.stem for db in self.sync_dir.glob("*.db")])
+        self._refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -------------------------------------------------------------
+    # Aktualisieren
+    # -------------------------------------------------------------
+    def _refresh(self):
+        known = dict((row[0], (row[1], row[2])) for row in self._conn.execute("SELECT name, mtime_ns, size FROM repos"))
+
+        for repo in self.repos:
+            db = self.sync_dir / f"{repo}.db"
+            st = db.stat()
+            if known.get(repo) == (st.st_mtime_ns, st.st_size):
+                continue
+            info(f"[syncdb] Lese {db} ...")
+            self._import_repo(repo, read_sync_db(db), st)
+
+        # Repos, die es nicht mehr gibt
+        for repo in set(known) - set(self.repos):
+            self._drop_repo(repo)
+        self._conn.commit()
+
+    def _drop_repo(self, repo: str):
+        self._conn.execute("DELETE FROM deps WHERE pkg_id IN (SELECT id FROM packages WHERE repo = ?)", (repo,))
+        self._conn.execute("DELETE FROM packages WHERE repo = ?", (repo,))
+        self._conn.execute("DELETE FROM repos WHERE name = ?", (repo,))
+
+    def _import_repo(self, repo: str, entries: list[dict], st):
+        with self._lock:
+            self._drop_repo(repo)
+            for fields in entries:
+                first = lambda key: fields.get(key, [None])[0]
+                cur = self._conn.execute(
+                    "INSERT INTO packages (repo, name, version, arch, filename, csize, isize, sha256) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (repo, first("NAME"), first("VERSION"), first("ARCH"), first("FILENAME"),
+                     int(first("CSIZE") or 0), int(first("ISIZE") or 0), first("SHA256SUM"))
+                )
+                rows = [
+                    (cur.lastrowid, kind, *parse_dep(dep))
+                    for kind in DEP_KINDS
+                    for dep in fields.get(kind.upper(), [])
+                ]
+                self._conn.executemany("INSERT INTO deps VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute("INSERT OR REPLACE INTO repos VALUES (?, ?, ?)", (repo, st.st_mtime_ns, st.st_size))
+            self._conn.commit()
+
+    # -------------------------------------------------------------
+    # Abfragen
+    # -------------------------------------------------------------
+    def _package(self, row) -> dict:
+        keys = ("id", "repo", "name", "version", "arch", "filename", "csize", "isize", "sha256")
+        pkg = dict(zip(keys, row))
+        with self._lock:
+            deps = self._conn.execute(
+                "SELECT kind, name, op, version FROM deps WHERE pkg_id = ?", (pkg["id"],)
+            ).fetchall()
+        for kind in DEP_KINDS:
+            pkg[kind] = [(name, op, version) for k, name, op, version in deps if k == kind]
+        return pkg
+
+    def _repo_rank(self, repo: str) -> int:
+        return self.repos.index(repo) if repo in self.repos else len(self.repos)
+
+    def get(self, name: str) -> dict | None:
+        """Paket mit exakt diesem Namen aus dem ersten Repo (pacman.conf-Reihenfolge)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, repo, name, version, arch, filename, csize, isize, sha256 FROM packages WHERE name = ?",
+                (name,)
+            ).fetchall()
+        if not rows:
+            return None
+        return self._package(min(rows, key=lambda row: self._repo_rank(row[1])))
+
+    def providers(self, name: str) -> list[dict]:
+        """Alle Pakete, die name per provides anbieten (repo-sortiert)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.id, p.repo, p.name, p.version, p.arch, p.filename, p.csize, p.isize, p.sha256 "
+                "FROM deps d JOIN packages p ON p.id = d.pkg_id WHERE d.kind = 'provides' AND d.name = ?",
+                (name,)
+            ).fetchall()
+        return [self._package(row) for row in sorted(rows, key=lambda row: self._repo_rank(row[1]))]
+
+    def satisfier(self, dep: str, selected: dict[str, dict] | None = None) -> dict | None:
+        """
+        Paket, das dep erfüllt: zuerst ein bereits gewähltes, dann exakter Name,
+        dann provides (mit Versionsprüfung wie libalpm).
+        """
+        name, op, wanted = parse_dep(dep)
+        selected = selected or {}
+
+        def provides_ok(pkg):
+            if pkg["name"] == name and version_satisfies(pkg["version"], op, wanted):
+                return True
+            return any(p == name and version_satisfies(v, op, wanted) for p, _, v in pkg["provides"])
+
+        for pkg in selected.values():
+            if provides_ok(pkg):
+                return pkg
+
+        pkg = self.get(name)
+        if pkg and version_satisfies(pkg["version"], op, wanted):
+            return pkg
+
+        for pkg in self.providers(name):
+            if provides_ok(pkg):
+                return pkg
+        return None
+
+    def resolve(self, targets: list[str], ignore_missing: bool = False) -> tuple[dict[str, dict], list[str]]:
+        """
+        Vollständige Abhängigkeits-Hülle für targets.
+        Gibt (Name -> Paket, nicht erfüllbare Abhängigkeiten) zurück.
+        """
+        selected: dict[str, dict] = {}
+        missing: list[str] = []
+        queue = list(targets)
+
+        while queue:
+            dep = queue.pop(0)
+            pkg = self.satisfier(dep, selected)
+            if pkg is None:
+                if not ignore_missing:
+                    raise RuntimeError(f"Abhängigkeit nicht erfüllbar: {dep}")
+                missing.append(dep)
+                continue
+            if pkg["name"] in selected:
+                continue
+            selected[pkg["name"]] = pkg
+            queue += [
+                f"{name}{op}{version}" if op else name
+                for name, op, version in pkg["depends"]
+            ]
+
+        return selected, missing
+
+
+# =============================================================================
+# Lokale Datenbank im RootFS (var/lib/pacman/local)
+# =============================================================================
+# Gleiches Format wie pacman (ALPM-DB Version 9): pro Paket <name>-<version>/{desc,files}.
+# Damit funktionieren pacman -Q/-Qk im Ziel, und der Installer kann inkrementell arbeiten.
+
+LOCAL_DB_DIR = Path("var") / "lib" / "pacman" / "local"
+ALPM_DB_VERSION = "9"
+
+# desc-Felder in pacman-Reihenfolge: %FELD% <- .PKGINFO-Schlüssel
+DESC_FIELDS = (
+    ("NAME", "pkgname"), ("VERSION", "pkgver"), ("BASE", "pkgbase"), ("DESC", "pkgdesc"),
+    ("URL", "url"), ("ARCH", "arch"), ("BUILDDATE", "builddate"), ("INSTALLDATE", None),
+    ("PACKAGER", "packager"), ("SIZE", "size"), ("REASON", None), ("GROUPS", "group"),
+    ("LICENSE", "license"), ("VALIDATION", None), ("REPLACES", "replaces"), ("DEPENDS", "depend"),
+    ("OPTDEPENDS", "optdepend"), ("CONFLICTS", "conflict"), ("PROVIDES", "provides"), ("XDATA", "xdata"),
+)
+
+
+def parse_pkginfo(data: bytes) -> dict[str, list[str]]:
+    """.PKGINFO ('schlüssel = wert', Schlüssel dürfen sich wiederholen)"""
+    fields: dict[str, list[str]] = {}
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if line.startswith("#") or " = " not in line:
+            continue
+        key, _, value = line.partition(" = ")
+        fields.setdefault(key.strip(), []).append(value.strip())
+    return fields
+
+
+def file_md5(path: Path) -> str:
+    """md5 wie in %BACKUP% der lokalen Datenbank"""
+    return hashlib.md5(Path(path).read_bytes()).hexdigest()
+
+
+def _write_fields(path: Path, fields: list[tuple[str, list[str]]]):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text("".join(f"%{key}%\n" + "".join(f"{v}\n" for v in values) + "\n"
+                           for key, values in fields if values))
+    os.replace(tmp, path)
+
+
+class LocalDB:
+    """pacman-kompatible lokale Paket-Datenbank eines RootFS"""
+
+    def __init__(self, rootfs_dir: Path):
+        self.rootfs_dir = Path(rootfs_dir)
+        self.path = self.rootfs_dir / LOCAL_DB_DIR
+
+    def packages(self) -> dict[str, dict]:
+        """Name -> {version, dir, reason}"""
+        result = {}
+        if not self.path.is_dir():
+            return result
+        for entry in os.scandir(self.path):
+            desc = Path(entry.path) / "desc"
+            if not entry.is_dir() or not desc.is_file():
+                continue
+            fields = parse_desc(desc.read_text(errors="replace"))
+            if fields.get("NAME") and fields.get("VERSION"):
+                result[fields["NAME"][0]] = {
+                    "version": fields["VERSION"][0],
+                    "dir": Path(entry.path),
+                    "reason": int(fields.get("REASON", ["0"])[0]),
+                }
+        return result
+
+    def files(self, entry: dict) -> list[str]:
+        """Dateiliste eines Pakets (Verzeichnisse mit abschließendem /)"""
+        files = entry["dir"] / "files"
+        if not files.is_file():
+            return []
+        return parse_desc(files.read_text(errors="replace")).get("FILES", [])
+
+    def backup(self, entry: dict) -> dict[str, str]:
+        """%BACKUP% eines Pakets: rel-Pfad -> md5 der Paket-Version"""
+        files = entry["dir"] / "files"
+        if not files.is_file():
+            return {}
+        lines = parse_desc(files.read_text(errors="replace")).get("BACKUP", [])
+        return dict(line.split("\t", 1) if "\t" in line else (line, "") for line in lines)
+
+    def backup_files(self) -> set[str]:
+        """Alle %BACKUP%-Pfade (vom Benutzer änderbare Konfigurationsdateien)"""
+        result = set()
+        for entry in self.packages().values():
+            result.update(self.backup(entry))
+        return result
+
+    def add(self, pkginfo: dict[str, list[str]], files: list[str], explicit: bool = True,
+            validation: str = "none", backup_hashes: dict[str, str] | None = None) -> Path:
+        """Legt den Eintrag <name>-<version> an (ersetzt ihn, falls vorhanden)"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        version_file = self.path / "ALPM_DB_VERSION"
+        if not version_file.exists():
+            version_file.write_text(ALPM_DB_VERSION + "\n")
+
+        name, version = pkginfo["pkgname"][0], pkginfo["pkgver"][0]
+        entry_dir = self.path / f"{name}-{version}"
+        entry_dir.mkdir(exist_ok=True)
+
+        computed = {
+            "INSTALLDATE": [str(int(time.time()))],
+            "REASON": [] if explicit else ["1"],
+            "VALIDATION": [validation],
+        }
+        _write_fields(entry_dir / "desc", [
+            (field, computed[field] if key is None else pkginfo.get(key, []))
+            for field, key in DESC_FIELDS
+        ])
+
+        # backup-Dateien mit md5 wie pacman, damit -Qii geänderte Konfigs erkennt
+        # (backup_hashes: md5 der Paket-Version, wenn die Datei des Benutzers erhalten blieb)
+        backup = []
+        for rel in pkginfo.get("backup", []):
+            path = self.rootfs_dir / rel
+            if rel in (backup_hashes or {}):
+                backup.append(f"{rel}\t{backup_hashes[rel]}")
+            elif path.is_file() and not path.is_symlink():
+                backup.append(f"{rel}\t{file_md5(path)}")
+        _write_fields(entry_dir / "files", [("FILES", sorted(files)), ("BACKUP", backup)])
+        return entry_dir
+
+    def remove(self, entry: dict):
+        shutil.rmtree(entry["dir"], ignore_errors=True)
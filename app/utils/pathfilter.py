@@ -0,0 +1,137 @@
+import os
+import re
+import shutil
+import fnmatch
+
+from pathlib import Path
+
+from utils.load import load_config
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Pfadfilter für Paket-Installationen
+# -----------------------------
+# Profile aus configs/install_filters.json: exclude-Globs verwerfen Pfade
+# (z.B. usr/share/man/*), include-Globs holen einzelne davon wieder zurück.
+# Globs sind relativ zum RootFS, "*" matcht auch "/".
+
+DEFAULT_FILTER_CONFIG = Path("configs") / "install_filters.json"
+
+
+class PathFilter:
+    """Entscheidet pro RootFS-Pfad, ob er installiert wird"""
+
+    def __init__(self, exclude: list[str] | None = None, include: list[str] | None = None, name: str = "custom"):
+        self.name = name
+        self.exclude = [p.strip("/") for p in exclude or []]
+        self.include = [p.strip("/") for p in include or []]
+        self._exclude = [re.compile(fnmatch.translate(p)) for p in self.exclude]
+        self._include = [re.compile(fnmatch.translate(p)) for p in self.include]
+
+    @classmethod
+    def from_profile(cls, profile: str | None = None, config_file: Path = DEFAULT_FILTER_CONFIG) -> "PathFilter":
+        config = load_config(config_file)
+        profile = profile or config.get("default_profile", "full")
+        if profile not in config["profiles"]:
+            raise ValueError(f"Unbekanntes Filter-Profil: {profile} (verfügbar: {', '.join(config['profiles'])})")
+        conf = config["profiles"][profile]
+        return cls(conf.get("exclude"), conf.get("include"), name=profile)
+
+    def __bool__(self):
+        return bool(self.exclude)
+
+    def excluded(self, rel: str) -> bool:
+        rel = rel[2:] if rel.startswith("./") else rel
+        rel = rel.strip("/")
+        if not any(r.match(rel) for r in self._exclude):
+            return False
+        return not any(r.match(rel) for r in self._include)
+
+
+# -------------------------------------------------------------
+# Nachträglich filtern / DESTDIR zusammenführen
+# -------------------------------------------------------------
+
+def prune_tree(root: Path, path_filter: PathFilter, meta=None) -> int:
+    """
+    Entfernt gefilterte Pfade aus einem bereits installierten Baum (für Installer ohne
+    Extraktions-Filter, z.B. apk.static). Leere, gefilterte Verzeichnisse werden mit entfernt.
+    Gibt die Anzahl entfernter Einträge zurück.
+    """
+    if not path_filter:
+        return 0
+
+    root = Path(root)
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = "" if rel_dir == "." else rel_dir
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if path_filter.excluded(rel):
+                os.unlink(os.path.join(dirpath, name))
+                removed += 1
+                if meta is not None:
+                    meta.remove(rel)
+        if rel_dir and path_filter.excluded(rel_dir) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+            removed += 1
+            if meta is not None:
+                meta.remove(rel_dir)
+    return removed
+
+
+def merge_tree(staging: Path, dest: Path, path_filter: PathFilter | None = None) -> tuple[int, int]:
+    """
+    Verschiebt einen DESTDIR-Staging-Baum per rename ins RootFS. Gefilterte Pfade werden
+    nie ins RootFS geschrieben. Gibt (übernommen, verworfen) zurück; staging wird danach gelöscht.
+    """
+    staging, dest = Path(staging), Path(dest)
+    moved = skipped = 0
+
+    for dirpath, dirnames, filenames in os.walk(staging):
+        rel_dir = os.path.relpath(dirpath, staging)
+        rel_dir = "" if rel_dir == "." else rel_dir
+
+        for name in list(dirnames):
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            src = os.path.join(dirpath, name)
+            if os.path.islink(src):
+                # Symlinks auf Verzeichnisse wie Dateien behandeln
+                dirnames.remove(name)
+                filenames.append(name)
+                continue
+            if path_filter and path_filter.excluded(rel):
+                # Mit include-Globs trotzdem absteigen, das Verzeichnis entsteht dann erst bei Bedarf
+                if not path_filter.include:
+                    dirnames.remove(name)
+                    skipped += 1
+                continue
+            target = dest / rel
+            if not target.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                shutil.copymode(src, target)
+
+        for name in filenames:
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            if path_filter and path_filter.excluded(rel):
+                skipped += 1
+                continue
+            target = dest / rel
+            if target.is_dir() and not target.is_symlink():
+                warning(f"[filter] {rel} ist im RootFS ein Verzeichnis, übersprungen.")
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(os.path.join(dirpath, name), target)
+            except OSError:
+                # Anderes Dateisystem: kopieren statt umbenennen
+                if target.is_symlink() or target.exists():
+                    target.unlink()
+                shutil.move(os.path.join(dirpath, name), target)
+            moved += 1
+
+    shutil.rmtree(staging, ignore_errors=True)
+    return moved, skipped
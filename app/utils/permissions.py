@@ -0,0 +1,106 @@
+import os
+import re
+import stat
+import fnmatch
+
+from pathlib import Path
+
+from utils.fswalk import parallel_walk
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Berechtigungs-Regeln
+# -----------------------------
+# Welt-beschreibbare Verzeichnisse – auch das RootFS-Skelett (utils/create.py) legt sie so an
+SPECIAL_DIR_MODES = {
+    "tmp": 0o1777,
+    "var/tmp": 0o1777,
+    "var/log": 0o777,
+    "var/run": 0o777,
+    "var/lock": 0o777,
+}
+
+# (muster, typ, modus) – erstes passendes Muster gewinnt.
+# muster: fnmatch-Glob relativ zum RootFS ("*" matcht auch "/", "usr/bin/*" ist damit ein Präfix)
+# typ:    "dir", "file" oder "any"
+# modus:  Zielmodus, oder None = unverändert lassen
+DEFAULT_PERMISSION_RULES = [
+    ("", "dir", 0o755),
+    *((path, "dir", mode) for path, mode in SPECIAL_DIR_MODES.items()),
+    ("dev", "dir", 0o755),
+    ("*.sh", "file", 0o755),
+    ("etc/init.d/rcS", "file", 0o755),
+    ("init", "file", 0o755),
+]
+
+# Verzeichnisnamen, deren Modus ohne explizite Regel nicht angefasst wird
+KEEP_DIR_NAMES = {"tmp", "run", "lock", "log", "dev"}
+
+EXEC_OR_SPECIAL = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH | stat.S_ISUID | stat.S_ISGID | stat.S_ISVTX
+
+
+def default_mode(is_dir: bool, name: str, mode: int) -> int:
+    """
+    Standardmodus ohne passende Regel:
+    Verzeichnisse -> 0755, Dateien -> 0644, außer sie sind ausführbar/setuid
+    oder absichtlich restriktiv (z.B. /etc/shadow 0600) – dann bleibt der Paketmodus.
+    """
+    if is_dir:
+        return mode if name in KEEP_DIR_NAMES else 0o755
+    if mode & EXEC_OR_SPECIAL or not mode & stat.S_IROTH:
+        return mode
+    return 0o644
+
+
+def _compile_rules(rules: list[tuple[str, str, int | None]]) -> list[tuple[re.Pattern, str, int | None]]:
+    return [(re.compile(fnmatch.translate(pattern)), kind, mode) for pattern, kind, mode in rules]
+
+
+def _target_mode(compiled, rel: str, is_dir: bool, name: str, mode: int) -> int:
+    kind = "dir" if is_dir else "file"
+    for regex, rule_kind, rule_mode in compiled:
+        if rule_kind in (kind, "any") and regex.match(rel):
+            return mode if rule_mode is None else rule_mode
+    return default_mode(is_dir, name, mode)
+
+
+def apply_permissions(root: Path, rules: list | None = None, jobs: int | None = None, meta=None) -> int:
+    """
+    Setzt Berechtigungen regelbasiert über das ganze RootFS.
+    Der Baum wird parallel per os.scandir gelesen, chmod nur bei Abweichung.
+    Symlinks und Device Nodes werden nie angefasst. Mit meta (FSMetadata) werden die
+    neuen Modi auch in vorhandene Einträge übernommen – dort gewinnt sonst der alte DB-Wert.
+    Gibt die Anzahl geänderter Pfade zurück.
+    """
+    root = Path(root)
+    compiled = _compile_rules(DEFAULT_PERMISSION_RULES if rules is None else rules)
+
+    def visit(entry: os.DirEntry, rel: str):
+        st = entry.stat(follow_symlinks=False)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if not is_dir and not stat.S_ISREG(st.st_mode):
+            return None
+
+        current = stat.S_IMODE(st.st_mode)
+        target = _target_mode(compiled, rel, is_dir, entry.name, current)
+        if target == current:
+            return None
+
+        os.chmod(entry.path, target)
+        return rel, target
+
+    changed = parallel_walk(root, visit, jobs=jobs)
+
+    # Das RootFS selbst (Regel mit leerem Muster)
+    current = stat.S_IMODE(os.lstat(root).st_mode)
+    target = _target_mode(compiled, "", True, "", current)
+    if target != current:
+        os.chmod(root, target)
+        changed.append(("", target))
+
+    if meta is not None:
+        meta.set_modes(changed)
+
+    return len(changed)
@@ -0,0 +1,48 @@
+import os
+import hashlib
+import tarfile
+import subprocess
+
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+from utils.shared_cache import SharedCache, default_cache
+
+
+# -----------------------------
+# Cache für vorgebaute Host-Tools (apk, opkg)
+# -----------------------------
+# Ein Build-Ergebnis hängt nur vom gepinnten Commit, der Zielarchitektur und der
+# Toolchain (Compiler-Version + Build-Optionen) ab. Schlüssel:
+#   prebuilt/<tool>/<arch>/<commit>-<toolchain-digest>/<datei>
+# Liegt im gemeinsamen Cache (falls gesetzt), sonst unter <work_dir>/cache.
+
+
+def prebuilt_cache(work_dir: Path) -> SharedCache:
+    return default_cache() or SharedCache(Path(work_dir) / "cache")
+
+
+def toolchain_version(compiler: str) -> str:
+    """Erste Zeile von '<compiler> --version' ('' wenn der Compiler fehlt)"""
+    try:
+        result = subprocess.run([compiler, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except FileNotFoundError:
+        return ""
+    return result.stdout.splitlines()[0].strip() if result.returncode == 0 and result.stdout else ""
+
+
+def prebuilt_key(tool: str, arch: str, commit: str, toolchain: str, options: list[str], filename: str) -> str:
+    digest = hashlib.sha256("\n".join([toolchain, *options]).encode()).hexdigest()[:16]
+    return f"prebuilt/{tool}/{arch}/{commit}-{digest}/{filename}"
+
+
+def pack_tree(src: Path, archive: Path):
+    """Packt einen Installationsbaum (DESTDIR) als tar.gz, Owner immer root:root"""
+    def as_root(member: tarfile.TarInfo) -> tarfile.TarInfo:
+        member.uid = member.gid = 0
+        member.uname = member.gname = "root"
+        return member
+
+    with tarfile.open(archive, "w:gz") as tar:
+        for entry in sorted(os.listdir(src)):
+            tar.add(Path(src) / entry, arcname=entry, filter=as_root)
@@ -0,0 +1,125 @@
+import os
+import fcntl
+import shutil
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+
+from core.logger import success, info, warning, error
+
+
+# -----------------------------
+# Gemeinsamer Download-/Paket-Cache für parallele Builds
+# -----------------------------
+# Ein Verzeichnis pro Host, von mehreren Builds gleichzeitig genutzt:
+# - pro Eintrag ein flock (.locks/<key>.lock), auch zwischen Threads eines Prozesses
+# - Download in eine temporäre Datei neben dem Ziel, dann os.replace (atomar)
+# - Single-Flight: wer den Lock bekommt, lädt; alle anderen warten und nehmen danach die fertige Datei
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("NEXUZCORE_CACHE_DIR", Path.home() / ".cache" / "nexuzcore"))
+
+
+class SharedCache:
+    """Prozess- und Thread-sicherer Datei-Cache (Schlüssel = relativer Pfad, z.B. 'pacman/bash-...pkg.tar.zst')"""
+
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR):
+        self.root = Path(root).expanduser().resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / ".locks").mkdir(exist_ok=True)
+        self.hits = 0
+        self.fetches = 0
+        self._stats = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        key = key.strip("/")
+        if not key or ".." in key.split("/"):
+            raise ValueError(f"Ungültiger Cache-Schlüssel: {key!r}")
+        return self.root / key
+
+    @contextmanager
+    def locked(self, key: str):
+        """Exklusiver flock auf key – blockiert, bis ein anderer Build/Thread fertig ist"""
+        lock_path = self.root / ".locks" / (key.strip("/").replace("/", "%") + ".lock")
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _valid(self, path: Path, verify) -> bool:
+        return path.is_file() and (verify is None or verify(path))
+
+    def publish(self, key: str, src: Path) -> Path:
+        """Übernimmt src atomar als Eintrag key (src wird verschoben)"""
+        dest = self.path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        shutil.move(str(src), tmp)
+        os.replace(tmp, dest)
+        return dest
+
+    def fetch(self, key: str, fetch, verify=None) -> Path:
+        """
+        Liefert den Pfad des Eintrags key. Fehlt er (oder schlägt verify fehl), lädt genau
+        ein Aufrufer ihn über fetch(tmp_path) – alle anderen warten auf dessen Ergebnis.
+        """
+        dest = self.path(key)
+        if self._valid(dest, verify):
+            with self._stats:
+                self.hits += 1
+            return dest
+
+        with self.locked(key):
+            # Ein anderer Build war schneller
+            if self._valid(dest, verify):
+                with self._stats:
+                    self.hits += 1
+                return dest
+
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.part")
+            try:
+                fetch(tmp)
+                if verify is not None and not verify(tmp):
+                    raise RuntimeError(f"Prüfung von {key} nach dem Download fehlgeschlagen")
+                os.replace(tmp, dest)
+            finally:
+                tmp.unlink(missing_ok=True)
+
+            with self._stats:
+                self.fetches += 1
+            return dest
+
+    def link_into(self, key: str, dest: Path) -> Path:
+        """Stellt den Eintrag unter dest bereit (Hardlink, sonst Kopie) – dest bleibt unabhängig vom Cache"""
+        src = self.path(key)
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, dest)
+        return dest
+
+
+# -------------------------------------------------------------
+# Prozessweiter Standard-Cache (von main.py gesetzt)
+# -------------------------------------------------------------
+
+_default_cache: SharedCache | None = None
+
+
+def set_default_cache(root: Path | None) -> SharedCache | None:
+    global _default_cache
+    _default_cache = SharedCache(root) if root else None
+    if _default_cache:
+        info(f"[cache] Gemeinsamer Cache: {_default_cache.root}")
+    return _default_cache
+
+
+def default_cache() -> SharedCache | None:
+    return _default_cache
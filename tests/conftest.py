@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# Module importieren sich relativ zu app/ (wie beim Aufruf von main.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
@@ -0,0 +1,107 @@
+import io
+import os
+import tarfile
+
+from base import alpine_baselayout
+from base.alpine_baselayout import APKInstaller
+from utils.apkindex import ApkIndex, read_apkindex
+
+
+# Fake apk.static: merkt sich die Argumente im RootFS statt Pakete zu installieren
+APK_STATIC = b"""#!/bin/sh
+root=""; prev=""
+for arg in "$@"; do [ "$prev" = "--root" ] && root="$arg"; prev="$arg"; done
+printf '%s\\n' "$@" > "$root/apk-args"
+"""
+
+INDEX = [
+    {"P": "musl", "V": "1.2.5-r0", "p": "so:libc.musl-x86_64.so.1=1"},
+    {"P": "busybox", "V": "1.36.1-r29", "D": "so:libc.musl-x86_64.so.1"},
+    {"P": "busybox-binsh", "V": "1.36.1-r29", "D": "busybox", "p": "cmd:sh /bin/sh", "k": "100"},
+    {"P": "dash-binsh", "V": "0.5.12-r3", "p": "cmd:sh /bin/sh", "k": "60"},
+    {"P": "alpine-baselayout", "V": "3.6.5-r0", "D": "alpine-baselayout-data>=3.6 musl"},
+    {"P": "alpine-baselayout-data", "V": "3.6.5-r0"},
+    {"P": "apk-tools", "V": "2.14.4-r0", "D": "so:libc.musl-x86_64.so.1 cmd:sh !apk-tools-legacy"},
+    {"P": "apk-tools-static", "V": "2.14.4-r0"},
+    {"P": "busybox-extras-openrc", "V": "1.36.1-r29", "i": "busybox alpine-baselayout"},
+    {"P": "bash-completion-apk", "V": "2.14.4-r0", "i": "apk-tools bash"},
+]
+
+
+def _tar_gz(files: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name, data in files.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            member.mode = 0o755
+            tar.addfile(member, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _make_mirror(mirror, arch="x86_64"):
+    repo = mirror / "main" / arch
+    repo.mkdir(parents=True)
+    blocks = []
+    for entry in INDEX:
+        files = {"sbin/apk.static": APK_STATIC} if entry["P"] == "apk-tools-static" else {".PKGINFO": b""}
+        apk = _tar_gz(files)
+        (repo / f"{entry['P']}-{entry['V']}.apk").write_bytes(apk)
+        fields = {"A": arch, "S": str(len(apk)), **entry}
+        blocks.append("".join(f"{key}:{value}\n" for key, value in fields.items()))
+    (repo / "APKINDEX.tar.gz").write_bytes(_tar_gz({"APKINDEX": "\n".join(blocks).encode()}))
+    return repo
+
+
+def test_apkindex_resolve_depends_provides_install_if(tmp_path):
+    index = ApkIndex(read_apkindex(_make_mirror(tmp_path / "mirror") / "APKINDEX.tar.gz"))
+
+    selected, missing = index.resolve(["alpine-baselayout", "busybox", "apk-tools"])
+
+    assert missing == []
+    assert sorted(selected) == [
+        "alpine-baselayout", "alpine-baselayout-data", "apk-tools", "busybox",
+        "busybox-binsh", "busybox-extras-openrc", "musl",
+    ]
+    # cmd:sh: höchste provider_priority gewinnt, install_if nur bei vollständiger Bedingung
+    assert "dash-binsh" not in selected
+    assert "bash-completion-apk" not in selected
+    assert selected["busybox"]["filename"] == "busybox-1.36.1-r29.apk"
+
+    _, missing = index.resolve(["doesnotexist", "so:libfoo.so.1"])
+    assert missing == ["doesnotexist", "so:libfoo.so.1"]
+
+
+def test_install_runs_apk_static_offline_from_local_cache(tmp_path, monkeypatch):
+    _make_mirror(tmp_path / "mirror")
+    monkeypatch.setenv("NEXUZCORE_ALPINE_MIRROR", f"file://{tmp_path / 'mirror'}")
+    rootfs = tmp_path / "rootfs"
+    rootfs.mkdir()
+
+    installer = APKInstaller(rootfs, "x86_64", work_dir=tmp_path / "work")
+    assert installer.install()
+
+    args = (rootfs / "apk-args").read_text().splitlines()
+    assert "--no-network" in args
+    assert args[args.index("--arch") + 1] == "x86_64"
+    local_repo = args[args.index("-X") + 1]
+    assert local_repo.startswith(str(tmp_path / "work" / "downloads" / "apk-cache"))
+    assert args[-3:] == list(APKInstaller.BASE_PACKAGES)
+
+    # Die ganze Hülle liegt vorab im lokalen Repository, apk.static braucht kein Netz
+    cached = {p.name for p in (tmp_path / "work" / "downloads" / "apk-cache").rglob("*.apk")}
+    assert {"busybox-binsh-1.36.1-r29.apk", "musl-1.2.5-r0.apk", "alpine-baselayout-data-3.6.5-r0.apk"} <= cached
+    assert os.listdir(os.path.join(local_repo, "x86_64"))
+    assert "alpinelinux.org" in (rootfs / "etc" / "apk" / "repositories").read_text()
+
+
+def test_default_cache_does_not_depend_on_cwd(tmp_path, monkeypatch):
+    monkeypatch.setattr(alpine_baselayout, "WORK_DIR", tmp_path / "work")
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+
+    installer = APKInstaller(tmp_path, "arm64")
+
+    assert installer.cache.root == tmp_path / "work" / "downloads" / "apk-cache"
+    assert not (elsewhere / "downloads").exists()
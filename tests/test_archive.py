@@ -0,0 +1,141 @@
+import io
+import os
+import stat
+import tarfile
+
+from utils.archive import extract_tar, resolve_in_dest, PACMAN_METADATA
+
+
+def _tar(path, members):
+    """members: (name, typ, daten/ziel, modus) mit typ in file, dir, sym, lnk"""
+    with tarfile.open(path, "w:gz") as tar:
+        for name, kind, value, mode in members:
+            info = tarfile.TarInfo(name)
+            info.mode = mode
+            if kind == "dir":
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif kind == "sym":
+                info.type = tarfile.SYMTYPE
+                info.linkname = value
+                tar.addfile(info)
+            elif kind == "lnk":
+                info.type = tarfile.LNKTYPE
+                info.linkname = value
+                tar.addfile(info)
+            else:
+                info.size = len(value)
+                tar.addfile(info, io.BytesIO(value))
+    return path
+
+
+class _Exclude:
+    def __init__(self, *prefixes):
+        self.prefixes = prefixes
+
+    def excluded(self, rel):
+        return rel.startswith(self.prefixes)
+
+
+def test_absolute_symlink_parent_resolves_inside_dest(tmp_path):
+    dest = tmp_path / "rootfs"
+    (dest / "usr" / "lib").mkdir(parents=True)
+    os.symlink("/usr/lib", dest / "lib")
+    archive = _tar(tmp_path / "pkg.tar.gz", [
+        ("lib/libfoo.so.1", "file", b"foo", 0o755),
+        ("bin", "sym", "usr/bin", 0o777),
+        ("usr/bin", "dir", None, 0o755),
+        ("bin/sh", "file", b"#!", 0o755),
+    ])
+
+    extracted = extract_tar(archive, dest)
+
+    assert (dest / "usr" / "lib" / "libfoo.so.1").read_bytes() == b"foo"
+    assert os.path.islink(dest / "lib")
+    # Ein im selben Archiv angelegter Symlink lenkt nachfolgende Member um
+    assert (dest / "usr" / "bin" / "sh").read_bytes() == b"#!"
+    assert "lib/libfoo.so.1" in extracted
+    assert resolve_in_dest(str(dest), "lib/libfoo.so.1") == "usr/lib/libfoo.so.1"
+    assert resolve_in_dest(str(dest), "bin/../lib/x") == "usr/lib/x"
+
+
+def test_parent_references_are_skipped(tmp_path):
+    dest = tmp_path / "rootfs"
+    archive = _tar(tmp_path / "evil.tar.gz", [
+        ("../escape", "file", b"x", 0o644),
+        ("usr/../../escape2", "file", b"x", 0o644),
+        ("etc/ok", "file", b"ok", 0o644),
+        ("etc/link", "lnk", "../outside", 0o644),
+    ])
+
+    extracted = extract_tar(archive, dest)
+
+    assert extracted == ["etc/ok"]
+    assert not (tmp_path / "escape").exists()
+    assert not (tmp_path / "escape2").exists()
+    assert not (dest / "etc" / "link").exists()
+
+
+def test_hardlink_to_filtered_target_is_skipped(tmp_path):
+    dest = tmp_path / "rootfs"
+    archive = _tar(tmp_path / "pkg.tar.gz", [
+        ("usr/share/doc/tool/README", "file", b"doc", 0o644),
+        ("usr/bin/tool", "file", b"bin", 0o755),
+        ("usr/bin/tool-alias", "lnk", "usr/bin/tool", 0o755),
+        ("usr/bin/readme", "lnk", "usr/share/doc/tool/README", 0o644),
+    ])
+
+    extracted = extract_tar(archive, dest, path_filter=_Exclude("usr/share/doc/"))
+
+    assert sorted(extracted) == ["usr/bin/tool", "usr/bin/tool-alias"]
+    assert not (dest / "usr" / "share").exists()
+    assert not os.path.lexists(dest / "usr" / "bin" / "readme")
+    assert os.stat(dest / "usr" / "bin" / "tool").st_ino == os.stat(dest / "usr" / "bin" / "tool-alias").st_ino
+
+
+def test_read_only_directory_gets_mode_after_contents(tmp_path):
+    dest = tmp_path / "rootfs"
+    archive = _tar(tmp_path / "pkg.tar.gz", [
+        ("etc", "dir", None, 0o755),
+        ("etc/ro", "dir", None, 0o555),
+        ("etc/ro/config", "file", b"cfg", 0o444),
+    ])
+
+    extracted = extract_tar(archive, dest)
+
+    assert extracted == ["etc/", "etc/ro/", "etc/ro/config"]
+    assert (dest / "etc" / "ro" / "config").read_bytes() == b"cfg"
+    assert stat.S_IMODE(os.stat(dest / "etc" / "ro").st_mode) == 0o555
+    os.chmod(dest / "etc" / "ro", 0o755)  # tmp_path aufräumbar lassen
+
+
+def test_metadata_is_kept_not_extracted(tmp_path):
+    dest = tmp_path / "rootfs"
+    archive = _tar(tmp_path / "pkg.tar.gz", [
+        (".PKGINFO", "file", b"pkgname = tool\n", 0o644),
+        (".MTREE", "file", b"#mtree\n", 0o644),
+        (".INSTALL", "file", b"post_install() { :; }\n", 0o644),
+        ("usr/bin/tool", "file", b"bin", 0o755),
+    ])
+    keep = {}
+
+    extracted = extract_tar(archive, dest, skip=PACMAN_METADATA, keep=keep)
+
+    assert extracted == ["usr/bin/tool"]
+    assert keep == {".PKGINFO": b"pkgname = tool\n", ".MTREE": b"#mtree\n", ".INSTALL": b"post_install() { :; }\n"}
+    assert not any(name.startswith(".") for name in os.listdir(dest))
+
+
+def test_preserve_dirs_keeps_existing_directory(tmp_path):
+    dest = tmp_path / "rootfs"
+    (dest / "usr").mkdir(parents=True)
+    os.chmod(dest / "usr", 0o755)
+    archive = _tar(tmp_path / "pkg.tar.gz", [
+        ("usr", "dir", None, 0o700),
+        ("usr/bin", "dir", None, 0o755),
+    ])
+
+    extracted = extract_tar(archive, dest, preserve_dirs=True)
+
+    assert extracted == ["usr/bin/"]
+    assert stat.S_IMODE(os.stat(dest / "usr").st_mode) == 0o755
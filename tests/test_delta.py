@@ -0,0 +1,144 @@
+import os
+import json
+import stat
+import shutil
+import tarfile
+
+import pytest
+
+from core.delta import generate_delta, apply_delta, verify_tree, generate_image_delta, apply_image_delta
+from utils.fsmeta import FSMetadata
+
+
+pytestmark = pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd nicht installiert")
+
+
+def _make_tree(root, content: bytes):
+    (root / "dev").mkdir(parents=True)
+    (root / "etc").mkdir()
+    (root / "etc" / "hostname").write_bytes(content)
+    os.mkfifo(root / "dev" / "initctl", 0o600)
+    if os.geteuid() == 0:
+        os.mknod(root / "dev" / "null", stat.S_IFCHR | 0o666, os.makedev(1, 3))
+        os.chmod(root / "dev" / "null", 0o666)
+
+
+def test_apply_delta_recreates_device_nodes_and_fifos(tmp_path):
+    old, new, rebuilt = tmp_path / "old", tmp_path / "new", tmp_path / "rebuilt"
+    _make_tree(old, b"old\n")
+    _make_tree(new, b"new\n")
+
+    generate_delta(old, new, tmp_path / "update.delta")
+    apply_delta(tmp_path / "update.delta", old, rebuilt)
+
+    assert (rebuilt / "etc" / "hostname").read_bytes() == b"new\n"
+    assert stat.S_ISFIFO(os.lstat(rebuilt / "dev" / "initctl").st_mode)
+    if os.geteuid() == 0:
+        st = os.lstat(rebuilt / "dev" / "null")
+        assert stat.S_ISCHR(st.st_mode)
+        assert (os.major(st.st_rdev), os.minor(st.st_rdev)) == (1, 3)
+        assert stat.S_IMODE(st.st_mode) == 0o666
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="mknod braucht Rootrechte")
+def test_verify_tree_detects_wrong_device_numbers(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    os.mknod(root / "null", stat.S_IFCHR | 0o666, os.makedev(1, 5))
+    os.chmod(root / "null", 0o666)
+    entries = [{"path": "null", "mode": stat.S_IFCHR | 0o666, "major": 1, "minor": 3}]
+
+    assert verify_tree(root, entries) == ["null"]
+    assert verify_tree(root, entries, skip={"null"}) == []
+
+
+def _entries(delta):
+    with tarfile.open(delta) as tar:
+        return {e["path"]: e for e in json.load(tar.extractfile("delta.json"))["entries"]}
+
+
+def test_delta_picks_old_patch_or_blob_source(tmp_path):
+    old, new, rebuilt = tmp_path / "old", tmp_path / "new", tmp_path / "rebuilt"
+    for root in (old, new):
+        (root / "usr" / "lib").mkdir(parents=True)
+    big = os.urandom(256 * 1024)
+    (old / "usr" / "lib" / "libbig.so").write_bytes(big)
+    (old / "usr" / "lib" / "moved.dat").write_bytes(b"same content\n" * 100)
+
+    # geändert (wenige Bytes) -> Patch, verschoben -> Kopie aus dem alten Build, neu -> Blob
+    (new / "usr" / "lib" / "libbig.so").write_bytes(big[:1000] + b"patched" + big[1007:])
+    (new / "usr" / "lib" / "renamed.dat").write_bytes(b"same content\n" * 100)
+    (new / "usr" / "lib" / "fresh.dat").write_bytes(os.urandom(4096))
+    os.symlink("libbig.so", new / "usr" / "lib" / "libbig.so.1")
+
+    report = generate_delta(old, new, tmp_path / "update.delta")
+    entries = _entries(tmp_path / "update.delta")
+
+    assert entries["usr/lib/libbig.so"]["source"] == "patch"
+    assert entries["usr/lib/renamed.dat"]["source"] == "old"
+    assert entries["usr/lib/renamed.dat"]["from"] == "usr/lib/moved.dat"
+    assert entries["usr/lib/fresh.dat"]["source"] == "blob"
+    assert entries["usr/lib/libbig.so.1"]["target"] == "libbig.so"
+    assert (report["patched"], report["copied"], report["blobs"]) == (1, 1, 1)
+    assert report["removed"] == 1
+    assert report["size"] < len(big) // 2
+
+    apply_delta(tmp_path / "update.delta", old, rebuilt)
+    assert (rebuilt / "usr" / "lib" / "libbig.so").read_bytes() == (new / "usr" / "lib" / "libbig.so").read_bytes()
+    assert not (rebuilt / "usr" / "lib" / "moved.dat").exists()
+    assert os.readlink(rebuilt / "usr" / "lib" / "libbig.so.1") == "libbig.so"
+
+
+def test_delta_keeps_owner_and_mtime(tmp_path):
+    old, new, rebuilt = tmp_path / "old", tmp_path / "new", tmp_path / "rebuilt"
+    _make_tree(old, b"old\n")
+    _make_tree(new, b"new\n")
+    os.utime(new / "etc" / "hostname", (1_600_000_000, 1_600_000_000))
+
+    # Rootless Build: Owner stehen nur in der Metadaten-DB
+    with FSMetadata(tmp_path / "meta.db") as meta:
+        meta.record("etc/hostname", uid=1234, gid=5678, mode=0o644, kind="file")
+        generate_delta(old, new, tmp_path / "update.delta", meta=meta)
+
+    entry = _entries(tmp_path / "update.delta")["etc/hostname"]
+    assert (entry["uid"], entry["gid"], entry["mtime"]) == (1234, 5678, 1_600_000_000)
+
+    apply_delta(tmp_path / "update.delta", old, rebuilt)
+    st = os.stat(rebuilt / "etc" / "hostname")
+    assert st.st_mtime == 1_600_000_000
+    if os.geteuid() == 0:
+        assert (st.st_uid, st.st_gid) == (1234, 5678)
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="chown braucht Rootrechte")
+def test_verify_tree_detects_wrong_owner(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    (root / "shadow").write_bytes(b"")
+    os.chmod(root / "shadow", 0o600)
+    entries = [{"path": "shadow", "mode": stat.S_IFREG | 0o600, "size": 0,
+                "sha256": "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855", "uid": 0, "gid": 42}]
+
+    assert verify_tree(root, entries) == []
+    assert verify_tree(root, entries, check_owner=True) == ["shadow"]
+    os.chown(root / "shadow", 0, 42)
+    assert verify_tree(root, entries, check_owner=True) == []
+
+
+def test_image_delta_roundtrip(tmp_path):
+    old_image = tmp_path / "old.img"
+    new_image = tmp_path / "new.img"
+    data = bytearray(os.urandom(1024 * 1024))
+    old_image.write_bytes(bytes(data))
+    data[4096:4096 + 512] = b"\xff" * 512
+    new_image.write_bytes(bytes(data))
+
+    report = generate_image_delta(old_image, new_image, tmp_path / "image.delta")
+    assert report["size"] < 64 * 1024
+
+    apply_image_delta(old_image, tmp_path / "image.delta", tmp_path / "rebuilt.img")
+    assert (tmp_path / "rebuilt.img").read_bytes() == new_image.read_bytes()
+
+    # Falsche Basis wird vor dem Patchen erkannt
+    with pytest.raises(RuntimeError, match="Basis-Image"):
+        apply_image_delta(new_image, tmp_path / "image.delta", tmp_path / "wrong.img")
@@ -0,0 +1,81 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from core.elfdeps import prune_libraries
+
+
+pytestmark = pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc nicht installiert")
+
+
+def _so(out, source, *libs, lib_dir=None):
+    src = out.with_suffix(".c")
+    src.write_text(source)
+    cmd = ["gcc", "-shared", "-fPIC", "-Wl,--no-as-needed", "-o", str(out), str(src)]
+    if libs:
+        cmd += [f"-L{lib_dir}", *(f"-l{lib}" for lib in libs)]
+    subprocess.run(cmd, check=True)
+    src.unlink()
+
+
+@pytest.fixture
+def rootfs(tmp_path):
+    """app -> liba.so -> libb.so (libb.so hat einen zweiten Hardlink-Namen), dazu Unbenutztes"""
+    root = tmp_path / "rootfs"
+    lib = root / "usr" / "lib"
+    bin_dir = root / "usr" / "bin"
+    lib.mkdir(parents=True)
+    bin_dir.mkdir(parents=True)
+
+    _so(lib / "libb.so", "int b(void) { return 1; }\n")
+    # Zweiter Name zuerst sortiert: scan_objects führt das Objekt unter libb-compat.so
+    os.link(lib / "libb.so", lib / "libb-compat.so")
+    _so(lib / "liba.so", "int b(void); int a(void) { return b(); }\n", "b", lib_dir=lib)
+
+    main = tmp_path / "main.c"
+    main.write_text("int a(void); int main(void) { return a(); }\n")
+    subprocess.run(["gcc", "-Wl,--no-as-needed", f"-Wl,-rpath-link,{lib}", "-o", str(bin_dir / "app"), str(main),
+                    f"-L{lib}", "-la"], check=True)
+
+    # Unerreichbar, mit zwei Hardlink-Namen und einem Symlink
+    _so(lib / "libunused.so.1.0", "int unused(void) { return 0; }\n")
+    os.link(lib / "libunused.so.1.0", lib / "libunused-copy.so.1")
+    os.symlink("libunused.so.1.0", lib / "libunused.so.1")
+    # Schon vorher verwaist: gehört nicht zu diesem Lauf
+    os.symlink("libgone.so.2.0", lib / "libgone.so.2")
+    return root
+
+
+def test_report_follows_needed_chain_through_hardlink_names(rootfs):
+    report = prune_libraries(rootfs, ["usr/bin/*"])
+
+    assert "usr/bin/app" in report["reachable"]
+    assert "usr/lib/liba.so" in report["reachable"]
+    assert "usr/lib/libb-compat.so" in report["reachable"]
+    assert report["unreachable"] == ["usr/lib/libunused-copy.so.1"]
+    assert "liba.so" not in report["missing"].get("usr/bin/app", [])
+    assert (rootfs / "usr" / "lib" / "libunused.so.1.0").exists()
+
+
+def test_remove_deletes_all_names_and_only_own_symlinks(rootfs):
+    lib = rootfs / "usr" / "lib"
+
+    report = prune_libraries(rootfs, ["usr/bin/*"], remove=True)
+
+    assert not os.path.lexists(lib / "libunused.so.1.0")
+    assert not os.path.lexists(lib / "libunused-copy.so.1")
+    assert not os.path.lexists(lib / "libunused.so.1")
+    assert report["removed_links"] == ["usr/lib/libunused.so.1"]
+    # Erreichbare Bibliotheken (beide Hardlink-Namen) und fremde Waisen bleiben
+    assert (lib / "liba.so").exists()
+    assert (lib / "libb.so").exists() and (lib / "libb-compat.so").exists()
+    assert os.path.islink(lib / "libgone.so.2")
+
+
+def test_keep_pattern_protects_dlopen_library(rootfs):
+    report = prune_libraries(rootfs, ["usr/bin/*"], keep=["usr/lib/libunused.so.*"], remove=True)
+
+    assert report["unreachable"] == []
+    assert (rootfs / "usr" / "lib" / "libunused.so.1.0").exists()
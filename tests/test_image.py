@@ -0,0 +1,135 @@
+import io
+import os
+import shutil
+import stat
+import subprocess
+
+import pytest
+
+from core.image import build_ext4, ext4_debugfs_commands, write_cpio
+
+
+def _parse_cpio(data):
+    """newc-Archiv -> Liste von (name, felder, daten)"""
+    keys = ("ino", "mode", "uid", "gid", "nlink", "mtime", "size", "devmajor", "devminor", "rmajor", "rminor",
+            "namesize", "check")
+    entries = []
+    pos = 0
+    while True:
+        assert data[pos:pos + 6] == b"070701"
+        fields = dict(zip(keys, (int(data[pos + 6 + i * 8:pos + 14 + i * 8], 16) for i in range(13))))
+        pos += 110
+        name = data[pos:pos + fields["namesize"] - 1].decode()
+        pos += fields["namesize"]
+        pos += -pos % 4
+        body = data[pos:pos + fields["size"]]
+        pos += fields["size"]
+        pos += -pos % 4
+        if name == "TRAILER!!!":
+            assert data[pos:].strip(b"\0") == b""
+            return entries
+        entries.append((name, fields, body))
+
+
+@pytest.fixture
+def rootfs(tmp_path):
+    """Kleiner Baum: Datei mit Hardlink, Symlink, Verzeichnis und ein Device-Platzhalter (reguläre Datei)"""
+    root = tmp_path / "rootfs"
+    (root / "dev").mkdir(parents=True)
+    (root / "usr" / "bin").mkdir(parents=True)
+    (root / "usr" / "bin" / "tool").write_bytes(b"hello")
+    os.link(root / "usr" / "bin" / "tool", root / "usr" / "bin" / "tool-alias")
+    os.symlink("usr/bin", root / "bin")
+    (root / "dev" / "null").write_bytes(b"")
+    for path in (root, root / "dev", root / "usr", root / "usr" / "bin"):
+        os.chmod(path, 0o755)
+    os.chmod(root / "usr" / "bin" / "tool", 0o755)
+    os.chmod(root / "dev" / "null", 0o644)
+    return root
+
+
+def _disk_owners(root):
+    """Owner wie auf der Platte für jeden Eintrag (bei rootless Builds der Benutzer)"""
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, root)
+            entries[rel] = {"path": rel, "uid": st.st_uid, "gid": st.st_gid}
+    return entries
+
+
+def _meta(root):
+    """Soll-Metadaten wie aus der DB: Platzhalter -> char 1:3, setuid und Gruppe 5 für tool"""
+    meta = _disk_owners(root)
+    meta["dev/null"] = {"path": "dev/null", "uid": 0, "gid": 0, "mode": 0o666, "kind": "char", "major": 1, "minor": 3}
+    meta["usr/bin/tool"] = {**meta["usr/bin/tool"], "gid": 5, "mode": 0o4755, "kind": "file"}
+    return meta
+
+
+def test_cpio_newc_output(rootfs):
+    out = io.BytesIO()
+
+    count = write_cpio(rootfs, _meta(rootfs), out)
+
+    entries = _parse_cpio(out.getvalue())
+    assert count == len(entries)
+    names = [name for name, _, _ in entries]
+    assert names == [".", "bin", "dev", "dev/null", "usr", "usr/bin", "usr/bin/tool", "usr/bin/tool-alias"]
+    by_name = {name: (fields, body) for name, fields, body in entries}
+
+    fields, body = by_name["bin"]
+    assert stat.S_ISLNK(fields["mode"]) and body == b"usr/bin"
+
+    fields, _ = by_name["dev/null"]
+    assert fields["mode"] == stat.S_IFCHR | 0o666
+    assert (fields["uid"], fields["gid"]) == (0, 0)
+    assert (fields["rmajor"], fields["rminor"], fields["size"]) == (1, 3, 0)
+
+    fields, body = by_name["usr/bin/tool"]
+    assert fields["mode"] == stat.S_IFREG | 0o4755
+    assert (fields["gid"], fields["nlink"]) == (5, 2)
+    assert body == b"hello"
+
+    # Hardlink: gleiche ino-Nummer, Daten nur einmal
+    alias, _ = by_name["usr/bin/tool-alias"]
+    assert alias["ino"] == fields["ino"] and alias["size"] == 0
+
+    fields, _ = by_name["usr/bin"]
+    assert fields["mode"] == stat.S_IFDIR | 0o755
+
+
+def test_debugfs_commands_only_for_differing_metadata(rootfs):
+    # Metadaten entsprechen dem, was mkfs.ext4 -d aus dem Baum übernimmt: nichts zu tun
+    assert ext4_debugfs_commands(rootfs, _disk_owners(rootfs)) == []
+
+    commands = ext4_debugfs_commands(rootfs, _meta(rootfs))
+
+    tool_gid = [] if os.lstat(rootfs / "usr" / "bin" / "tool").st_gid == 5 else ['sif "/usr/bin/tool" gid 5']
+    # mknod schreibt nur den Dateityp als root:root – Rechte immer, Owner nur wenn nicht root
+    assert commands == [
+        'rm "/dev/null"', 'cd "/dev"', 'mknod "null" c 1 3', "cd /",
+        'sif "/dev/null" mode 020666',
+        'sif "/usr/bin/tool" mode 0104755',
+        *tool_gid,
+    ]
+
+
+def _debugfs_stat(image, path):
+    result = subprocess.run(["debugfs", "-R", f"stat {path}", str(image)], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True, check=True)
+    return result.stdout
+
+
+@pytest.mark.skipif(shutil.which("mkfs.ext4") is None or shutil.which("debugfs") is None,
+                    reason="e2fsprogs nicht installiert")
+def test_ext4_image_has_metadata_from_db(rootfs, tmp_path):
+    image = build_ext4(rootfs, tmp_path / "rootfs.ext4", _meta(rootfs), jobs=1)
+
+    null = _debugfs_stat(image, "/dev/null")
+    assert "Type: character special" in null and "Mode:  0666" in null
+    assert "User:     0   Group:     0" in null
+    assert "Device major/minor number: 01:03" in null
+    tool = _debugfs_stat(image, "/usr/bin/tool")
+    assert "Mode:  04755" in tool and "Group:     5" in tool
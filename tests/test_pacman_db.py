@@ -0,0 +1,132 @@
+import io
+import tarfile
+
+import pytest
+
+from utils.pacman_db import SyncDB, vercmp, parse_dep, version_satisfies
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("1.0", "1.0", 0),
+    ("1.0", "1.0.0", -1),
+    ("1.01", "1.1", 0),              # führende Nullen zählen nicht
+    ("1.10", "1.9", 1),              # numerisch, nicht lexikalisch
+    ("1_0", "1.0", 0),               # Trennerzeichen sind gleichwertig
+    ("1..0", "1.0", 1),              # längerer Trenner gewinnt
+    # Epochen
+    ("1:1.0", "2.0", 1),
+    ("2:1.0", "1:9.0", 1),
+    ("0:1.0", "1.0", 0),
+    # alphabetisch vs. numerisch
+    ("1.0a", "1.0", -1),
+    ("1.0rc1", "1.0", -1),
+    ("1.0alpha", "1.0beta", -1),
+    ("1.0.a", "1.0.1", -1),          # numerische Segmente sind neuer
+    ("a", "1", -1),
+    # ~ ist bei pacman (anders als dpkg) nur ein Trenner
+    ("1.0~rc1", "1.0", 1),
+    # pkgrel
+    ("1.0-10", "1.0-9", 1),
+    ("1.0-1.1", "1.0-1", 1),
+    ("1.0", "1.0-1", 0),             # fehlendes pkgrel vergleicht gleich
+    ("1:1.0-1", "1:1.0-2", -1),
+])
+def test_vercmp(a, b, expected):
+    assert vercmp(a, b) == expected
+    assert vercmp(b, a) == -expected
+
+
+def test_parse_dep_and_constraints():
+    assert parse_dep("glibc>=2.27") == ("glibc", ">=", "2.27")
+    assert parse_dep("python<3.13") == ("python", "<", "3.13")
+    assert parse_dep("libfoo.so=1-64") == ("libfoo.so", "=", "1-64")
+    assert parse_dep("sh: für Skripte") == ("sh", None, None)
+
+    assert version_satisfies("2.40-1", ">=", "2.27")
+    assert version_satisfies("2.27", ">=", "2.27-1")
+    assert not version_satisfies("2.26-5", ">=", "2.27")
+    assert version_satisfies("3.12.7-1", "<", "3.13")
+    assert not version_satisfies("1:3.12", "<", "3.13")
+    assert not version_satisfies("3.13.0-1", "<", "3.13.0-1")
+    # Unversionierte provides erfüllen keine versionierte Abhängigkeit
+    assert version_satisfies(None, None, None)
+    assert not version_satisfies(None, ">=", "1")
+
+
+def _desc(name, version, depends=(), provides=()):
+    fields = {
+        "NAME": [name], "VERSION": [version], "ARCH": ["x86_64"],
+        "FILENAME": [f"{name}-{version}-x86_64.pkg.tar.zst"], "CSIZE": ["100"],
+        "DEPENDS": list(depends), "PROVIDES": list(provides),
+    }
+    return "".join(f"%{key}%\n" + "".join(f"{v}\n" for v in values) + "\n" for key, values in fields.items() if values)
+
+
+def _write_repo(path, packages):
+    with tarfile.open(path, "w:gz") as tar:
+        for pkg in packages:
+            data = _desc(*pkg).encode()
+            member = tarfile.TarInfo(f"{pkg[0]}-{pkg[1]}/desc")
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+
+@pytest.fixture
+def syncdb(tmp_path):
+    sync = tmp_path / "sync"
+    sync.mkdir()
+    _write_repo(sync / "core.db", [
+        ("glibc", "2.40-1"),
+        ("bash", "5.2.037-1", ["glibc>=2.27", "readline>=8.0", "sh"]),
+        ("readline", "8.2.013-1", ["glibc"], ["libreadline.so=8-64"]),
+        ("python", "3.13.0-1", ["glibc"]),
+    ])
+    _write_repo(sync / "extra.db", [
+        # Gleicher Name in einem späteren Repo: core gewinnt
+        ("bash", "5.3-1", ["glibc"]),
+        ("busybox", "1.36.1-2", ["glibc"], ["sh"]),
+        ("dash", "0.5.12-1", ["glibc"], ["sh"]),
+        ("python312", "3.12.7-1", ["glibc"], ["python=3.12.7"]),
+        ("rlwrap", "0.46-1", ["libreadline.so=8-64"]),
+        ("oldtool", "1.0-1", ["python<3.13"]),
+    ])
+    conf = tmp_path / "pacman.conf"
+    conf.write_text("[options]\nArchitecture = auto\n\n[core]\nInclude = /dev/null\n\n[extra]\nInclude = /dev/null\n")
+
+    db = SyncDB(tmp_path / "syncdb.sqlite", sync_dir=sync, pacman_conf=conf)
+    yield db
+    db.close()
+
+
+def test_satisfier_repo_order_and_provides(syncdb):
+    assert syncdb.repos == ["core", "extra"]
+    assert syncdb.satisfier("bash")["repo"] == "core"
+    assert syncdb.satisfier("bash")["version"] == "5.2.037-1"
+
+    # Versionierte provides (so-Namen)
+    assert syncdb.satisfier("libreadline.so=8-64")["name"] == "readline"
+    assert syncdb.satisfier("libreadline.so>=9") is None
+
+    # Bereits gewählte Provider haben Vorrang vor dem ersten Provider in Repo-Reihenfolge
+    dash = syncdb.get("dash")
+    assert syncdb.satisfier("sh", {"dash": dash})["name"] == "dash"
+    assert syncdb.satisfier("sh")["name"] == "busybox"
+
+    # < : der exakte Name (python 3.13) passt nicht, ein Provider mit passender Version schon
+    assert syncdb.satisfier("python<3.13")["name"] == "python312"
+    assert syncdb.satisfier("python>=3.13")["name"] == "python"
+    assert syncdb.satisfier("glibc>=2.41") is None
+
+
+def test_resolve_closure(syncdb):
+    selected, missing = syncdb.resolve(["bash", "rlwrap", "oldtool"])
+
+    assert missing == []
+    assert sorted(selected) == ["bash", "busybox", "glibc", "oldtool", "python312", "readline", "rlwrap"]
+    assert selected["bash"]["repo"] == "core"
+
+    with pytest.raises(RuntimeError, match="glibc>=3"):
+        syncdb.resolve(["glibc>=3"])
+    selected, missing = syncdb.resolve(["glibc>=3", "readline"], ignore_missing=True)
+    assert missing == ["glibc>=3"]
+    assert sorted(selected) == ["glibc", "readline"]
@@ -0,0 +1,166 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+from manager.pacstrapper import RootFSPackageInstaller
+from utils.pacman_db import LocalDB, file_md5
+
+
+def _sync_entry(name, version):
+    return {"name": name, "version": version, "repo": "core", "arch": "x86_64",
+            "filename": f"{name}-{version}-x86_64.pkg.tar.zst", "csize": 100, "sha256": "0" * 64}
+
+
+def _installer(tmp_path, lock_mode, sync):
+    """Installer mit Lockfile unter tmp_path/output; die Auflösung liefert sync (Name -> Version)"""
+    rootfs = tmp_path / "rootfs"
+    rootfs.mkdir(exist_ok=True)
+    installer = RootFSPackageInstaller(rootfs, lock_file=tmp_path / "output" / "packages.lock.json",
+                                       lock_mode=lock_mode)
+    installer.resolve_calls = 0
+
+    def resolve(packages):
+        installer.resolve_calls += 1
+        installer.resolved = {name: _sync_entry(name, version) for name, version in sync.items()}
+        installer.versions = dict(sync)
+        return list(sync)
+
+    installer._resolve_dependencies = resolve
+    return installer
+
+
+def test_auto_resolves_and_leaves_lockfile_alone(tmp_path):
+    installer = _installer(tmp_path, "auto", {"bash": "5.2-1", "glibc": "2.40-1"})
+    assert sorted(installer._resolve_locked(["bash"])) == ["bash", "glibc"]
+    assert installer.resolve_calls == 1
+    assert not installer.locked
+    assert not (tmp_path / "output").exists()
+
+    # Ein (veraltetes) Lockfile wird in auto weder benutzt noch überschrieben
+    _installer(tmp_path, "update", {"bash": "5.1-1", "glibc": "2.39-1"})._resolve_locked(["bash"])
+    before = (tmp_path / "output" / "packages.lock.json").read_text()
+    installer = _installer(tmp_path, "auto", {"bash": "5.2-1", "glibc": "2.40-1"})
+    installer._resolve_locked(["bash"])
+    assert installer.resolve_calls == 1
+    assert installer.versions["bash"] == "5.2-1"
+    assert (tmp_path / "output" / "packages.lock.json").read_text() == before
+
+
+def test_update_writes_lockfile(tmp_path):
+    installer = _installer(tmp_path, "update", {"bash": "5.2-1", "glibc": "2.40-1"})
+    installer._resolve_locked(["bash"])
+
+    lock = json.loads((tmp_path / "output" / "packages.lock.json").read_text())
+    assert lock["requested"] == ["bash"]
+    assert lock["arch"] == "x86_64"
+    assert lock["packages"]["glibc"]["version"] == "2.40-1"
+    assert lock["packages"]["glibc"]["filename"] == "glibc-2.40-1-x86_64.pkg.tar.zst"
+
+
+def test_locked_uses_lockfile_without_resolving(tmp_path):
+    _installer(tmp_path, "update", {"bash": "5.1-1", "glibc": "2.39-1"})._resolve_locked(["bash"])
+
+    installer = _installer(tmp_path, "locked", {"bash": "5.2-1", "glibc": "2.40-1"})
+    assert sorted(installer._resolve_locked(["bash"])) == ["bash", "glibc"]
+    assert installer.resolve_calls == 0
+    assert installer.locked
+    assert installer.versions == {"bash": "5.1-1", "glibc": "2.39-1"}
+    assert installer.resolved["glibc"]["filename"] == "glibc-2.39-1-x86_64.pkg.tar.zst"
+
+
+def test_locked_fails_without_matching_lockfile(tmp_path):
+    with pytest.raises(RuntimeError, match="--locked"):
+        _installer(tmp_path, "locked", {"bash": "5.2-1"})._resolve_locked(["bash"])
+
+    _installer(tmp_path, "update", {"bash": "5.2-1"})._resolve_locked(["bash"])
+    with pytest.raises(RuntimeError, match="--locked"):
+        _installer(tmp_path, "locked", {"bash": "5.2-1"})._resolve_locked(["bash", "nano"])
+
+
+def _package(cache, name, version, files, backup=()):
+    """Minimales pacman-Paket (tar.gz) mit .PKGINFO im Paket-Cache"""
+    pkginfo = f"pkgname = {name}\npkgver = {version}\narch = x86_64\n" + "".join(f"backup = {rel}\n" for rel in backup)
+    path = cache / f"{name}-{version}-x86_64.pkg.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        for rel, data in {".PKGINFO": pkginfo.encode(), **files}.items():
+            member = tarfile.TarInfo(rel)
+            if data is None:
+                member.type, member.mode = tarfile.DIRTYPE, 0o755
+                tar.addfile(member)
+            else:
+                member.size, member.mode = len(data), 0o644
+                tar.addfile(member, io.BytesIO(data))
+    return {"name": name, "version": version, "filename": path.name, "csize": path.stat().st_size}
+
+
+def _install(tmp_path, packages):
+    rootfs = tmp_path / "rootfs"
+    rootfs.mkdir(exist_ok=True)
+    installer = RootFSPackageInstaller(rootfs, jobs=2)
+    installer.pacman_cache = tmp_path / "pkg"
+
+    def resolve(targets):
+        installer.resolved = {pkg["name"]: pkg for pkg in packages}
+        installer.versions = {pkg["name"]: pkg["version"] for pkg in packages}
+        return list(installer.resolved)
+
+    installer._resolve_dependencies = resolve
+    installer.install_packages([packages[0]["name"]])
+    return rootfs
+
+
+def test_upgrade_removes_orphans_and_keeps_modified_backup_files(tmp_path):
+    cache = tmp_path / "pkg"
+    cache.mkdir()
+    v1 = _package(cache, "tool", "1.0-1", {
+        "etc/": None,
+        "etc/tool.conf": b"v1\n",
+        "etc/tool-old.conf": b"old\n",
+        "etc/tool-plain.conf": b"plain\n",
+        "usr/": None, "usr/bin/": None,
+        "usr/bin/tool": b"bin1",
+        "usr/share/": None, "usr/share/tool/": None,
+        "usr/share/tool/old.dat": b"old",
+    }, backup=("etc/tool.conf", "etc/tool-old.conf", "etc/tool-plain.conf"))
+    doc = _package(cache, "tool-doc", "1.0-1", {"usr/": None, "usr/share/": None, "usr/share/doc/": None,
+                                                "usr/share/doc/tool.txt": b"doc"})
+    rootfs = _install(tmp_path, [v1, doc])
+
+    local = LocalDB(rootfs)
+    assert {name: entry["version"] for name, entry in local.packages().items()} == {"tool": "1.0-1", "tool-doc": "1.0-1"}
+    assert local.backup(local.packages()["tool"])["etc/tool.conf"] == file_md5(rootfs / "etc" / "tool.conf")
+
+    # Benutzer ändert Konfigurationsdateien zwischen den Läufen
+    (rootfs / "etc" / "tool.conf").write_bytes(b"user\n")
+    (rootfs / "etc" / "tool-old.conf").write_bytes(b"user-old\n")
+
+    v2 = _package(cache, "tool", "1.1-1", {
+        "etc/": None,
+        "etc/tool.conf": b"v2\n",
+        "usr/": None, "usr/bin/": None,
+        "usr/bin/tool": b"bin2",
+        "usr/lib/": None, "usr/lib/tool/": None,
+        "usr/lib/tool/new.dat": b"new",
+    }, backup=("etc/tool.conf",))
+    _install(tmp_path, [v2])
+
+    local = LocalDB(rootfs)
+    assert {name: entry["version"] for name, entry in local.packages().items()} == {"tool": "1.1-1"}
+    assert (rootfs / "usr" / "bin" / "tool").read_bytes() == b"bin2"
+    assert (rootfs / "usr" / "lib" / "tool" / "new.dat").read_bytes() == b"new"
+
+    # Verwaiste Dateien/Verzeichnisse der alten Version und des entfernten Pakets
+    assert not (rootfs / "usr" / "share" / "tool").exists()
+    assert not (rootfs / "usr" / "share" / "doc").exists()
+    assert not (rootfs / "etc" / "tool-plain.conf").exists()
+
+    # Geänderte backup-Dateien: Benutzer-Version bleibt, neue als .pacnew, entfernte als .pacsave
+    assert (rootfs / "etc" / "tool.conf").read_bytes() == b"user\n"
+    assert (rootfs / "etc" / "tool.conf.pacnew").read_bytes() == b"v2\n"
+    assert (rootfs / "etc" / "tool-old.conf.pacsave").read_bytes() == b"user-old\n"
+    assert not (rootfs / "etc" / "tool-old.conf").exists()
+    assert not list((rootfs / "etc").glob(".*.keep"))
+    # Die DB merkt sich die Paket-Version, damit der nächste Lauf die Änderung wieder erkennt
+    assert local.backup(local.packages()["tool"])["etc/tool.conf"] == file_md5(rootfs / "etc" / "tool.conf.pacnew")
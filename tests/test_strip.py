@@ -0,0 +1,79 @@
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from core import strip
+from core.strip import strip_rootfs
+from utils.elf import ElfFile, host_machine
+
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("gcc") is None or shutil.which("strip") is None or host_machine() is None,
+    reason="gcc/binutils für den Host nicht installiert"
+)
+
+
+def _compile(src_dir, out):
+    src = src_dir / "hello.c"
+    src.write_text("int main(void) { return 0; }\n")
+    subprocess.run(["gcc", "-g", "-o", str(out), str(src)], check=True)
+
+
+def _foreign_elf(src, out, machine: int = 0x1234):
+    """Kopie eines ELF mit unbekannter e_machine (z.B. DSP-Firmware)"""
+    data = bytearray(src.read_bytes())
+    struct.pack_into("<H", data, 18, machine)
+    out.write_bytes(bytes(data))
+
+
+def test_strip_split_writes_debug_file_and_skips_foreign_elf(tmp_path):
+    root = tmp_path / "rootfs"
+    (root / "usr" / "bin").mkdir(parents=True)
+    (root / "lib" / "firmware").mkdir(parents=True)
+
+    binary = root / "usr" / "bin" / "hello"
+    _compile(tmp_path, binary)
+    _foreign_elf(binary, root / "lib" / "firmware" / "dsp.elf")
+    foreign_before = (root / "lib" / "firmware" / "dsp.elf").read_bytes()
+    size_before = binary.stat().st_size
+
+    report = strip_rootfs(root, "split", debug_dir=tmp_path / "debug")
+
+    assert report["files"] == 1
+    assert binary.stat().st_size < size_before
+    with ElfFile(binary) as elf:
+        assert not elf.has_debug()
+    assert subprocess.run([str(binary)]).returncode == 0
+
+    debug_files = list((tmp_path / "debug").rglob("*.debug"))
+    assert len(debug_files) == 1
+    assert "usr/bin/hello" in (tmp_path / "debug" / "index.tsv").read_text()
+
+    # Unbekannte Architektur: unverändert, kein Abbruch, keine halbe Debug-Datei
+    assert (root / "lib" / "firmware" / "dsp.elf").read_bytes() == foreign_before
+
+
+def test_strip_failure_does_not_abort_build(tmp_path, monkeypatch):
+    root = tmp_path / "rootfs"
+    (root / "usr" / "bin").mkdir(parents=True)
+    binary = root / "usr" / "bin" / "hello"
+    _compile(tmp_path, binary)
+    before = binary.read_bytes()
+
+    # objcopy läuft durch, strip scheitert (z.B. kaputte Section-Tabelle)
+    run = strip._run
+
+    def failing_run(cmd):
+        if "objcopy" not in cmd[0]:
+            raise RuntimeError(f"{cmd[0]} fehlgeschlagen")
+        run(cmd)
+
+    monkeypatch.setattr(strip, "_run", failing_run)
+    report = strip_rootfs(root, "split", debug_dir=tmp_path / "debug")
+
+    assert report["files"] == 0
+    assert binary.read_bytes() == before
+    assert not list((tmp_path / "debug").rglob("*.debug"))
+    assert not list(root.rglob(".*.strip-*"))